@@ -731,11 +731,14 @@ class apsw_build_ext(beparent):
                 write("ICU: Unable to determine includes/libraries for ICU using pkg-config or icu-config")
                 write("ICU: You will need to manually edit setup.py or setup.cfg to set them")
 
-        # shell
-        if not os.path.exists("src/shell.c") or \
-               os.path.getmtime("src/shell.c")<os.path.getmtime("tools/shell.py") or \
-               os.path.getmtime(__file__)>os.path.getmtime("src/shell.c"):
-            create_c_file("tools/shell.py", "src/shell.c")
+        # python code compiled into the module
+        for src, dest in (("tools/shell.py", "src/shell.c"), ("tools/pool.py", "src/pool.c"),
+                          ("tools/backups.py", "src/backups.c"), ("tools/blobio.py", "src/blobio.c"),
+                          ("tools/aio.py", "src/aio.c")):
+            if not os.path.exists(dest) or \
+                   os.path.getmtime(dest)<os.path.getmtime(src) or \
+                   os.path.getmtime(__file__)>os.path.getmtime(dest):
+                create_c_file(src, dest)
 
         # done ...
         return v
@@ -881,8 +884,12 @@ depends = [f for f in glob.glob("src/*.[ch]") if f != "src/apsw.c"]
 for f in (findamalgamation(), ):
     if f:
         depends.append(f)
-# we produce a .c file from this
+# we produce .c files from these
 depends.append("tools/shell.py")
+depends.append("tools/pool.py")
+depends.append("tools/backups.py")
+depends.append("tools/blobio.py")
+depends.append("tools/aio.py")
 
 # work out version number
 version = read_whole_file(os.path.join("src", "apswversion.h"), "rt").split()[2].strip('"')
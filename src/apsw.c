@@ -66,6 +66,11 @@ API Reference
 /* system headers */
 #include <assert.h>
 #include <stdarg.h>
+#ifdef _WIN32
+#include <windows.h>
+#else
+#include <time.h>
+#endif
 
 /* Get the version number */
 #include "apswversion.h"
@@ -159,6 +164,9 @@ static PyObject *apswmodule;
 /* cursors */
 #include "cursor.c"
 
+/* prepared statements */
+#include "preparedstatement.c"
+
 /* virtual tables */
 #include "vtable.c"
 
@@ -486,6 +494,55 @@ softheaplimit(APSW_ARGUNUSED PyObject *self, PyObject *args)
   return PyLong_FromLongLong(oldlimit);
 }
 
+/** .. method:: sharedquerycache(maxentries) -> int
+
+  Sets how many queries are kept in the process wide shared query
+  cache, returning the previous setting.  Zero (the default) disables
+  and empties it.
+
+  Each :class:`Connection` has its own :ref:`statement cache
+  <statementcache>` because prepared statements can't be shared
+  between connections.  The work before preparing can be, which is
+  converting the query text to UTF-8, finding where each statement of
+  multi-statement queries starts, and the cache keys.  When you have
+  many connections running the same SQL (eg a pool of connections to
+  the same database) enabling this means that is done once and the
+  memory for it shared instead of once per connection.  The shared
+  cache is emptied when it reaches *maxentries*.
+
+  .. seealso::
+
+    * :meth:`sharedquerycache_stats`
+*/
+static PyObject *
+sharedquerycache(APSW_ARGUNUSED PyObject *self, PyObject *args)
+{
+  Py_ssize_t maxentries, old;
+
+  if (!PyArg_ParseTuple(args, "n:sharedquerycache(maxentries)", &maxentries))
+    return NULL;
+
+  old = sharedquery_setmaxentries(maxentries);
+  if (old < 0)
+    return NULL;
+
+  return PyLong_FromSsize_t(old);
+}
+
+/** .. method:: sharedquerycache_stats() -> dict
+
+  Returns a dict about the :meth:`shared query cache <sharedquerycache>`
+  with keys *hits* and *misses* counting queries looked up since the
+  process started, *queries* and *tails* (statements after the first
+  of multi-statement queries) counting what is currently cached, and
+  *maxentries*.
+*/
+static PyObject *
+sharedquerycache_stats(void)
+{
+  return sharedquery_stats();
+}
+
 /** .. method:: randomness(bytes)  -> data
 
   Gets random data from SQLite's random number generator.
@@ -694,6 +751,7 @@ apsw_test_reset_rng(APSW_ARGUNUSED PyObject *self)
 static PyObject *
 apsw_fini(APSW_ARGUNUSED PyObject *self)
 {
+  sharedquery_setmaxentries(0);
   APSWBuffer_fini();
   Py_XDECREF(tls_errmsg);
 
@@ -1239,6 +1297,10 @@ static PyMethodDef module_methods[] = {
      "Sets soft limit on SQLite memory usage"},
     {"releasememory", (PyCFunction)releasememory, METH_VARARGS,
      "Attempts to free specified amount of memory"},
+    {"sharedquerycache", (PyCFunction)sharedquerycache, METH_VARARGS,
+     "Sets size of the query cache shared by all connections"},
+    {"sharedquerycache_stats", (PyCFunction)sharedquerycache_stats, METH_NOARGS,
+     "Statistics about the query cache shared by all connections"},
     {"randomness", (PyCFunction)randomness, METH_VARARGS,
      "Obtains random bytes"},
     {"exceptionfor", (PyCFunction)getapswexceptionfor, METH_O,
@@ -1260,7 +1322,7 @@ static PyMethodDef module_methods[] = {
     {0, 0, 0, 0} /* Sentinel */
 };
 
-static void add_shell(PyObject *module);
+static void add_python(PyObject *module);
 
 #if PY_MAJOR_VERSION >= 3
 static struct PyModuleDef apswmoduledef = {
@@ -1298,9 +1360,12 @@ PyInit_apsw(void)
     goto fail;
   }
 
-  if (PyType_Ready(&ConnectionType) < 0 || PyType_Ready(&APSWCursorType) < 0 || PyType_Ready(&ZeroBlobBindType) < 0 || PyType_Ready(&APSWBlobType) < 0 || PyType_Ready(&APSWVFSType) < 0 || PyType_Ready(&APSWVFSFileType) < 0 || PyType_Ready(&APSWURIFilenameType) < 0 || PyType_Ready(&APSWStatementType) < 0 || PyType_Ready(&APSWBufferType) < 0 || PyType_Ready(&FunctionCBInfoType) < 0
+  if (PyType_Ready(&ConnectionType) < 0 || PyType_Ready(&APSWCursorType) < 0 || PyType_Ready(&ZeroBlobBindType) < 0 || PyType_Ready(&APSWBlobType) < 0 || PyType_Ready(&APSWPreparedStatementType) < 0 || PyType_Ready(&APSWVFSType) < 0 || PyType_Ready(&APSWVFSFileType) < 0 || PyType_Ready(&APSWURIFilenameType) < 0 || PyType_Ready(&APSWStatementType) < 0 || PyType_Ready(&APSWBufferType) < 0 || PyType_Ready(&FunctionCBInfoType) < 0
 #ifdef EXPERIMENTAL
       || PyType_Ready(&APSWBackupType) < 0
+#endif
+#if PY_MAJOR_VERSION >= 3
+      || PyType_Ready(&APSWSQLiteMemoryType) < 0
 #endif
   )
     goto fail;
@@ -1335,6 +1400,9 @@ PyInit_apsw(void)
   Py_INCREF(&APSWBackupType);
   PyModule_AddObject(m, "Backup", (PyObject *)&APSWBackupType);
 
+  Py_INCREF(&APSWPreparedStatementType);
+  PyModule_AddObject(m, "PreparedStatement", (PyObject *)&APSWPreparedStatementType);
+
   Py_INCREF(&ZeroBlobBindType);
   PyModule_AddObject(m, "zeroblob", (PyObject *)&ZeroBlobBindType);
 
@@ -1908,7 +1976,7 @@ modules etc. For example::
     assert(thedict == NULL);
   }
 
-  add_shell(m);
+  add_python(m);
 
   PyModule_AddObject(m, "compile_options", get_compile_options());
   PyModule_AddObject(m, "keywords", get_keywords());
@@ -1931,11 +1999,33 @@ fail:
       ;
 }
 
+#ifndef PYPY_VERSION
+/* runs code using globals as its module dict, consuming the reference to code */
 static void
-add_shell(PyObject *apswmodule)
+run_python(PyObject *globals, PyObject *code)
+{
+  PyObject *res = NULL;
+
+  if (code)
+    res = PyRun_StringFlags(PyBytes_AS_STRING(code), Py_file_input, globals, globals, NULL);
+  if (!res)
+    PyErr_Print();
+  assert(res);
+  Py_XDECREF(res);
+  Py_XDECREF(code);
+}
+#endif
+
+/* Adds the shell, connection pool, backup helpers, blob streams and
+   apsw.aio which are written in Python */
+static void
+add_python(PyObject *apswmodule)
 {
 #ifndef PYPY_VERSION
-  PyObject *res = NULL, *maindict = NULL, *apswdict, *msvciscrap = NULL;
+  PyObject *maindict = NULL, *apswdict;
+#if PY_VERSION_HEX >= 0x03050000
+  PyObject *aio, *aiodict;
+#endif
 
   maindict = PyModule_GetDict(PyImport_AddModule("__main__"));
   apswdict = PyModule_GetDict(apswmodule);
@@ -1948,16 +2038,37 @@ add_shell(PyObject *apswmodule)
      into a bytes and use that instead.  The format string is as many
      %s as there are chunks.  It is generated in setup.py.
   */
-  msvciscrap = PyBytes_FromFormat(
+  run_python(apswdict, PyBytes_FromFormat(
 #include "shell.c"
-  );
-  if (msvciscrap)
-    res = PyRun_StringFlags(PyBytes_AS_STRING(msvciscrap), Py_file_input, apswdict, apswdict, NULL);
-  if (!res)
+                           ));
+  run_python(apswdict, PyBytes_FromFormat(
+#include "pool.c"
+                           ));
+  run_python(apswdict, PyBytes_FromFormat(
+#include "backups.c"
+                           ));
+  run_python(apswdict, PyBytes_FromFormat(
+#include "blobio.c"
+                           ));
+
+#if PY_VERSION_HEX >= 0x03050000
+  /* aio is a submodule.  Adding it to sys.modules means import
+     apsw.aio works */
+  aio = PyImport_AddModule("apsw.aio");
+  if (!aio)
+  {
     PyErr_Print();
-  assert(res);
-  Py_XDECREF(res);
-  Py_XDECREF(msvciscrap);
+    return;
+  }
+  aiodict = PyModule_GetDict(aio);
+  PyDict_SetItemString(aiodict, "__builtins__", PyDict_GetItemString(maindict, "__builtins__"));
+  PyDict_SetItemString(aiodict, "apsw", apswmodule);
+  run_python(aiodict, PyBytes_FromFormat(
+#include "aio.c"
+                          ));
+  Py_INCREF(aio);
+  PyModule_AddObject(apswmodule, "aio", aio);
+#endif
 #endif
 }
 
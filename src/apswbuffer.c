@@ -97,10 +97,20 @@ APSWBuffer_fini(void)
 #endif
 #endif
 
+/* Buffers longer than this only have the first and last half of this
+   many bytes hashed */
+#define AB_HASHSAMPLE 256
+
 /* This is the same algorithm as used for Python strings/bytes/buffer.  Note
    they can also use a hash seed which alters the value.  There is no need
    for this hash and strings/bytes etc be the same, but usually they are.  We
-   add an extra 1 to put APSWBuffer into a different hash bucket. */
+   add an extra 1 to put APSWBuffer into a different hash bucket.
+
+   The statement cache uses the remaining text of multi-statement
+   queries as keys, so hashing all of a long script for each of its
+   statements would be quadratic.  Long buffers only have their ends
+   and length hashed, with equality comparison sorting out any
+   collisions. */
 static Py_hash_t
 APSWBuffer_hash(APSWBuffer *self)
 {
@@ -121,6 +131,15 @@ APSWBuffer_hash(APSWBuffer *self)
 
   hash = *p << 7;
 
+  if (len > AB_HASHSAMPLE)
+  {
+    len = AB_HASHSAMPLE / 2;
+    while (--len >= 0)
+      hash = (1000003 * hash) ^ *p++;
+    p = (unsigned char *)self->data + self->length - AB_HASHSAMPLE / 2;
+    len = AB_HASHSAMPLE / 2;
+  }
+
   while (--len >= 0)
     hash = (1000003 * hash) ^ *p++;
 
@@ -51,6 +51,49 @@ round trip via SQL.  All pages are copied including free ones.
 
 The destination database is locked during the copy.  You will get a
 :exc:`ThreadingViolationError` if you attempt to use it.
+
+If another connection changes the source database then SQLite starts
+the copy again from the beginning.
+
+Background backups
+==================
+
+:class:`BackupRunner` does the stepping in a background thread,
+limiting how many bytes per second are copied so a large live
+database can be backed up without hurting the latency of its other
+users.  It reports progress and an estimated time to completion,
+counts restarts, retries busy steps, and can verify the result.
+
+.. autoclass:: apsw.BackupRunner
+     :members:
+
+:class:`BackupScheduler` runs many backups, such as of sharded
+databases, on a fixed number of worker threads with one bytes per
+second limit shared between them.  It reports the status of each
+backup and retries those that fail because a database is busy or
+locked.
+
+.. autoclass:: apsw.BackupScheduler
+     :members:
+
+Incremental backups
+===================
+
+A full backup copies every page each time.  For large databases that
+mostly don't change, :func:`incrementalbackup` keeps a hash of each
+page from the previous run and writes only the changed pages to a new
+delta file in a directory.  :func:`incrementalrestore` rebuilds the
+database from the deltas as of any of the runs::
+
+  # nightly
+  apsw.incrementalbackup("app.db", "/backups/app")
+
+  # restore
+  apsw.incrementalrestore("/backups/app", "restored.db")
+
+.. autofunction:: apsw.incrementalbackup
+
+.. autofunction:: apsw.incrementalrestore
 */
 
 /* we love us some macros */
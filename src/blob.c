@@ -22,6 +22,24 @@ An alternate approach to using blobs is to store the data in files and
 store the filename in the database.  Doing so loses the `ACID
 <https://sqlite.org/transactional.html>`_ properties of SQLite.
 
+Streams
+=======
+
+:func:`blobstream` and :class:`BlobIO` make a :class:`blob` work with
+the Python :mod:`io` module, so code such as
+:func:`shutil.copyfileobj` can be used with large buffered reads and
+writes.  :class:`ChunkedBlobs` stores objects bigger than the maximum
+blob size by spreading them across multiple rows, streaming them in
+and out in chunks.
+
+.. autofunction:: apsw.blobstream
+
+.. autoclass:: apsw.BlobIO
+     :members: blob
+
+.. autoclass:: apsw.ChunkedBlobs
+     :members:
+
 */
 
 /* ZEROBLOB CODE */
@@ -163,6 +181,7 @@ struct APSWBlob
   unsigned inuse;        /* track if we are in use preventing concurrent thread mangling */
   int curoffset;         /* SQLite only supports 32 bit signed int offsets */
   PyObject *weakreflist; /* weak reference tracking */
+  PyObject *viewmemory;  /* memory reused by readview */
 };
 
 typedef struct APSWBlob APSWBlob;
@@ -197,6 +216,7 @@ APSWBlob_init(APSWBlob *self, Connection *connection, sqlite3_blob *blob)
   self->curoffset = 0;
   self->inuse = 0;
   self->weakreflist = NULL;
+  self->viewmemory = NULL;
 }
 
 static int
@@ -240,6 +260,7 @@ APSWBlob_close_internal(APSWBlob *self, int force)
     Connection_remove_dependent(self->connection, (PyObject *)self);
 
   Py_CLEAR(self->connection);
+  Py_CLEAR(self->viewmemory);
 
   if (force == 2)
     PyErr_Restore(err_type, err_value, err_traceback);
@@ -346,6 +367,82 @@ APSWBlob_read(APSWBlob *self, PyObject *args)
   return buffy;
 }
 
+/** .. method:: readview([nbytes]) -> memoryview
+
+  Reads like :meth:`~blob.read` but returns a read only memoryview.
+  The memory is reused by the next call if you no longer have any
+  references to the previous memoryview (or anything using it), so
+  repeatedly reading doesn't allocate a new bytes each time.
+
+  SQLite does not provide access to where the blob is in the database
+  file, and blobs bigger than a page are not contiguous in the file,
+  so the data is still copied from SQLite's page cache (or memory
+  map) once.  Use :meth:`~blob.readinto` to copy into memory you
+  manage.  In Python 2 this returns a string.
+
+  -* sqlite3_blob_read
+*/
+
+static PyObject *
+APSWBlob_readview(APSWBlob *self, PyObject *args)
+{
+#if PY_MAJOR_VERSION < 3
+  return APSWBlob_read(self, args);
+#else
+  int length = -1, res;
+  APSWSQLiteMemory *memory;
+
+  CHECK_USE(NULL);
+  CHECK_BLOB_CLOSED;
+
+  if (!PyArg_ParseTuple(args, "|i:readview(numbytes=remaining)", &length))
+    return NULL;
+
+  if (length < 0 || self->curoffset + length > sqlite3_blob_bytes(self->pBlob))
+    length = sqlite3_blob_bytes(self->pBlob) - self->curoffset;
+
+  /* reuse the memory if nothing else is using it */
+  if (self->viewmemory && Py_REFCNT(self->viewmemory) == 1)
+    memory = (APSWSQLiteMemory *)self->viewmemory;
+  else
+  {
+    memory = PyObject_New(APSWSQLiteMemory, &APSWSQLiteMemoryType);
+    if (!memory)
+      return NULL;
+    memory->data = NULL;
+    memory->size = memory->allocated = 0;
+    memory->readonly = 1;
+    Py_XDECREF(self->viewmemory);
+    self->viewmemory = (PyObject *)memory;
+  }
+
+  if (length > memory->allocated)
+  {
+    void *newdata = sqlite3_realloc(memory->data, length); /* PYSQLITE_CALL not needed */
+    if (!newdata)
+      return PyErr_NoMemory();
+    memory->data = newdata;
+    memory->allocated = length;
+  }
+  memory->size = length;
+
+  if (length)
+  {
+    PYSQLITE_BLOB_CALL(res = sqlite3_blob_read(self->pBlob, memory->data, length, self->curoffset));
+    if (PyErr_Occurred())
+      return NULL;
+    if (res != SQLITE_OK)
+    {
+      SET_EXC(res, self->connection->db);
+      return NULL;
+    }
+    self->curoffset += length;
+  }
+
+  return PyMemoryView_FromObject((PyObject *)memory);
+#endif
+}
+
 /** .. method:: readinto(buffer[, offset=0, length=remaining-buffer]) -> None
 
   Reads from the blob into a buffer you have supplied.  This method is
@@ -743,6 +840,8 @@ static PyMethodDef APSWBlob_methods[] = {
      "Returns length in bytes of the blob"},
     {"read", (PyCFunction)APSWBlob_read, METH_VARARGS,
      "Reads data from the blob"},
+    {"readview", (PyCFunction)APSWBlob_readview, METH_VARARGS,
+     "Reads data from the blob into a reused memoryview"},
     {"readinto", (PyCFunction)APSWBlob_readinto, METH_VARARGS,
      "Reads data from the blob into a provided buffer"},
     {"seek", (PyCFunction)APSWBlob_seek, METH_VARARGS,
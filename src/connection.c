@@ -22,12 +22,57 @@ processes.
 
 /* CALLBACK INFO */
 
+/* A cache of results from a deterministic scalar function keyed by
+   the argument values, also used for the sort keys of key
+   collations.  It is only used while SQLite holds the database
+   mutex, so hits don't need the GIL. */
+typedef struct FunctionMemoEntry
+{
+  struct FunctionMemoEntry *hashnext; /* next entry in the same bucket */
+  struct FunctionMemoEntry *lru_prev; /* more recently used */
+  struct FunctionMemoEntry *lru_next; /* less recently used */
+  unsigned hash;
+  int keylen;
+  int type; /* SQLITE_ type of the result */
+  union
+  {
+    sqlite3_int64 i;
+    double d;
+    int len; /* SQLITE_TEXT and SQLITE_BLOB data follows the key */
+  } u;
+  sqlite3_int64 size; /* bytes counted against the budget */
+} FunctionMemoEntry;  /* followed by the key */
+
+typedef struct FunctionMemo
+{
+  FunctionMemoEntry **buckets;
+  unsigned nbuckets; /* always a power of two */
+  FunctionMemoEntry *mru, *lru;
+  unsigned numentries, maxentries;
+  sqlite3_int64 numbytes, maxbytes; /* maxbytes is zero for no limit */
+  unsigned char *key;               /* key of the current call */
+  int keysize;                      /* allocated size of key */
+  int busy;                         /* the function is running so key is in use */
+  FunctionMemoEntry *pinned;        /* entry that mustn't be evicted */
+  /* statistics - see Connection.memoize_stats */
+  sqlite3_uint64 st_hits, st_misses, st_evictions;
+} FunctionMemo;
+
+static void functionmemo_free(FunctionMemo *memo);
+
 /* details of a registered function passed as user data to sqlite3_create_function */
 typedef struct FunctionCBInfo
 {
   PyObject_HEAD char *name;   /* utf8 function name */
   PyObject *scalarfunc;       /* the function to call for stepping */
   PyObject *aggregatefactory; /* factory for aggregate functions */
+  int batch;                  /* scalarfunc takes sequences of values */
+  FunctionMemo *memo;         /* results cache if memoizing */
+  PyObject *argtuple;         /* argument tuple of None kept for reuse by the next call */
+  char *argtypes;             /* declared SQLITE_ type of each argument, 0 for any */
+  int returntype;             /* declared SQLITE_ type of the result, 0 for any */
+  struct Connection *connection; /* not a counted reference - set when memoizing */
+  PyObject *memokey;          /* key in connection->memofunctions */
 } FunctionCBInfo;
 
 /* a particular aggregate function instance used as sqlite3_aggregate_context */
@@ -38,6 +83,17 @@ typedef struct _aggregatefunctioncontext
   PyObject *finalfunc; /* final function */
 } aggregatefunctioncontext;
 
+/* a particular window function instance used as sqlite3_aggregate_context */
+typedef struct _windowfunctioncontext
+{
+  int state;             /* WINDOW_ values */
+  PyObject *aggvalue;    /* first parameter of each function, NULL if they are methods */
+  PyObject *stepfunc;    /* step function */
+  PyObject *finalfunc;   /* final function */
+  PyObject *valuefunc;   /* value function */
+  PyObject *inversefunc; /* inverse function */
+} windowfunctioncontext;
+
 /* CONNECTION TYPE */
 
 struct Connection
@@ -70,10 +126,24 @@ struct Connection
   /* used for nested with (contextmanager) statements */
   long savepointlevel;
 
+  /* convert result rows with the GIL released once per row not per column */
+  int rowfastpath;
+
   /* informational attributes */
   PyObject *open_flags;
   PyObject *open_vfs;
 
+  /* database name to memoryview of contents SQLite is using directly
+     after deserialize without copying */
+  PyObject *deserialized;
+
+  /* (name, numargs) to FunctionCBInfo of memoizing scalar functions */
+  PyObject *memofunctions;
+
+  /* case folded name to numargs of scalar functions that also
+     registered a batch table valued function */
+  PyObject *batchmodules;
+
   /* weak reference support */
   PyObject *weakreflist;
 };
@@ -108,6 +178,10 @@ static PyTypeObject APSWCursorType;
 struct ZeroBlobBind;
 static PyTypeObject ZeroBlobBindType;
 
+struct APSWPreparedStatement;
+static int APSWPreparedStatement_init(struct APSWPreparedStatement *self, Connection *connection, PyObject *query);
+static PyTypeObject APSWPreparedStatementType;
+
 static void
 FunctionCBInfo_dealloc(FunctionCBInfo *self)
 {
@@ -115,6 +189,12 @@ FunctionCBInfo_dealloc(FunctionCBInfo *self)
     PyMem_Free(self->name);
   Py_CLEAR(self->scalarfunc);
   Py_CLEAR(self->aggregatefactory);
+  if (self->memo)
+    functionmemo_free(self->memo);
+  Py_CLEAR(self->argtuple);
+  if (self->argtypes)
+    PyMem_Free(self->argtypes);
+  Py_CLEAR(self->memokey);
   Py_TYPE(self)->tp_free((PyObject *)self);
 }
 
@@ -144,6 +224,9 @@ Connection_internal_cleanup(Connection *self)
   Py_CLEAR(self->vfs);
   Py_CLEAR(self->open_flags);
   Py_CLEAR(self->open_vfs);
+  Py_CLEAR(self->deserialized);
+  Py_CLEAR(self->memofunctions);
+  Py_CLEAR(self->batchmodules);
 }
 
 static int
@@ -331,15 +414,19 @@ Connection_new(PyTypeObject *type, APSW_ARGUNUSED PyObject *args, APSW_ARGUNUSED
     self->rowtrace = 0;
     self->vfs = 0;
     self->savepointlevel = 0;
+    self->rowfastpath = 0;
     self->open_flags = 0;
     self->open_vfs = 0;
+    self->deserialized = 0;
+    self->memofunctions = 0;
+    self->batchmodules = 0;
     self->weakreflist = 0;
   }
 
   return (PyObject *)self;
 }
 
-/** .. method:: __init__(filename, flags=SQLITE_OPEN_READWRITE | SQLITE_OPEN_CREATE, vfs=None, statementcachesize=100)
+/** .. method:: __init__(filename, flags=SQLITE_OPEN_READWRITE | SQLITE_OPEN_CREATE, vfs=None, statementcachesize=100, statementcachebytes=0, statementcachepolicy="lru")
 
   Opens the named database.  You can use ``:memory:`` to get a private temporary
   in-memory database that is not shared with any other connections.
@@ -352,6 +439,25 @@ Connection_new(PyTypeObject *type, APSW_ARGUNUSED PyObject *args, APSW_ARGUNUSED
     or a number larger than the total distinct SQL statements you
     execute frequently.
 
+  :param statementcachebytes: If non-zero then the statement cache
+    also evicts statements to keep the memory they use (SQL text plus
+    what SQLite allocated for the prepared statement) under this many
+    bytes.  Statements bigger than this are never cached.  When zero
+    only statements shorter than 16kb are cached.
+
+  :param statementcachepolicy: Which statement to evict when the cache is full.
+
+    lru
+      The least recently used statement
+    cost
+      Amongst the 16 least recently used statements, the one that was
+      quickest to prepare per byte of memory used
+    arc
+      `Adaptive Replacement Cache
+      <https://en.wikipedia.org/wiki/Adaptive_replacement_cache>`__
+      which keeps statements used more than once from being pushed out
+      by a stream of statements used only once
+
   -* sqlite3_open_v2
 
   .. seealso::
@@ -367,20 +473,38 @@ static int apswvfs_xAccess(sqlite3_vfs *vfs, const char *zName, int flags, int *
 static int
 Connection_init(Connection *self, PyObject *args, PyObject *kwds)
 {
-  static char *kwlist[] = {"filename", "flags", "vfs", "statementcachesize", NULL};
+  static char *kwlist[] = {"filename", "flags", "vfs", "statementcachesize", "statementcachebytes", "statementcachepolicy", NULL};
   PyObject *hooks = NULL, *hook = NULL, *iterator = NULL, *hookargs = NULL, *hookresult = NULL;
   char *filename = NULL;
   int res = 0;
   int flags = SQLITE_OPEN_READWRITE | SQLITE_OPEN_CREATE;
   char *vfs = 0;
   int statementcachesize = 100;
+  Py_ssize_t statementcachebytes = 0;
+  const char *statementcachepolicy = "lru";
+  int policy;
   sqlite3_vfs *vfsused = 0;
 
-  if (!PyArg_ParseTupleAndKeywords(args, kwds, "es|izi:Connection(filename, flags=SQLITE_OPEN_READWRITE|SQLITE_OPEN_CREATE, vfs=None, statementcachesize=100)", kwlist, STRENCODING, &filename, &flags, &vfs, &statementcachesize))
+  if (!PyArg_ParseTupleAndKeywords(args, kwds, "es|izins:Connection(filename, flags=SQLITE_OPEN_READWRITE|SQLITE_OPEN_CREATE, vfs=None, statementcachesize=100, statementcachebytes=0, statementcachepolicy=\"lru\")", kwlist, STRENCODING, &filename, &flags, &vfs, &statementcachesize, &statementcachebytes, &statementcachepolicy))
     return -1;
 
   if (statementcachesize < 0)
     statementcachesize = 0;
+  if (statementcachebytes < 0)
+    statementcachebytes = 0;
+
+  if (!strcmp(statementcachepolicy, "lru"))
+    policy = SC_POLICY_LRU;
+  else if (!strcmp(statementcachepolicy, "cost"))
+    policy = SC_POLICY_COST;
+  else if (!strcmp(statementcachepolicy, "arc"))
+    policy = SC_POLICY_ARC;
+  else
+  {
+    PyErr_Format(PyExc_ValueError, "Unknown statementcachepolicy \"%s\" - expected lru, cost or arc", statementcachepolicy);
+    res = -1;
+    goto finally;
+  }
 
   /* Technically there is a race condition as a vfs of the same name
      could be registered between our find and the open starting.
@@ -424,7 +548,7 @@ Connection_init(Connection *self, PyObject *args, PyObject *kwds)
     goto pyexception;
   }
 
-  self->stmtcache = statementcache_init(self->db, statementcachesize);
+  self->stmtcache = statementcache_init(self->db, statementcachesize, statementcachebytes, policy);
   if (!self->stmtcache)
     goto pyexception;
 
@@ -526,6 +650,182 @@ Connection_blobopen(Connection *self, PyObject *args)
   return (PyObject *)apswblob;
 }
 
+typedef struct
+{
+  sqlite3_int64 rowid;
+  Py_ssize_t index;
+} BlobReadManyRow;
+
+static int
+blobreadmany_cmp(const void *left, const void *right)
+{
+  sqlite3_int64 l = ((const BlobReadManyRow *)left)->rowid, r = ((const BlobReadManyRow *)right)->rowid;
+  return (l < r) ? -1 : (l > r);
+}
+
+/* Reads up to length bytes at offset from each row into consecutive
+   length sized slots of buffer recording how many bytes each got.
+   Rows are visited in rowid order which makes seeking to each one
+   quicker.  Called with the GIL released and db mutex held.  The blob
+   is returned so the caller can close it after getting any error
+   message. */
+static int
+blobreadmany(sqlite3 *db, const char *dbname, const char *table, const char *column, BlobReadManyRow *rows,
+             Py_ssize_t nrows, int offset, int length, char *buffer, int *lengths, sqlite3_blob **blob)
+{
+  Py_ssize_t i, index;
+  int res = SQLITE_OK, size, amount;
+
+  qsort(rows, nrows, sizeof(BlobReadManyRow), blobreadmany_cmp);
+
+  for (i = 0; i < nrows; i++)
+  {
+    index = rows[i].index;
+    if (!*blob)
+      res = sqlite3_blob_open(db, dbname, table, column, rows[i].rowid, 0, blob); /* PYSQLITE_CALL by caller */
+    else if (i == 0 || rows[i].rowid != rows[i - 1].rowid)
+      res = sqlite3_blob_reopen(*blob, rows[i].rowid); /* PYSQLITE_CALL by caller */
+    if (res != SQLITE_OK)
+      break;
+    size = sqlite3_blob_bytes(*blob);
+    amount = (size > offset) ? size - offset : 0;
+    if (amount > length)
+      amount = length;
+    if (amount)
+    {
+      res = sqlite3_blob_read(*blob, buffer + (size_t)index * length, amount, offset); /* PYSQLITE_CALL by caller */
+      if (res != SQLITE_OK)
+        break;
+    }
+    lengths[index] = amount;
+  }
+  return res;
+}
+
+/** .. method:: blob_read_many(table, column, rowids, offset, length, database="main") -> tuple[bytes, list[int]]
+
+   Reads *length* bytes starting at *offset* from the blob in each of
+   the *rowids*, which is quicker than using :meth:`blobopen`
+   and :meth:`blob.reopen` from Python when reading small slices of
+   many blobs.  The rows are visited in rowid order with the GIL
+   released.
+
+   Returns a tuple of bytes and a list of ints.  The bytes is *length*
+   times the number of rowids long, with the slice from each row at
+   that row's position times *length*.  The list has how many bytes
+   were read from each row, which is less than *length* when the blob
+   is shorter than *offset* plus *length*.  Unused space is zero.
+
+   .. code-block:: python
+
+     data, lengths = con.blob_read_many("features", "vector", rowids, 128, 64)
+     # slice for rowids[7]
+     data[7*64:7*64+lengths[7]]
+
+   An exception is raised if a row doesn't exist, or the value isn't
+   a blob or string, as with :meth:`blobopen`.
+
+   -* sqlite3_blob_open sqlite3_blob_reopen sqlite3_blob_read
+*/
+static PyObject *
+Connection_blob_read_many(Connection *self, PyObject *args, PyObject *kwds)
+{
+  static char *kwlist[] = {"table", "column", "rowids", "offset", "length", "database", NULL};
+  const char *dbname = NULL, *tablename = NULL, *column = NULL;
+  PyObject *rowids = NULL, *seq = NULL, *data = NULL, *lengthlist = NULL, *result = NULL;
+  BlobReadManyRow *rows = NULL;
+  int *lengths = NULL;
+  int offset, length, res = SQLITE_OK;
+  Py_ssize_t nrows, i;
+  sqlite3_blob *blob = NULL;
+  char *buffer;
+
+  CHECK_USE(NULL);
+  CHECK_CLOSED(self, NULL);
+
+  if (!PyArg_ParseTupleAndKeywords(args, kwds, "esesOii|es:blob_read_many(table, column, rowids, offset, length, database=\"main\")",
+                                   kwlist, STRENCODING, &tablename, STRENCODING, &column, &rowids, &offset, &length,
+                                   STRENCODING, &dbname))
+    return NULL;
+
+  if (offset < 0 || length < 0)
+  {
+    PyErr_Format(PyExc_ValueError, "offset and length must not be negative");
+    goto finally;
+  }
+
+  seq = PySequence_Fast(rowids, "rowids must be a sequence");
+  if (!seq)
+    goto finally;
+  nrows = PySequence_Fast_GET_SIZE(seq);
+  if (length && nrows > PY_SSIZE_T_MAX / length)
+  {
+    PyErr_Format(PyExc_OverflowError, "Result would be too large");
+    goto finally;
+  }
+
+  rows = PyMem_Malloc(sizeof(BlobReadManyRow) * (nrows ? nrows : 1));
+  lengths = PyMem_Malloc(sizeof(int) * (nrows ? nrows : 1));
+  if (!rows || !lengths)
+  {
+    PyErr_NoMemory();
+    goto finally;
+  }
+  for (i = 0; i < nrows; i++)
+  {
+    PyObject *item = PySequence_Fast_GET_ITEM(seq, i);
+    if (!PyIntLong_Check(item))
+    {
+      PyErr_Format(PyExc_TypeError, "rowids must be integers");
+      goto finally;
+    }
+    rows[i].rowid = PyIntLong_AsLongLong(item);
+    rows[i].index = i;
+    if (PyErr_Occurred())
+      goto finally;
+  }
+
+  data = PyBytes_FromStringAndSize(NULL, nrows * length);
+  if (!data)
+    goto finally;
+  buffer = PyBytes_AS_STRING(data);
+  memset(buffer, 0, nrows * length);
+
+  PYSQLITE_CON_CALL(res = blobreadmany(self->db, dbname ? dbname : "main", tablename, column, rows, nrows, offset, length,
+                                       buffer, lengths, &blob));
+  if (blob)
+    PYSQLITE_VOID_CALL(sqlite3_blob_close(blob));
+  if (res != SQLITE_OK)
+  {
+    SET_EXC(res, self->db);
+    goto finally;
+  }
+
+  lengthlist = PyList_New(nrows);
+  if (!lengthlist)
+    goto finally;
+  for (i = 0; i < nrows; i++)
+  {
+    PyObject *l = PyInt_FromLong(lengths[i]);
+    if (!l)
+      goto finally;
+    PyList_SET_ITEM(lengthlist, i, l);
+  }
+
+  result = Py_BuildValue("(OO)", data, lengthlist);
+
+finally:
+  PyMem_Free((void *)dbname);
+  PyMem_Free((void *)tablename);
+  PyMem_Free((void *)column);
+  PyMem_Free(rows);
+  PyMem_Free(lengths);
+  Py_XDECREF(seq);
+  Py_XDECREF(data);
+  Py_XDECREF(lengthlist);
+  return result;
+}
+
 #ifdef EXPERIMENTAL
 /** .. method:: backup(databasename, sourceconnection, sourcedatabasename)  -> backup
 
@@ -707,6 +1007,175 @@ Connection_cursor(Connection *self)
   return (PyObject *)cursor;
 }
 
+/** .. method:: prepare(statement) -> PreparedStatement
+
+  Prepares a single SQL statement returning a :class:`PreparedStatement`
+  which can be bound, stepped and reset directly, without the
+  overhead of :meth:`Cursor.execute`.
+
+  :param statement: Exactly one SQL statement.
+
+  .. seealso::
+
+     * :ref:`preparedstatements`
+
+  -* sqlite3_prepare_v2
+*/
+static PyObject *
+Connection_prepare(Connection *self, PyObject *args)
+{
+  struct APSWPreparedStatement *stmt = NULL;
+  PyObject *query, *weakref;
+
+  CHECK_USE(NULL);
+  CHECK_CLOSED(self, NULL);
+
+  if (!PyArg_ParseTuple(args, "O:prepare(statement)", &query))
+    return NULL;
+
+  APSW_FAULT_INJECT(PreparedStatementAllocFails, stmt = PyObject_New(struct APSWPreparedStatement, &APSWPreparedStatementType), (PyErr_NoMemory(), stmt = NULL));
+  if (!stmt)
+    return NULL;
+
+  if (APSWPreparedStatement_init(stmt, self, query))
+  {
+    Py_DECREF(stmt);
+    return NULL;
+  }
+
+  weakref = PyWeakref_NewRef((PyObject *)stmt, self->dependent_remove);
+  PyList_Append(self->dependents, weakref);
+  Py_DECREF(weakref);
+
+  return (PyObject *)stmt;
+}
+
+/** .. method:: statementcache_stats() -> dict
+
+  Returns statistics about the :ref:`statement cache <statementcache>`
+  since the connection was opened.  These can be used to choose a
+  *statementcachesize* for :class:`Connection` based on measurements
+  of real workloads.  The keys are:
+
+  .. list-table::
+    :header-rows: 1
+    :widths: auto
+
+    * - Key
+      - Value
+    * - hits
+      - How many times a query was found in the cache
+    * - misses
+      - How many times a query was not found in the cache
+    * - hits_inuse
+      - How many of the hits could not be used because the cached
+        statement was already executing (eg the same query in nested
+        cursors) so it had to be prepared again
+    * - evictions
+      - How many statements were removed from the cache to make space
+    * - recycled
+      - How many times a statement object was reused rather than
+        being allocated
+    * - prepares
+      - How many times `sqlite3_prepare
+        <https://sqlite.org/c3ref/prepare.html>`__ was called
+        (including re-preparing after schema changes)
+    * - prepare_time
+      - Total seconds spent in sqlite3_prepare
+    * - too_big
+      - How many statements were not cached because their text was
+        too long, or they were bigger than *statementcachebytes*
+    * - size
+      - How many statements are currently in the cache
+    * - maxentries
+      - Maximum number of statements in the cache
+    * - bytes
+      - Memory used by the statements currently in the cache
+    * - maxbytes
+      - The *statementcachebytes* budget, zero for none
+    * - policy
+      - The *statementcachepolicy*
+    * - entries
+      - List of the SQL text of cached statements that are not
+        currently executing, most recently used first.  With the arc
+        policy statements used once are listed before those used more
+        often.
+
+*/
+static PyObject *
+Connection_statementcache_stats(Connection *self)
+{
+  CHECK_USE(NULL);
+  CHECK_CLOSED(self, NULL);
+
+  return statementcache_stats(self->stmtcache);
+}
+
+/** .. method:: memoize_stats() -> dict
+
+  Returns statistics about each scalar function registered with
+  *memoize* in :meth:`~Connection.createscalarfunction`.  The key is a
+  tuple of the function name in lower case (SQLite ignores case in
+  function names) and number of arguments, and the value
+  is a dict with these keys:
+
+  .. list-table::
+    :header-rows: 1
+    :widths: auto
+
+    * - Key
+      - Value
+    * - hits
+      - How many calls used a remembered result
+    * - misses
+      - How many calls ran the function
+    * - evictions
+      - How many results were removed to make space
+    * - size
+      - How many results are currently remembered
+    * - maxentries
+      - The *memoize* limit
+    * - bytes
+      - Memory used by the remembered results
+    * - maxbytes
+      - The *memoizebytes* budget, zero for none
+
+*/
+static PyObject *
+Connection_memoize_stats(Connection *self)
+{
+  PyObject *res, *key, *value;
+  Py_ssize_t pos = 0;
+
+  CHECK_USE(NULL);
+  CHECK_CLOSED(self, NULL);
+
+  res = PyDict_New();
+  if (!res)
+    return NULL;
+  if (self->memofunctions)
+    while (PyDict_Next(self->memofunctions, &pos, &key, &value))
+    {
+      FunctionMemo *memo = ((FunctionCBInfo *)value)->memo;
+      PyObject *stats = Py_BuildValue("{s: K, s: K, s: K, s: I, s: I, s: L, s: L}",
+                                      "hits", (unsigned long long)memo->st_hits,
+                                      "misses", (unsigned long long)memo->st_misses,
+                                      "evictions", (unsigned long long)memo->st_evictions,
+                                      "size", memo->numentries,
+                                      "maxentries", memo->maxentries,
+                                      "bytes", (long long)memo->numbytes,
+                                      "maxbytes", (long long)memo->maxbytes);
+      if (!stats || PyDict_SetItem(res, key, stats))
+      {
+        Py_XDECREF(stats);
+        Py_DECREF(res);
+        return NULL;
+      }
+      Py_DECREF(stats);
+    }
+  return res;
+}
+
 /** .. method:: setbusytimeout(millseconds)
 
   If the database is locked such as when another connection is making
@@ -1682,7 +2151,8 @@ finally:
 }
 
 #ifndef SQLITE_OMIT_DESERIALZE
-/** .. method:: serialize(name: str) -> bytes
+
+/** .. method:: serialize(name: str, copy: bool = True) -> bytes | memoryview
 
    Returns a memory copy of the database. *name* is **"main"** for the
    main database, **"temp"** for the temporary database etc.
@@ -1690,6 +2160,13 @@ finally:
    The memory copy is the same as if the database was backed up to
    disk.
 
+   :param copy: If True (the default) the result is bytes which means
+     SQLite's copy of the database is copied again, briefly needing
+     twice the memory.  If False then a writable memoryview of SQLite's
+     copy is returned, and the memory is freed when the memoryview
+     (and anything using its memory) is released.  This is only
+     supported on Python 3.
+
   If the database name doesn't exist or is empty, then None is
   returned, not an exception (this is SQLite's behaviour).
 
@@ -1701,16 +2178,25 @@ finally:
 
 */
 static PyObject *
-Connection_serialize(Connection *self, PyObject *dbname)
+Connection_serialize(Connection *self, PyObject *args, PyObject *kwds)
 {
-  PyObject *pyres = NULL, *dbnames = NULL;
+  static char *kwlist[] = {"name", "copy", NULL};
+  PyObject *pyres = NULL, *dbnames = NULL, *dbname;
+  const char *name;
   sqlite3_int64 size = 0;
   unsigned char *serialization = NULL;
-  int res = SQLITE_OK;
+  int copy = 1;
+
+  CHECK_USE(NULL);
+  CHECK_CLOSED(self, NULL);
+
+  if (!PyArg_ParseTupleAndKeywords(args, kwds, "O|i:serialize(name, copy=True)", kwlist, &dbname, &copy))
+    return NULL;
 
   dbnames = getutf8string(dbname);
   if (!dbnames)
     goto end;
+  name = PyBytes_AS_STRING(dbnames);
 
   /* sqlite3_serialize does not use the same error pattern as other
   SQLite APIs.  I originally coded this as though error codes/strings
@@ -1718,7 +2204,31 @@ Connection_serialize(Connection *self, PyObject *dbname)
   case so this code can't do anything about errors.  See commit
   history for prior attempt */
 
-  INUSE_CALL(_PYSQLITE_CALL_V(serialization = sqlite3_serialize(self->db, PyBytes_AS_STRING(dbnames), &size, 0)));
+  INUSE_CALL(_PYSQLITE_CALL_V(serialization = sqlite3_serialize(self->db, name, &size, 0)));
+
+#if PY_MAJOR_VERSION >= 3
+  if (serialization && !copy)
+  {
+    APSWSQLiteMemory *memory;
+
+    if (size > PY_SSIZE_T_MAX)
+    {
+      PyErr_Format(PyExc_OverflowError, "Database is too big for a memoryview");
+      goto end;
+    }
+    memory = PyObject_New(APSWSQLiteMemory, &APSWSQLiteMemoryType);
+    if (!memory)
+      goto end;
+    /* memory now owns it */
+    memory->data = serialization;
+    memory->size = memory->allocated = (Py_ssize_t)size;
+    memory->readonly = 0;
+    serialization = NULL;
+    pyres = PyMemoryView_FromObject((PyObject *)memory);
+    Py_DECREF(memory);
+    goto end;
+  }
+#endif
 
   if (serialization)
     pyres = converttobytes(serialization, size);
@@ -1733,6 +2243,136 @@ end:
   Py_RETURN_NONE;
 }
 
+/** .. method:: deserialize(name: str, contents: buffer, readonly: bool = False, resizeable: bool = None, copy: bool = True) -> None
+
+   Replaces the named database with *contents* which is in the same
+   format as a database file, such as returned by :meth:`serialize`.
+   *name* is **"main"** for the main database, or the name of an
+   attached database.  The database is then held in memory.
+
+   :param contents: Any object supporting the buffer protocol such as
+     bytes, bytearray or mmap
+   :param readonly: If True then changes can't be made to the database
+   :param resizeable: If True the database can grow.  The default is
+     True when copying.  It can't be used when not copying.
+   :param copy: If True (the default) then *contents* are copied.  If
+     False then SQLite uses the memory of *contents* directly, so even
+     a multi-gigabyte `mmap
+     <https://docs.python.org/3/library/mmap.html>`__ of a database
+     file is available in milliseconds.  A reference to *contents* is
+     kept until the connection is closed or *name* is deserialized
+     again, and *contents* must be writable unless *readonly* is True.
+     Changes to the database are made directly to *contents*.
+
+   SQLite can't use the contents of a database in `WAL mode
+   <https://sqlite.org/wal.html>`__.  Change the journal mode of the
+   database file first.
+
+   -* sqlite3_deserialize
+*/
+static PyObject *
+Connection_deserialize(Connection *self, PyObject *args, PyObject *kwds)
+{
+  static char *kwlist[] = {"name", "contents", "readonly", "resizeable", "copy", NULL};
+  char *name = NULL;
+  PyObject *contents = NULL, *resizeableobj = Py_None, *view = NULL, *pyname = NULL;
+  Py_buffer *buffer;
+  int readonly = 0, resizeable, copy = 1, res = SQLITE_OK;
+  unsigned flags = 0;
+  unsigned char *data;
+
+  CHECK_USE(NULL);
+  CHECK_CLOSED(self, NULL);
+
+  if (!PyArg_ParseTupleAndKeywords(args, kwds, "esO|iOi:deserialize(name, contents, readonly=False, resizeable=None, copy=True)", kwlist,
+                                   STRENCODING, &name, &contents, &readonly, &resizeableobj, &copy))
+    return NULL;
+
+  resizeable = (resizeableobj == Py_None) ? copy : PyObject_IsTrue(resizeableobj);
+  if (resizeable < 0)
+    goto error;
+  if (resizeable && !copy)
+  {
+    PyErr_Format(PyExc_ValueError, "The database can't be resizeable when contents are not copied");
+    goto error;
+  }
+
+  view = PyMemoryView_FromObject(contents);
+  if (!view)
+    goto error;
+  buffer = PyMemoryView_GET_BUFFER(view);
+  if (!PyBuffer_IsContiguous(buffer, 'C'))
+  {
+    PyErr_Format(PyExc_TypeError, "contents must be contiguous");
+    goto error;
+  }
+
+  if (copy)
+  {
+    /* SQLite frees it, even on failure */
+    data = sqlite3_malloc64(buffer->len ? buffer->len : 1); /* PYSQLITE_CALL not needed - no error message */
+    if (!data)
+    {
+      PyErr_NoMemory();
+      goto error;
+    }
+    /* can be gigabytes */
+    Py_BEGIN_ALLOW_THREADS
+    {
+      memcpy(data, buffer->buf, buffer->len);
+    }
+    Py_END_ALLOW_THREADS;
+    flags = SQLITE_DESERIALIZE_FREEONCLOSE | (resizeable ? SQLITE_DESERIALIZE_RESIZEABLE : 0);
+  }
+  else
+  {
+    if (buffer->readonly && !readonly)
+    {
+      PyErr_Format(PyExc_TypeError, "contents must be writable unless readonly is True or they are copied");
+      goto error;
+    }
+    data = buffer->buf;
+  }
+  if (readonly)
+    flags |= SQLITE_DESERIALIZE_READONLY;
+
+  PYSQLITE_CON_CALL(res = sqlite3_deserialize(self->db, name, data, buffer->len, buffer->len, flags));
+  SET_EXC(res, self->db);
+  if (res != SQLITE_OK)
+    goto error;
+
+  /* track contents SQLite is now using, forgetting any previous ones
+     as SQLite no longer uses them */
+  pyname = convertutf8string(name);
+  if (!pyname)
+    goto error;
+  if (!self->deserialized)
+  {
+    self->deserialized = PyDict_New();
+    if (!self->deserialized)
+      goto error;
+  }
+  if (copy)
+  {
+    if (PyDict_GetItem(self->deserialized, pyname) && PyDict_DelItem(self->deserialized, pyname))
+      goto error;
+  }
+  else if (PyDict_SetItem(self->deserialized, pyname, view))
+    goto error;
+
+  PyMem_Free(name);
+  Py_DECREF(view);
+  Py_DECREF(pyname);
+  Py_RETURN_NONE;
+
+error:
+  assert(PyErr_Occurred());
+  PyMem_Free(name);
+  Py_XDECREF(view);
+  Py_XDECREF(pyname);
+  return NULL;
+}
+
 #endif /* SQLITE_OMIT_DESERIALZE */
 
 #if defined(EXPERIMENTAL) && !defined(SQLITE_OMIT_LOAD_EXTENSION) /* extension loading */
@@ -1887,6 +2527,13 @@ allocfunccbinfo(void)
     res->name = 0;
     res->scalarfunc = 0;
     res->aggregatefactory = 0;
+    res->batch = 0;
+    res->memo = 0;
+    res->argtuple = 0;
+    res->argtypes = 0;
+    res->returntype = 0;
+    res->connection = 0;
+    res->memokey = 0;
   }
   return res;
 }
@@ -2026,6 +2673,65 @@ set_context_result(sqlite3_context *context, PyObject *obj)
   sqlite3_result_error(context, "Bad return type from function callback", -1);
 }
 
+/* converts a python object into a sqlite3_context result, going
+   straight to the declared SQLITE_ type (0 for none) when the object
+   is exactly that type */
+static void
+set_context_result_typed(sqlite3_context *context, PyObject *obj, int type)
+{
+  switch (type)
+  {
+  case SQLITE_INTEGER:
+#if PY_MAJOR_VERSION < 3
+    if (PyInt_CheckExact(obj))
+    {
+      sqlite3_result_int64(context, PyInt_AS_LONG(obj));
+      return;
+    }
+#endif
+    if (PyLong_CheckExact(obj))
+    {
+      sqlite3_result_int64(context, PyLong_AsLongLong(obj));
+      return;
+    }
+    break;
+  case SQLITE_FLOAT:
+    if (PyFloat_CheckExact(obj))
+    {
+      sqlite3_result_double(context, PyFloat_AS_DOUBLE(obj));
+      return;
+    }
+    break;
+#if PY_MAJOR_VERSION >= 3
+  case SQLITE_TEXT:
+    if (PyUnicode_CheckExact(obj))
+    {
+      Py_ssize_t len;
+      const char *data = PyUnicode_AsUTF8AndSize(obj, &len);
+      if (!data)
+      {
+        sqlite3_result_error(context, "Unicode conversions failed", -1);
+        return;
+      }
+      if (len <= APSW_INT32_MAX)
+      {
+        sqlite3_result_text(context, data, len, SQLITE_TRANSIENT);
+        return;
+      }
+    }
+    break;
+#endif
+  case SQLITE_BLOB:
+    if (PyBytes_CheckExact(obj) && PyBytes_GET_SIZE(obj) <= APSW_INT32_MAX)
+    {
+      sqlite3_result_blob(context, PyBytes_AS_STRING(obj), PyBytes_GET_SIZE(obj), SQLITE_TRANSIENT);
+      return;
+    }
+    break;
+  }
+  set_context_result(context, obj);
+}
+
 /* Returns a new reference to a tuple formed from function parameters */
 static PyObject *
 getfunctionargs(sqlite3_context *context, PyObject *firstelement, int argc, sqlite3_value **argv)
@@ -2069,16 +2775,487 @@ error:
   return NULL;
 }
 
-/* dispatches scalar function */
-static void
-cbdispatch_func(sqlite3_context *context, int argc, sqlite3_value **argv)
+/* Converts a function argument to the declared SQLITE_ type (0 for
+   any) letting SQLite do the conversion.  Returns a new reference. */
+static PyObject *
+convert_value_to_pyobject_typed(sqlite3_value *value, int type)
 {
-  PyGILState_STATE gilstate;
-  PyObject *pyargs = NULL;
-  PyObject *retval = NULL;
-  FunctionCBInfo *cbinfo = (FunctionCBInfo *)sqlite3_user_data(context);
+  if (!type || sqlite3_value_type(value) == SQLITE_NULL)
+    return convert_value_to_pyobject(value);
+
+  switch (type)
+  {
+  case SQLITE_INTEGER:
+    return convert_int64_to_pyobject(sqlite3_value_int64(value));
+  case SQLITE_FLOAT:
+    return convert_double_to_pyobject(sqlite3_value_double(value));
+  case SQLITE_TEXT:
+    return convertutf8stringsize((const char *)sqlite3_value_text(value), sqlite3_value_bytes(value));
+  default:
+    assert(type == SQLITE_BLOB);
+    return converttobytes(sqlite3_value_blob(value), sqlite3_value_bytes(value));
+  }
+}
+
+/* Returns a new reference to a tuple formed from scalar function
+   parameters converted to their declared types, reusing the tuple
+   kept from an earlier call when there is one */
+static PyObject *
+getscalarfunctionargs(sqlite3_context *context, FunctionCBInfo *cbinfo, int argc, sqlite3_value **argv)
+{
+  PyObject *pyargs;
+  int i;
+
+  /* something else got hold of it (eg gc.get_objects) so it can't be
+     changed any more */
+  if (cbinfo->argtuple && Py_REFCNT(cbinfo->argtuple) != 1)
+    Py_CLEAR(cbinfo->argtuple);
+
+  if (cbinfo->argtuple && PyTuple_GET_SIZE(cbinfo->argtuple) == argc)
+  {
+    /* we own it until released so recursive calls can't use it */
+    pyargs = cbinfo->argtuple;
+    cbinfo->argtuple = NULL;
+  }
+  else if (!cbinfo->argtypes)
+    return getfunctionargs(context, NULL, argc, argv);
+  else
+  {
+    APSW_FAULT_INJECT(GFAPyTuple_NewFail, pyargs = PyTuple_New(argc), pyargs = PyErr_NoMemory());
+    if (!pyargs)
+    {
+      sqlite3_result_error(context, "PyTuple_New failed", -1);
+      return NULL;
+    }
+  }
+
+  for (i = 0; i < argc; i++)
+  {
+    PyObject *item = convert_value_to_pyobject_typed(argv[i], cbinfo->argtypes ? cbinfo->argtypes[i] : 0);
+    PyObject *old = PyTuple_GET_ITEM(pyargs, i);
+    if (!item)
+    {
+      sqlite3_result_error(context, "convert_value_to_pyobject failed", -1);
+      Py_DECREF(pyargs);
+      return NULL;
+    }
+    PyTuple_SET_ITEM(pyargs, i, item);
+    /* None in a reused tuple, NULL in a new one */
+    Py_XDECREF(old);
+  }
+
+  return pyargs;
+}
+
+/* Done with the arguments from getscalarfunctionargs.  If nothing
+   else kept a reference then the tuple is kept for the next call
+   instead of being freed and allocated again.  Its items are replaced
+   with None so it is always a valid tuple should anything (eg the
+   garbage collector) look at it.  Batch functions replace the items
+   with lists so those aren't reused. */
+static void
+releasescalarfunctionargs(FunctionCBInfo *cbinfo, PyObject *pyargs)
+{
+  Py_ssize_t i;
+
+  if (cbinfo->batch || cbinfo->argtuple || Py_REFCNT(pyargs) != 1)
+  {
+    Py_DECREF(pyargs);
+    return;
+  }
+
+  for (i = 0; i < PyTuple_GET_SIZE(pyargs); i++)
+  {
+    PyObject *item = PyTuple_GET_ITEM(pyargs, i);
+    Py_INCREF(Py_None);
+    PyTuple_SET_ITEM(pyargs, i, Py_None);
+    Py_DECREF(item);
+  }
+
+  /* freeing the items could have run code that made a call */
+  if (cbinfo->argtuple || Py_REFCNT(pyargs) != 1)
+    Py_DECREF(pyargs);
+  else
+    cbinfo->argtuple = pyargs;
+}
+
+/* Returns a new reference to a fast sequence of the results from a
+   batch function, checking there is one per row */
+static PyObject *
+getbatchresults(FunctionCBInfo *cbinfo, PyObject *retval, Py_ssize_t nrows)
+{
+  PyObject *results = PySequence_Fast(retval, "Batch functions must return a sequence");
+  if (results && PySequence_Fast_GET_SIZE(results) != nrows)
+  {
+    PyErr_Format(PyExc_ValueError, "Batch function %s returned %d results for %d rows", cbinfo->name,
+                 (int)PySequence_Fast_GET_SIZE(results), (int)nrows);
+    Py_CLEAR(results);
+  }
+  return results;
+}
+
+/* Keys longer than this aren't memoized */
+#define FUNCTIONMEMO_MAXKEY 65536
+
+static FunctionMemo *
+functionmemo_new(unsigned maxentries, sqlite3_int64 maxbytes)
+{
+  FunctionMemo *memo = malloc(sizeof(FunctionMemo));
+  if (!memo)
+    return NULL;
+  memset(memo, 0, sizeof(FunctionMemo));
+  memo->nbuckets = 64;
+  memo->buckets = calloc(memo->nbuckets, sizeof(FunctionMemoEntry *));
+  if (!memo->buckets)
+  {
+    free(memo);
+    return NULL;
+  }
+  memo->maxentries = maxentries;
+  memo->maxbytes = maxbytes;
+  return memo;
+}
+
+static void
+functionmemo_free(FunctionMemo *memo)
+{
+  FunctionMemoEntry *entry = memo->mru;
+
+  while (entry)
+  {
+    FunctionMemoEntry *next = entry->lru_next;
+    free(entry);
+    entry = next;
+  }
+  free(memo->buckets);
+  free(memo->key);
+  free(memo);
+}
+
+/* makes sure the key can be at least size bytes */
+static int
+functionmemo_keyspace(FunctionMemo *memo, int size)
+{
+  unsigned char *key;
+
+  if (size <= memo->keysize)
+    return 1;
+  if (size > FUNCTIONMEMO_MAXKEY)
+    return 0;
+  key = realloc(memo->key, size * 2);
+  if (!key)
+    return 0;
+  memo->key = key;
+  memo->keysize = size * 2;
+  return 1;
+}
+
+/* Puts the type and value of each argument into memo->key returning
+   its length, or -1 if the arguments can't be memoized */
+static int
+functionmemo_makekey(FunctionMemo *memo, int argc, sqlite3_value **argv)
+{
+  int i, len = 0;
+
+  for (i = 0; i < argc; i++)
+  {
+    int type = sqlite3_value_type(argv[i]), n = 0;
+    const void *data = NULL;
+    sqlite3_int64 ival;
+    double dval;
+
+    switch (type)
+    {
+    case SQLITE_INTEGER:
+      ival = sqlite3_value_int64(argv[i]);
+      data = &ival;
+      n = sizeof(ival);
+      break;
+    case SQLITE_FLOAT:
+      dval = sqlite3_value_double(argv[i]);
+      data = &dval;
+      n = sizeof(dval);
+      break;
+    case SQLITE_TEXT:
+      data = sqlite3_value_text(argv[i]);
+      n = sqlite3_value_bytes(argv[i]);
+      break;
+    case SQLITE_BLOB:
+      data = sqlite3_value_blob(argv[i]);
+      n = sqlite3_value_bytes(argv[i]);
+      break;
+    }
+    /* type, length then the value */
+    if (!functionmemo_keyspace(memo, len + 1 + (int)sizeof(int) + n))
+      return -1;
+    memo->key[len++] = (unsigned char)type;
+    if (type == SQLITE_TEXT || type == SQLITE_BLOB)
+    {
+      memcpy(memo->key + len, &n, sizeof(int));
+      len += sizeof(int);
+    }
+    if (n)
+      memcpy(memo->key + len, data, n);
+    len += n;
+  }
+  return len;
+}
+
+static unsigned
+functionmemo_hash(const unsigned char *key, int len)
+{
+  /* FNV-1a */
+  unsigned hash = 2166136261U;
+  int i;
+
+  for (i = 0; i < len; i++)
+    hash = (hash ^ key[i]) * 16777619U;
+  return hash;
+}
+
+#define FUNCTIONMEMO_KEY(entry) ((unsigned char *)((entry) + 1))
+
+static void
+functionmemo_lru_unlink(FunctionMemo *memo, FunctionMemoEntry *entry)
+{
+  if (entry->lru_prev)
+    entry->lru_prev->lru_next = entry->lru_next;
+  else
+    memo->mru = entry->lru_next;
+  if (entry->lru_next)
+    entry->lru_next->lru_prev = entry->lru_prev;
+  else
+    memo->lru = entry->lru_prev;
+}
+
+static void
+functionmemo_lru_front(FunctionMemo *memo, FunctionMemoEntry *entry)
+{
+  entry->lru_prev = NULL;
+  entry->lru_next = memo->mru;
+  if (memo->mru)
+    memo->mru->lru_prev = entry;
+  memo->mru = entry;
+  if (!memo->lru)
+    memo->lru = entry;
+}
+
+/* returns the entry for the current key, making it most recently used */
+static FunctionMemoEntry *
+functionmemo_lookup(FunctionMemo *memo, int keylen, unsigned hash)
+{
+  FunctionMemoEntry *entry = memo->buckets[hash & (memo->nbuckets - 1)];
+
+  for (; entry; entry = entry->hashnext)
+    if (entry->hash == hash && entry->keylen == keylen && !memcmp(FUNCTIONMEMO_KEY(entry), memo->key, keylen))
+    {
+      if (entry != memo->mru)
+      {
+        functionmemo_lru_unlink(memo, entry);
+        functionmemo_lru_front(memo, entry);
+      }
+      return entry;
+    }
+  return NULL;
+}
+
+static void
+functionmemo_result(sqlite3_context *context, FunctionMemoEntry *entry)
+{
+  switch (entry->type)
+  {
+  case SQLITE_INTEGER:
+    sqlite3_result_int64(context, entry->u.i);
+    break;
+  case SQLITE_FLOAT:
+    sqlite3_result_double(context, entry->u.d);
+    break;
+  case SQLITE_TEXT:
+    sqlite3_result_text(context, (char *)FUNCTIONMEMO_KEY(entry) + entry->keylen, entry->u.len, SQLITE_TRANSIENT);
+    break;
+  case SQLITE_BLOB:
+    sqlite3_result_blob(context, FUNCTIONMEMO_KEY(entry) + entry->keylen, entry->u.len, SQLITE_TRANSIENT);
+    break;
+  default:
+    sqlite3_result_null(context);
+  }
+}
+
+static void
+functionmemo_evict(FunctionMemo *memo)
+{
+  FunctionMemoEntry *entry = memo->lru, **pentry;
+
+  functionmemo_lru_unlink(memo, entry);
+  for (pentry = &memo->buckets[entry->hash & (memo->nbuckets - 1)]; *pentry != entry; pentry = &(*pentry)->hashnext)
+    ;
+  *pentry = entry->hashnext;
+  memo->numentries--;
+  memo->numbytes -= entry->size;
+  memo->st_evictions++;
+  free(entry);
+}
+
+/* doubles the buckets when there are more entries than buckets */
+static void
+functionmemo_grow(FunctionMemo *memo)
+{
+  unsigned nbuckets = memo->nbuckets * 2;
+  FunctionMemoEntry **buckets = calloc(nbuckets, sizeof(FunctionMemoEntry *)), *entry;
+
+  /* not growing only makes the chains longer */
+  if (!buckets)
+    return;
+  for (entry = memo->mru; entry; entry = entry->lru_next)
+  {
+    entry->hashnext = buckets[entry->hash & (nbuckets - 1)];
+    buckets[entry->hash & (nbuckets - 1)] = entry;
+  }
+  free(memo->buckets);
+  memo->buckets = buckets;
+  memo->nbuckets = nbuckets;
+}
+
+/* Remembers a result for the current key, returning the new entry or
+   NULL if it wasn't remembered */
+static FunctionMemoEntry *
+functionmemo_insert(FunctionMemo *memo, int keylen, unsigned hash, int type, sqlite3_int64 ival, double dval,
+                    const char *data, Py_ssize_t len)
+{
+  FunctionMemoEntry *entry;
+  sqlite3_int64 size;
+
+  if (len > APSW_INT32_MAX)
+    return NULL;
+  size = (sqlite3_int64)sizeof(FunctionMemoEntry) + keylen + len;
+  if (memo->maxbytes && size > memo->maxbytes)
+    return NULL;
+  while (memo->lru && memo->lru != memo->pinned &&
+         (memo->numentries >= memo->maxentries || (memo->maxbytes && memo->numbytes + size > memo->maxbytes)))
+    functionmemo_evict(memo);
+
+  entry = malloc((size_t)size);
+  if (!entry)
+    return NULL;
+  entry->hash = hash;
+  entry->keylen = keylen;
+  entry->type = type;
+  entry->size = size;
+  memcpy(FUNCTIONMEMO_KEY(entry), memo->key, keylen);
+  if (type == SQLITE_INTEGER)
+    entry->u.i = ival;
+  else if (type == SQLITE_FLOAT)
+    entry->u.d = dval;
+  else if (type == SQLITE_TEXT || type == SQLITE_BLOB)
+  {
+    entry->u.len = (int)len;
+    memcpy(FUNCTIONMEMO_KEY(entry) + keylen, data, len);
+  }
+  entry->hashnext = memo->buckets[hash & (memo->nbuckets - 1)];
+  memo->buckets[hash & (memo->nbuckets - 1)] = entry;
+  functionmemo_lru_front(memo, entry);
+  memo->numentries++;
+  memo->numbytes += size;
+  if (memo->numentries > memo->nbuckets)
+    functionmemo_grow(memo);
+  return entry;
+}
+
+/* Remembers a function result for the current key.  Only None, int,
+   float, str and bytes results are memoized.  Called with the GIL
+   held. */
+static void
+functionmemo_add(FunctionMemo *memo, int keylen, unsigned hash, PyObject *result)
+{
+  int type;
+  const char *data = NULL;
+  Py_ssize_t len = 0;
+  sqlite3_int64 ival = 0;
+  double dval = 0;
+
+  if (result == Py_None)
+    type = SQLITE_NULL;
+#if PY_MAJOR_VERSION < 3
+  else if (PyInt_CheckExact(result))
+  {
+    type = SQLITE_INTEGER;
+    ival = PyInt_AS_LONG(result);
+  }
+#endif
+  else if (PyLong_CheckExact(result))
+  {
+    type = SQLITE_INTEGER;
+    ival = PyLong_AsLongLong(result);
+    if (ival == -1 && PyErr_Occurred())
+    {
+      PyErr_Clear();
+      return;
+    }
+  }
+  else if (PyFloat_CheckExact(result))
+  {
+    type = SQLITE_FLOAT;
+    dval = PyFloat_AS_DOUBLE(result);
+  }
+#if PY_MAJOR_VERSION >= 3
+  else if (PyUnicode_CheckExact(result))
+  {
+    type = SQLITE_TEXT;
+    data = PyUnicode_AsUTF8AndSize(result, &len);
+    if (!data)
+    {
+      PyErr_Clear();
+      return;
+    }
+  }
+  else if (PyBytes_CheckExact(result))
+  {
+    type = SQLITE_BLOB;
+    data = PyBytes_AS_STRING(result);
+    len = PyBytes_GET_SIZE(result);
+  }
+#endif
+  else
+    return;
+
+  functionmemo_insert(memo, keylen, hash, type, ival, dval, data, len);
+}
+
+/* dispatches scalar function */
+static void
+cbdispatch_func(sqlite3_context *context, int argc, sqlite3_value **argv)
+{
+  PyGILState_STATE gilstate;
+  PyObject *pyargs = NULL;
+  PyObject *retval = NULL;
+  int i;
+  FunctionCBInfo *cbinfo = (FunctionCBInfo *)sqlite3_user_data(context);
+  FunctionMemo *memo = NULL;
+  int keylen = -1;
+  unsigned hash = 0;
   assert(cbinfo);
 
+  /* a recursive call can't use the memo since the key is in use */
+  if (cbinfo->memo && !cbinfo->memo->busy)
+  {
+    memo = cbinfo->memo;
+    keylen = functionmemo_makekey(memo, argc, argv);
+    if (keylen >= 0)
+    {
+      FunctionMemoEntry *entry;
+      hash = functionmemo_hash(memo->key, keylen);
+      entry = functionmemo_lookup(memo, keylen, hash);
+      if (entry)
+      {
+        memo->st_hits++;
+        functionmemo_result(context, entry);
+        return;
+      }
+    }
+    memo->st_misses++;
+    memo->busy = 1;
+  }
+
   gilstate = PyGILState_Ensure();
 
   assert(cbinfo->scalarfunc);
@@ -2092,14 +3269,41 @@ cbdispatch_func(sqlite3_context *context, int argc, sqlite3_value **argv)
     goto finalfinally;
   }
 
-  pyargs = getfunctionargs(context, NULL, argc, argv);
+  pyargs = getscalarfunctionargs(context, cbinfo, argc, argv);
   if (!pyargs)
     goto finally;
 
+  if (cbinfo->batch)
+  {
+    /* a batch of one row - each argument becomes a list of one item */
+    for (i = 0; i < argc; i++)
+    {
+      PyObject *list = PyList_New(1);
+      if (!list)
+        goto finally;
+      PyList_SET_ITEM(list, 0, PyTuple_GET_ITEM(pyargs, i));
+      PyTuple_SET_ITEM(pyargs, i, list);
+    }
+  }
+
   assert(!PyErr_Occurred());
   retval = PyEval_CallObject(cbinfo->scalarfunc, pyargs);
+  if (retval && cbinfo->batch)
+  {
+    PyObject *results = getbatchresults(cbinfo, retval, 1);
+    Py_DECREF(retval);
+    retval = NULL;
+    if (results)
+    {
+      retval = PySequence_Fast_GET_ITEM(results, 0);
+      Py_INCREF(retval);
+      Py_DECREF(results);
+    }
+  }
   if (retval)
-    set_context_result(context, retval);
+    set_context_result_typed(context, retval, cbinfo->returntype);
+  if (retval && keylen >= 0 && !PyErr_Occurred())
+    functionmemo_add(memo, keylen, hash, retval);
 
 finally:
   if (PyErr_Occurred())
@@ -2113,8 +3317,11 @@ finally:
     sqlite3_free(errmsg);
   }
 finalfinally:
-  Py_XDECREF(pyargs);
+  if (pyargs)
+    releasescalarfunctionargs(cbinfo, pyargs);
   Py_XDECREF(retval);
+  if (memo)
+    memo->busy = 0;
 
   PyGILState_Release(gilstate);
 }
@@ -2300,45 +3507,868 @@ finally:
   PyGILState_Release(gilstate);
 }
 
-/* Used for the create function v2 xDestroy callbacks.  Note this is
-   called even when supplying NULL for the function implementation (ie
-   deleting it), so XDECREF has to be used.
- */
-static void
-apsw_free_func(void *funcinfo)
-{
-  PyGILState_STATE gilstate;
-  gilstate = PyGILState_Ensure();
+/* Window functions.  The factory returns either a tuple of (object,
+   step, final, value, inverse) with object passed as the first
+   parameter to each function, or an object with step, final, value and
+   inverse methods. */
 
-  Py_XDECREF((PyObject *)funcinfo);
+#define WINDOW_NEW 0   /* factory not called yet */
+#define WINDOW_OK 1    /* functions are valid */
+#define WINDOW_ERROR 2 /* factory failed */
 
-  PyGILState_Release(gilstate);
-}
+/* Returns the window function context, calling the factory the first
+   time.  If state isn't WINDOW_OK there was an exception. */
+static windowfunctioncontext *
+getwindowfunctioncontext(sqlite3_context *context)
+{
+  windowfunctioncontext *winfc = sqlite3_aggregate_context(context, sizeof(windowfunctioncontext));
+  FunctionCBInfo *cbinfo;
+  PyObject *retval;
+  PyObject **funcs[4];
+  static const char *const names[] = {"step", "final", "value", "inverse"};
+  int i;
 
-/** .. method:: createscalarfunction(name, callable[, numargs=-1, deterministic=False])
+  if (!winfc)
+  {
+    PyErr_NoMemory();
+    return NULL;
+  }
+  if (winfc->state != WINDOW_NEW)
+    return winfc;
 
-  Registers a scalar function.  Scalar functions operate on one set of parameters once.
+  winfc->state = WINDOW_ERROR;
+  funcs[0] = &winfc->stepfunc;
+  funcs[1] = &winfc->finalfunc;
+  funcs[2] = &winfc->valuefunc;
+  funcs[3] = &winfc->inversefunc;
 
-  :param name: The string name of the function.  It should be less than 255 characters
-  :param callable: The function that will be called
-  :param numargs: How many arguments the function takes, with -1 meaning any number
-  :param deterministic: When True this means the function always
-           returns the same result for the same input arguments.
-           SQLite's query planner can perform additional optimisations
-           for deterministic functions.  For example a random()
-           function is not deterministic while one that returns the
-           length of a string is.
+  cbinfo = (FunctionCBInfo *)sqlite3_user_data(context);
+  assert(cbinfo);
+  assert(cbinfo->aggregatefactory);
 
-  .. note::
+  retval = PyEval_CallObject(cbinfo->aggregatefactory, NULL);
+  if (!retval)
+    return winfc;
 
-    You can register the same named function but with different
-    *callable* and *numargs*.  For example::
+  if (PyTuple_Check(retval))
+  {
+    if (PyTuple_GET_SIZE(retval) != 5)
+    {
+      PyErr_Format(PyExc_TypeError, "Window function factory should return 5 item tuple of (object, stepfunction, finalfunction, valuefunction, inversefunction)");
+      goto finally;
+    }
+    winfc->aggvalue = PyTuple_GET_ITEM(retval, 0);
+    Py_INCREF(winfc->aggvalue);
+    for (i = 0; i < 4; i++)
+    {
+      *funcs[i] = PyTuple_GET_ITEM(retval, i + 1);
+      Py_INCREF(*funcs[i]);
+    }
+  }
+  else
+    for (i = 0; i < 4; i++)
+    {
+      *funcs[i] = PyObject_GetAttrString(retval, names[i]);
+      if (!*funcs[i])
+        goto finally;
+    }
 
-      connection.createscalarfunction("toip", ipv4convert, 4)
-      connection.createscalarfunction("toip", ipv6convert, 16)
-      connection.createscalarfunction("toip", strconvert, -1)
+  for (i = 0; i < 4; i++)
+    if (!PyCallable_Check(*funcs[i]))
+    {
+      PyErr_Format(PyExc_TypeError, "Window function %s must be callable", names[i]);
+      goto finally;
+    }
 
-    The one with the correct *numargs* will be called and only if that
+  winfc->state = WINDOW_OK;
+
+finally:
+  Py_DECREF(retval);
+  return winfc;
+}
+
+/* sets the result to the current exception */
+static void
+cbwindow_error(sqlite3_context *context, const char *which, int argc)
+{
+  char *errmsg = NULL;
+  char *funname;
+  FunctionCBInfo *cbinfo = (FunctionCBInfo *)sqlite3_user_data(context);
+  assert(cbinfo);
+
+  funname = sqlite3_mprintf("user-defined-window-%s-%s", which, cbinfo->name);
+  sqlite3_result_error_code(context, MakeSqliteMsgFromPyException(&errmsg));
+  sqlite3_result_error(context, errmsg, -1);
+  AddTraceBackHere(__FILE__, __LINE__, funname, "{s: i, s: s}", "NumberOfArguments", argc, "message", errmsg);
+  sqlite3_free(funname);
+  sqlite3_free(errmsg);
+}
+
+/* Calls the step, value or inverse function.  Unlike aggregates an
+   error is returned straight away so the query stops. */
+static void
+cbwindow_call(sqlite3_context *context, const char *which, int argc, sqlite3_value **argv)
+{
+  PyGILState_STATE gilstate;
+  PyObject *pyargs = NULL, *retval = NULL, *func;
+  windowfunctioncontext *winfc;
+
+  gilstate = PyGILState_Ensure();
+
+  if (PyErr_Occurred())
+  {
+    sqlite3_result_error_code(context, MakeSqliteMsgFromPyException(NULL));
+    sqlite3_result_error(context, "Prior Python Error", -1);
+    goto finalfinally;
+  }
+
+  winfc = getwindowfunctioncontext(context);
+  if (!winfc || winfc->state != WINDOW_OK)
+    goto finally;
+
+  func = which[0] == 's' ? winfc->stepfunc : (which[0] == 'v' ? winfc->valuefunc : winfc->inversefunc);
+
+  pyargs = getfunctionargs(context, winfc->aggvalue, argc, argv);
+  if (!pyargs)
+    goto finally;
+
+  retval = PyEval_CallObject(func, pyargs);
+  if (retval && which[0] == 'v')
+    set_context_result(context, retval);
+
+finally:
+  if (PyErr_Occurred())
+    cbwindow_error(context, which, argc);
+  else if (winfc && winfc->state != WINDOW_OK)
+    sqlite3_result_error(context, "Prior Python Error in window function factory", -1);
+
+finalfinally:
+  Py_XDECREF(pyargs);
+  Py_XDECREF(retval);
+  PyGILState_Release(gilstate);
+}
+
+static void
+cbwindow_step(sqlite3_context *context, int argc, sqlite3_value **argv)
+{
+  cbwindow_call(context, "step", argc, argv);
+}
+
+static void
+cbwindow_value(sqlite3_context *context)
+{
+  cbwindow_call(context, "value", 0, NULL);
+}
+
+static void
+cbwindow_inverse(sqlite3_context *context, int argc, sqlite3_value **argv)
+{
+  cbwindow_call(context, "inverse", argc, argv);
+}
+
+/* Gets the final result and releases the objects.  This is also
+   called when the query is abandoned after an error. */
+static void
+cbwindow_final(sqlite3_context *context)
+{
+  PyGILState_STATE gilstate;
+  PyObject *pyargs = NULL, *retval = NULL;
+  windowfunctioncontext *winfc = NULL;
+  PyObject *err_type = NULL, *err_value = NULL, *err_traceback = NULL;
+
+  gilstate = PyGILState_Ensure();
+
+  PyErr_Fetch(&err_type, &err_value, &err_traceback);
+
+  if (err_type || err_value || err_traceback)
+  {
+    sqlite3_result_error(context, "Prior Python Error in window function", -1);
+    /* doesn't allocate so the factory isn't called just to clean up */
+    winfc = sqlite3_aggregate_context(context, 0);
+  }
+  else
+    winfc = getwindowfunctioncontext(context);
+  if (!winfc || winfc->state != WINDOW_OK)
+    goto finally;
+
+  /* final is called even after an error so it can release resources,
+     but then its result is discarded */
+  pyargs = getfunctionargs(context, winfc->aggvalue, 0, NULL);
+  if (!pyargs)
+    goto finally;
+  retval = PyEval_CallObject(winfc->finalfunc, pyargs);
+  if (!(err_type || err_value || err_traceback))
+    set_context_result(context, retval);
+
+finally:
+  if (winfc)
+  {
+    Py_CLEAR(winfc->aggvalue);
+    Py_CLEAR(winfc->stepfunc);
+    Py_CLEAR(winfc->finalfunc);
+    Py_CLEAR(winfc->valuefunc);
+    Py_CLEAR(winfc->inversefunc);
+  }
+  Py_XDECREF(pyargs);
+  Py_XDECREF(retval);
+
+  if (err_type || err_value || err_traceback)
+  {
+    if (PyErr_Occurred())
+    {
+      PyErr_Format(PyExc_Exception, "An exception happened during cleanup of a window function, but there was already an error so only that can be returned");
+      apsw_write_unraiseable(NULL);
+    }
+    PyErr_Restore(err_type, err_value, err_traceback);
+  }
+  else if (PyErr_Occurred())
+    cbwindow_error(context, "final", 0);
+
+  /* sqlite3 frees the actual underlying memory we used (winfc itself) */
+
+  PyGILState_Release(gilstate);
+}
+
+/* Used for the create function v2 xDestroy callbacks.  Note this is
+   called even when supplying NULL for the function implementation (ie
+   deleting it), so XDECREF has to be used.
+ */
+static void
+apsw_free_func(void *funcinfo)
+{
+  PyGILState_STATE gilstate;
+  gilstate = PyGILState_Ensure();
+
+  Py_XDECREF((PyObject *)funcinfo);
+
+  PyGILState_Release(gilstate);
+}
+
+/* Scalar functions also have to be forgotten by memoize_stats once
+   SQLite has replaced or deleted them, or the connection is closing */
+static void
+apsw_free_scalarfunc(void *funcinfo)
+{
+  FunctionCBInfo *cbinfo = (FunctionCBInfo *)funcinfo;
+  PyGILState_STATE gilstate;
+  gilstate = PyGILState_Ensure();
+
+  if (cbinfo && cbinfo->memokey && cbinfo->connection->memofunctions &&
+      PyDict_GetItem(cbinfo->connection->memofunctions, cbinfo->memokey) == (PyObject *)cbinfo)
+  {
+    PyObject *etype, *evalue, *etb;
+
+    /* there can be an exception pending from whatever replaced us */
+    PyErr_Fetch(&etype, &evalue, &etb);
+    if (PyDict_DelItem(cbinfo->connection->memofunctions, cbinfo->memokey))
+      apsw_write_unraiseable(NULL);
+    PyErr_Restore(etype, evalue, etb);
+  }
+  Py_XDECREF((PyObject *)cbinfo);
+
+  PyGILState_Release(gilstate);
+}
+
+/* Batch scalar functions are also registered as an eponymous table
+   valued function of the same name so that the callable can be given
+   many rows at once:
+
+     select key, value from name('select key, arg1, arg2 ... from ...' [, batchsize])
+
+   The inner query is run, and batchsize rows at a time have the
+   argument columns turned into one list per argument for a single
+   call.  The key column is passed through unchanged so results can be
+   joined back.  The inner query runs while the outer sqlite3_step
+   holds the database mutex so no PYSQLITE_CALL is used.
+*/
+
+#define APSW_BATCH_DEFAULT_SIZE 1024
+
+typedef struct
+{
+  sqlite3_vtab base;      /* must be first */
+  sqlite3 *db;            /* database the inner query runs on */
+  FunctionCBInfo *cbinfo; /* reference is owned by the module */
+} apswbatch_vtab;
+
+/* Keys and simple results are kept like this so xColumn doesn't need
+   the GIL and numeric keys don't need memory allocated */
+typedef struct
+{
+  int type; /* SQLITE_ type, or 0 for a result meaning use the Python object */
+  union
+  {
+    sqlite3_int64 i;
+    double d;
+    sqlite3_value *v; /* SQLITE_TEXT and SQLITE_BLOB keys */
+  } u;
+} apswbatch_value;
+
+typedef struct
+{
+  sqlite3_vtab_cursor base;    /* must be first */
+  sqlite3_stmt *stmt;          /* the inner query */
+  int ncols;                   /* columns in the inner query */
+  int batchsize;               /* most rows per call */
+  int done;                    /* inner query has no more rows */
+  apswbatch_value *keys;       /* key column of each row in the batch */
+  apswbatch_value *converted;  /* result of each row in the batch */
+  PyObject *results;           /* fast sequence returned by the callable */
+  int nrows;                   /* rows in the current batch */
+  int row;                     /* current row within the batch */
+  sqlite3_int64 rowid;
+} apswbatch_cursor;
+
+static int
+apswbatch_connect(sqlite3 *db, void *pAux, int argc, const char *const *argv, sqlite3_vtab **ppVtab, char **pzErr)
+{
+  apswbatch_vtab *vtab;
+  int res;
+
+  (void)argc;
+  (void)argv;
+  (void)pzErr;
+
+  res = sqlite3_declare_vtab(db, "CREATE TABLE x(key, value, query HIDDEN, batchsize HIDDEN)");
+  if (res != SQLITE_OK)
+    return res;
+  /* PYSQLITE_CALL not needed - only memory is allocated */
+  vtab = sqlite3_malloc(sizeof(apswbatch_vtab));
+  if (!vtab)
+    return SQLITE_NOMEM;
+  memset(vtab, 0, sizeof(apswbatch_vtab));
+  vtab->db = db;
+  vtab->cbinfo = (FunctionCBInfo *)pAux;
+  *ppVtab = &vtab->base;
+  return SQLITE_OK;
+}
+
+static int
+apswbatch_disconnect(sqlite3_vtab *pVtab)
+{
+  sqlite3_free(pVtab);
+  return SQLITE_OK;
+}
+
+static int
+apswbatch_bestindex(sqlite3_vtab *pVtab, sqlite3_index_info *info)
+{
+  int i, query = -1, batchsize = -1;
+
+  for (i = 0; i < info->nConstraint; i++)
+  {
+    if (info->aConstraint[i].op != SQLITE_INDEX_CONSTRAINT_EQ || info->aConstraint[i].iColumn < 2)
+      continue;
+    /* a plan without the hidden column values can't be used */
+    if (!info->aConstraint[i].usable)
+      return SQLITE_CONSTRAINT;
+    if (info->aConstraint[i].iColumn == 2)
+      query = i;
+    else
+      batchsize = i;
+  }
+  if (query < 0)
+  {
+    sqlite3_free(pVtab->zErrMsg);
+    pVtab->zErrMsg = sqlite3_mprintf("Batch function %s needs the query as its first argument",
+                                     ((apswbatch_vtab *)pVtab)->cbinfo->name);
+    return SQLITE_ERROR;
+  }
+  info->aConstraintUsage[query].argvIndex = 1;
+  info->aConstraintUsage[query].omit = 1;
+  if (batchsize >= 0)
+  {
+    info->aConstraintUsage[batchsize].argvIndex = 2;
+    info->aConstraintUsage[batchsize].omit = 1;
+    info->idxNum = 1;
+  }
+  info->estimatedCost = 1000000;
+  return SQLITE_OK;
+}
+
+static int
+apswbatch_open(sqlite3_vtab *pVtab, sqlite3_vtab_cursor **ppCursor)
+{
+  apswbatch_cursor *cur;
+
+  (void)pVtab;
+  /* PYSQLITE_CALL not needed - only memory is allocated */
+  cur = sqlite3_malloc(sizeof(apswbatch_cursor));
+  if (!cur)
+    return SQLITE_NOMEM;
+  memset(cur, 0, sizeof(apswbatch_cursor));
+  *ppCursor = &cur->base;
+  return SQLITE_OK;
+}
+
+static void
+apswbatch_freevalue(apswbatch_value *value)
+{
+  if (value->type == SQLITE_TEXT || value->type == SQLITE_BLOB)
+    sqlite3_value_free(value->u.v);
+  value->type = SQLITE_NULL;
+}
+
+/* returns 0 if value is a result that needs the Python object */
+static int
+apswbatch_resultvalue(sqlite3_context *context, apswbatch_value *value)
+{
+  switch (value->type)
+  {
+  case SQLITE_NULL:
+    sqlite3_result_null(context);
+    return 1;
+  case SQLITE_INTEGER:
+    sqlite3_result_int64(context, value->u.i);
+    return 1;
+  case SQLITE_FLOAT:
+    sqlite3_result_double(context, value->u.d);
+    return 1;
+  case SQLITE_TEXT:
+  case SQLITE_BLOB:
+    sqlite3_result_value(context, value->u.v);
+    return 1;
+  }
+  return 0;
+}
+
+/* discards the current batch */
+static void
+apswbatch_clearbatch(apswbatch_cursor *cur)
+{
+  int i;
+
+  if (cur->keys)
+    for (i = 0; i < cur->nrows; i++)
+      apswbatch_freevalue(cur->keys + i);
+  if (cur->results)
+  {
+    PyGILState_STATE gilstate = PyGILState_Ensure();
+    Py_CLEAR(cur->results);
+    PyGILState_Release(gilstate);
+  }
+  cur->nrows = cur->row = 0;
+}
+
+static void
+apswbatch_reset(apswbatch_cursor *cur)
+{
+  apswbatch_clearbatch(cur);
+  /* PYSQLITE_CALL not needed - mutex held by enclosing sqlite3_step */
+  sqlite3_finalize(cur->stmt);
+  sqlite3_free(cur->keys);
+  sqlite3_free(cur->converted);
+  cur->stmt = NULL;
+  cur->keys = NULL;
+  cur->converted = NULL;
+  cur->done = 0;
+  cur->rowid = 0;
+}
+
+static int
+apswbatch_close(sqlite3_vtab_cursor *pCursor)
+{
+  apswbatch_reset((apswbatch_cursor *)pCursor);
+  sqlite3_free(pCursor);
+  return SQLITE_OK;
+}
+
+/* Gets the next batch of rows from the inner query and calls the
+   function with them.  The GIL is held for the whole batch so the
+   argument values can be converted as each row is stepped. */
+static int
+apswbatch_fill(apswbatch_cursor *cur)
+{
+  apswbatch_vtab *vtab = (apswbatch_vtab *)cur->base.pVtab;
+  PyGILState_STATE gilstate;
+  PyObject *pyargs = NULL, *retval = NULL;
+  apswbatch_value *key;
+  sqlite3_value *value;
+  int res = SQLITE_OK, i, row;
+
+  apswbatch_clearbatch(cur);
+
+  if (cur->done)
+    return SQLITE_OK;
+
+  gilstate = PyGILState_Ensure();
+
+  if (PyErr_Occurred())
+    goto pyexception;
+
+  pyargs = PyTuple_New(cur->ncols - 1);
+  if (!pyargs)
+    goto pyexception;
+  for (i = 1; i < cur->ncols; i++)
+  {
+    PyObject *list = PyList_New(cur->batchsize);
+    if (!list)
+      goto pyexception;
+    PyTuple_SET_ITEM(pyargs, i - 1, list);
+  }
+
+  while (cur->nrows < cur->batchsize)
+  {
+    /* PYSQLITE_CALL not needed - mutex held by enclosing sqlite3_step */
+    res = sqlite3_step(cur->stmt);
+    if (res == SQLITE_DONE)
+    {
+      cur->done = 1;
+      break;
+    }
+    if (res != SQLITE_ROW)
+    {
+      if (PyErr_Occurred())
+        goto pyexception;
+      sqlite3_free(vtab->base.zErrMsg);
+      /* PYSQLITE_CALL not needed - mutex held by enclosing sqlite3_step */
+      vtab->base.zErrMsg = sqlite3_mprintf("%s", sqlite3_errmsg(vtab->db));
+      goto finally;
+    }
+    key = cur->keys + cur->nrows;
+    /* PYSQLITE_CALL not needed - mutex held by enclosing sqlite3_step */
+    value = sqlite3_column_value(cur->stmt, 0);
+    key->type = sqlite3_value_type(value);
+    if (key->type == SQLITE_INTEGER)
+      key->u.i = sqlite3_value_int64(value);
+    else if (key->type == SQLITE_FLOAT)
+      key->u.d = sqlite3_value_double(value);
+    else if (key->type != SQLITE_NULL)
+    {
+      key->u.v = sqlite3_value_dup(value);
+      if (!key->u.v)
+      {
+        key->type = SQLITE_NULL;
+        PyErr_NoMemory();
+        goto pyexception;
+      }
+    }
+    for (i = 1; i < cur->ncols; i++)
+    {
+      /* PYSQLITE_CALL not needed - mutex held by enclosing sqlite3_step */
+      PyObject *item = convert_value_to_pyobject(sqlite3_column_value(cur->stmt, i));
+      if (!item)
+        goto pyexception;
+      PyList_SET_ITEM(PyTuple_GET_ITEM(pyargs, i - 1), cur->nrows, item);
+    }
+    cur->nrows++;
+  }
+  res = SQLITE_OK;
+
+  if (!cur->nrows)
+    goto finally;
+
+  /* the lists were made for a full batch */
+  if (cur->nrows < cur->batchsize)
+    for (i = 1; i < cur->ncols; i++)
+      if (PyList_SetSlice(PyTuple_GET_ITEM(pyargs, i - 1), cur->nrows, cur->batchsize, NULL))
+        goto pyexception;
+
+  retval = PyEval_CallObject(vtab->cbinfo->scalarfunc, pyargs);
+  if (!retval)
+    goto pyexception;
+  cur->results = getbatchresults(vtab->cbinfo, retval, cur->nrows);
+  if (!cur->results)
+    goto pyexception;
+
+  for (row = 0; row < cur->nrows; row++)
+  {
+    PyObject *item = PySequence_Fast_GET_ITEM(cur->results, row);
+    apswbatch_value *converted = cur->converted + row;
+    converted->type = 0;
+    if (item == Py_None)
+      converted->type = SQLITE_NULL;
+#if PY_MAJOR_VERSION < 3
+    else if (PyInt_CheckExact(item))
+    {
+      converted->type = SQLITE_INTEGER;
+      converted->u.i = PyInt_AS_LONG(item);
+    }
+#endif
+    else if (PyLong_CheckExact(item))
+    {
+      converted->type = SQLITE_INTEGER;
+      converted->u.i = PyLong_AsLongLong(item);
+      if (converted->u.i == -1 && PyErr_Occurred())
+        goto pyexception;
+    }
+    else if (PyFloat_CheckExact(item))
+    {
+      converted->type = SQLITE_FLOAT;
+      converted->u.d = PyFloat_AS_DOUBLE(item);
+    }
+  }
+  goto finally;
+
+pyexception:
+  assert(PyErr_Occurred());
+  /* key of a partially converted row */
+  if (cur->nrows < cur->batchsize)
+    apswbatch_freevalue(cur->keys + cur->nrows);
+  sqlite3_free(vtab->base.zErrMsg);
+  vtab->base.zErrMsg = NULL;
+  res = MakeSqliteMsgFromPyException(&vtab->base.zErrMsg);
+  AddTraceBackHere(__FILE__, __LINE__, "user-defined-batch-function", "{s: s, s: i}", "name", vtab->cbinfo->name,
+                   "rows", cur->nrows);
+
+finally:
+  Py_XDECREF(pyargs);
+  Py_XDECREF(retval);
+  PyGILState_Release(gilstate);
+  return res;
+}
+
+static int
+apswbatch_filter(sqlite3_vtab_cursor *pCursor, int idxNum, const char *idxStr, int argc, sqlite3_value **argv)
+{
+  apswbatch_cursor *cur = (apswbatch_cursor *)pCursor;
+  apswbatch_vtab *vtab = (apswbatch_vtab *)pCursor->pVtab;
+  const char *query;
+  int res;
+
+  (void)idxStr;
+  (void)argc;
+
+  apswbatch_reset(cur);
+
+  query = (const char *)sqlite3_value_text(argv[0]);
+  cur->batchsize = idxNum ? sqlite3_value_int(argv[1]) : APSW_BATCH_DEFAULT_SIZE;
+  sqlite3_free(vtab->base.zErrMsg);
+  vtab->base.zErrMsg = NULL;
+  if (cur->batchsize < 1)
+  {
+    vtab->base.zErrMsg = sqlite3_mprintf("Batch size must be at least 1");
+    return SQLITE_ERROR;
+  }
+
+  /* PYSQLITE_CALL not needed - mutex held by enclosing sqlite3_step */
+  res = query ? sqlite3_prepare_v2(vtab->db, query, -1, &cur->stmt, NULL) : SQLITE_OK;
+  if (res != SQLITE_OK)
+  {
+    /* PYSQLITE_CALL not needed - mutex held by enclosing sqlite3_step */
+    vtab->base.zErrMsg = sqlite3_mprintf("%s", sqlite3_errmsg(vtab->db));
+    return res;
+  }
+  /* PYSQLITE_CALL not needed - mutex held by enclosing sqlite3_step */
+  if (cur->stmt && !sqlite3_stmt_readonly(cur->stmt))
+  {
+    vtab->base.zErrMsg = sqlite3_mprintf("The batch query must not modify the database");
+    return SQLITE_ERROR;
+  }
+  cur->ncols = cur->stmt ? sqlite3_column_count(cur->stmt) : 0;
+  if (cur->ncols < 2)
+  {
+    vtab->base.zErrMsg = sqlite3_mprintf("The batch query must return the key column then one for each argument");
+    return SQLITE_ERROR;
+  }
+
+  /* PYSQLITE_CALL not needed - only memory is allocated */
+  cur->keys = sqlite3_malloc64(sizeof(apswbatch_value) * cur->batchsize);
+  /* PYSQLITE_CALL not needed - only memory is allocated */
+  cur->converted = sqlite3_malloc64(sizeof(apswbatch_value) * cur->batchsize);
+  if (!cur->keys || !cur->converted)
+    return SQLITE_NOMEM;
+  memset(cur->keys, 0, sizeof(apswbatch_value) * cur->batchsize);
+
+  return apswbatch_fill(cur);
+}
+
+static int
+apswbatch_next(sqlite3_vtab_cursor *pCursor)
+{
+  apswbatch_cursor *cur = (apswbatch_cursor *)pCursor;
+
+  cur->rowid++;
+  cur->row++;
+  if (cur->row >= cur->nrows && !cur->done)
+    return apswbatch_fill(cur);
+  return SQLITE_OK;
+}
+
+static int
+apswbatch_eof(sqlite3_vtab_cursor *pCursor)
+{
+  apswbatch_cursor *cur = (apswbatch_cursor *)pCursor;
+  return cur->row >= cur->nrows;
+}
+
+static int
+apswbatch_column(sqlite3_vtab_cursor *pCursor, sqlite3_context *context, int column)
+{
+  apswbatch_cursor *cur = (apswbatch_cursor *)pCursor;
+  PyGILState_STATE gilstate;
+
+  switch (column)
+  {
+  case 0:
+    apswbatch_resultvalue(context, cur->keys + cur->row);
+    break;
+  case 1:
+    if (!apswbatch_resultvalue(context, cur->converted + cur->row))
+    {
+      gilstate = PyGILState_Ensure();
+      set_context_result(context, PySequence_Fast_GET_ITEM(cur->results, cur->row));
+      PyGILState_Release(gilstate);
+    }
+    break;
+  case 2:
+    /* PYSQLITE_CALL not needed - mutex held by enclosing sqlite3_step */
+    sqlite3_result_text(context, sqlite3_sql(cur->stmt), -1, SQLITE_TRANSIENT);
+    break;
+  default:
+    sqlite3_result_int(context, cur->batchsize);
+  }
+  return SQLITE_OK;
+}
+
+static int
+apswbatch_rowid(sqlite3_vtab_cursor *pCursor, sqlite_int64 *pRowid)
+{
+  *pRowid = ((apswbatch_cursor *)pCursor)->rowid;
+  return SQLITE_OK;
+}
+
+/* xCreate is NULL making this an eponymous only virtual table */
+static sqlite3_module apswbatch_module =
+    {
+        1,                    /* version */
+        NULL,                 /* xCreate */
+        apswbatch_connect,    /* xConnect */
+        apswbatch_bestindex,  /* xBestIndex */
+        apswbatch_disconnect, /* xDisconnect */
+        apswbatch_disconnect, /* xDestroy */
+        apswbatch_open,       /* xOpen */
+        apswbatch_close,      /* xClose */
+        apswbatch_filter,     /* xFilter */
+        apswbatch_next,       /* xNext */
+        apswbatch_eof,        /* xEof */
+        apswbatch_column,     /* xColumn */
+        apswbatch_rowid,      /* xRowid */
+        NULL,                 /* xUpdate */
+        NULL,                 /* xBegin */
+        NULL,                 /* xSync */
+        NULL,                 /* xCommit */
+        NULL,                 /* xRollback */
+        NULL,                 /* xFindFunction */
+        NULL};                /* xRename */
+
+/* Returns the SQLITE_ type for a type declared to createscalarfunction,
+   with None giving 0 for any type.  Returns -1 with an exception set
+   for anything else. */
+static int
+getfunctiontype(PyObject *type)
+{
+  if (type == Py_None)
+    return 0;
+#if PY_MAJOR_VERSION < 3
+  if (type == (PyObject *)&PyInt_Type)
+    return SQLITE_INTEGER;
+#endif
+  if (type == (PyObject *)&PyLong_Type)
+    return SQLITE_INTEGER;
+  if (type == (PyObject *)&PyFloat_Type)
+    return SQLITE_FLOAT;
+  if (type == (PyObject *)&PyUnicode_Type)
+    return SQLITE_TEXT;
+  if (type == (PyObject *)&PyBytes_Type)
+    return SQLITE_BLOB;
+  PyErr_Format(PyExc_TypeError, "Function types must be int, float, str, bytes or None");
+  return -1;
+}
+
+/* SQLite function and module names only ignore case for ASCII */
+static PyObject *
+foldfunctionname(const char *name)
+{
+  PyObject *res;
+  size_t i, len = strlen(name);
+  char *folded = PyMem_Malloc(len + 1);
+
+  if (!folded)
+    return PyErr_NoMemory();
+  for (i = 0; i <= len; i++)
+    folded[i] = (name[i] >= 'A' && name[i] <= 'Z') ? name[i] - 'A' + 'a' : name[i];
+  res = convertutf8string(folded);
+  PyMem_Free(folded);
+  return res;
+}
+
+/* The batch table valued function is registered separately so it
+   has to be removed when the scalar function (name, numargs) it
+   belongs to is replaced or deleted */
+static int
+Connection_dropbatchmodule(Connection *self, const char *name, int numargs)
+{
+  PyObject *key, *registered;
+  int res = SQLITE_OK;
+
+  if (!self->batchmodules || !PyDict_Size(self->batchmodules))
+    return 0;
+
+  key = foldfunctionname(name);
+  if (!key)
+    return -1;
+  registered = PyDict_GetItem(self->batchmodules, key);
+  if (registered && PyIntLong_AsLong(registered) == numargs)
+  {
+    PYSQLITE_CON_CALL(res = sqlite3_create_module_v2(self->db, name, NULL, NULL, NULL));
+    SET_EXC(res, self->db);
+    if (res == SQLITE_OK)
+      PyDict_DelItem(self->batchmodules, key);
+  }
+  Py_DECREF(key);
+  return PyErr_Occurred() ? -1 : 0;
+}
+
+/** .. method:: createscalarfunction(name, callable[, numargs=-1, deterministic=False, batch=False, memoize=0, memoizebytes=0, argtypes=None, returntype=None])
+
+  Registers a scalar function.  Scalar functions operate on one set of parameters once.
+
+  :param name: The string name of the function.  It should be less than 255 characters
+  :param callable: The function that will be called
+  :param numargs: How many arguments the function takes, with -1 meaning any number
+  :param deterministic: When True this means the function always
+           returns the same result for the same input arguments.
+           SQLite's query planner can perform additional optimisations
+           for deterministic functions.  For example a random()
+           function is not deterministic while one that returns the
+           length of a string is.
+  :param batch: When True the *callable* is given a sequence of
+           values for each argument, and must return a sequence with
+           one result per row.  See :ref:`batch functions <batchfunctions>`.
+  :param memoize: When non-zero this many results of a *deterministic*
+           function are remembered, and calls with the same arguments
+           as a remembered result use it without calling Python.  The
+           least recently used results are discarded first.  Only
+           None, int, float, str and bytes results are remembered.
+           See :meth:`~Connection.memoize_stats`.
+  :param memoizebytes: When non-zero the memory used by remembered
+           results (including their arguments) is also kept below this.
+  :param argtypes: A sequence of *numargs* types (int, float, str,
+           bytes or None) which each argument is converted to by
+           SQLite before the call, the same as :code:`CAST`.  None
+           leaves that argument unconverted, and SQL NULL is always
+           given as None.  Requires a non-negative *numargs*.
+  :param returntype: The type (int, float, str, or bytes) the
+           function normally returns.  Results of exactly that type
+           are given to SQLite directly, while others are converted
+           as usual.
+
+  Declared argument types mean the function doesn't have to check
+  or convert the values it is given itself.  Each call reuses the
+  argument tuple from the previous call when the function did not
+  keep a reference to it.
+
+  .. note::
+
+    You can register the same named function but with different
+    *callable* and *numargs*.  For example::
+
+      connection.createscalarfunction("toip", ipv4convert, 4)
+      connection.createscalarfunction("toip", ipv6convert, 16)
+      connection.createscalarfunction("toip", strconvert, -1)
+
+    The one with the correct *numargs* will be called and only if that
     doesn't exist then the one with negative *numargs* will be called.
 
   .. seealso::
@@ -2346,26 +4376,66 @@ apsw_free_func(void *funcinfo)
      * :ref:`Example <scalar-example>`
      * :meth:`~Connection.createaggregatefunction`
 
-  -* sqlite3_create_function_v2
+  .. _batchfunctions:
+
+  **Batch functions**
+
+  Calling Python once per row has a fixed overhead that dominates
+  simple functions, and prevents using libraries like `NumPy
+  <https://numpy.org>`__ that work on many values at once.  With
+  *batch* the callable receives one list per argument and returns a
+  sequence of results::
+
+    def scaled(xs, factors):
+        return (numpy.array(xs) * numpy.array(factors)).tolist()
+
+    connection.createscalarfunction("scaled", scaled, 2, batch=True)
+
+  SQLite requires scalar functions to return each result before it
+  moves on to the next row, so when used as a normal function in SQL
+  the lists have only one item.  To process many rows per call, the
+  function is also available as a `table valued function
+  <https://sqlite.org/vtab.html#tabfunc2>`__ of the same name.  It
+  takes a query whose first column is a key and the remaining columns
+  are the arguments, with an optional batch size (default 1024).  The
+  result has a *key* column with the unchanged first column of the
+  query, and a *value* column with the function result::
+
+    select key, value from scaled('select id, price, rate from items', 4096)
+
+    update items set total=b.value from scaled('select id, price, rate from items') as b
+                                    where b.key=items.id
+
+  The query is run within the same connection and must not modify the
+  database.  The table valued function is removed when the scalar
+  function is deleted or replaced by another function with the same
+  name and number of arguments.
+
+  -* sqlite3_create_function_v2 sqlite3_create_module_v2
 */
 
 static PyObject *
 Connection_createscalarfunction(Connection *self, PyObject *args, PyObject *kwargs)
 {
-  static char *kwlist[] = {"name", "callable", "numargs", "deterministic", NULL};
+  static char *kwlist[] = {"name", "callable", "numargs", "deterministic", "batch", "memoize", "memoizebytes",
+                           "argtypes", "returntype", NULL};
   int numargs = -1;
   PyObject *callable = NULL;
-  PyObject *odeterministic = NULL;
-  int deterministic = 0;
+  PyObject *odeterministic = NULL, *obatch = NULL, *oargtypes = NULL, *oreturntype = NULL;
+  int deterministic = 0, batch = 0, memoize = 0, returntype = 0;
+  char *argtypes = NULL;
+  Py_ssize_t memoizebytes = 0;
   char *name = 0;
   FunctionCBInfo *cbinfo;
+  PyObject *memokey = NULL;
   int res;
 
   CHECK_USE(NULL);
   CHECK_CLOSED(self, NULL);
 
-  if (!PyArg_ParseTupleAndKeywords(args, kwargs, "esO|iO!:createscalarfunction(name,callback, numargs=-1, deterministic=False)",
-                                   kwlist, STRENCODING, &name, &callable, &numargs, &PyBool_Type, &odeterministic))
+  if (!PyArg_ParseTupleAndKeywords(args, kwargs, "esO|iO!O!inOO:createscalarfunction(name,callback, numargs=-1, deterministic=False, batch=False, memoize=0, memoizebytes=0, argtypes=None, returntype=None)",
+                                   kwlist, STRENCODING, &name, &callable, &numargs, &PyBool_Type, &odeterministic,
+                                   &PyBool_Type, &obatch, &memoize, &memoizebytes, &oargtypes, &oreturntype))
     return NULL;
 
   assert(name);
@@ -2377,6 +4447,13 @@ Connection_createscalarfunction(Connection *self, PyObject *args, PyObject *kwar
       return NULL;
     deterministic = res;
   }
+  if (obatch)
+  {
+    res = PyObject_IsTrue(obatch);
+    if (res < 0)
+      return NULL;
+    batch = res;
+  }
 
   if (callable != Py_None && !PyCallable_Check(callable))
   {
@@ -2384,6 +4461,80 @@ Connection_createscalarfunction(Connection *self, PyObject *args, PyObject *kwar
     PyErr_SetString(PyExc_TypeError, "parameter must be callable");
     return NULL;
   }
+  if (memoize < 0 || memoizebytes < 0)
+  {
+    PyMem_Free(name);
+    PyErr_SetString(PyExc_ValueError, "memoize and memoizebytes can't be negative");
+    return NULL;
+  }
+  if (memoize && !deterministic)
+  {
+    PyMem_Free(name);
+    PyErr_SetString(PyExc_ValueError, "Only deterministic functions can be memoized");
+    return NULL;
+  }
+  if (oreturntype)
+  {
+    returntype = getfunctiontype(oreturntype);
+    if (returntype < 0)
+    {
+      PyMem_Free(name);
+      return NULL;
+    }
+  }
+  if (oargtypes && oargtypes != Py_None)
+  {
+    PyObject *seq;
+    int i;
+
+    if (numargs < 0)
+    {
+      PyMem_Free(name);
+      PyErr_SetString(PyExc_ValueError, "argtypes requires numargs to be given");
+      return NULL;
+    }
+    seq = PySequence_Fast(oargtypes, "argtypes must be a sequence");
+    if (seq && PySequence_Fast_GET_SIZE(seq) != numargs)
+    {
+      PyErr_Format(PyExc_ValueError, "argtypes has %d items but numargs is %d", (int)PySequence_Fast_GET_SIZE(seq), numargs);
+      Py_CLEAR(seq);
+    }
+    if (seq)
+    {
+      argtypes = PyMem_Malloc(numargs ? numargs : 1);
+      if (!argtypes)
+        PyErr_NoMemory();
+      for (i = 0; argtypes && i < numargs; i++)
+      {
+        int type = getfunctiontype(PySequence_Fast_GET_ITEM(seq, i));
+        if (type < 0)
+        {
+          PyMem_Free(argtypes);
+          argtypes = NULL;
+          break;
+        }
+        argtypes[i] = (char)type;
+      }
+      Py_DECREF(seq);
+    }
+    if (!argtypes)
+    {
+      PyMem_Free(name);
+      return NULL;
+    }
+  }
+
+  if (memoize)
+  {
+    memokey = Py_BuildValue("(Ni)", foldfunctionname(name), numargs);
+    if (!memokey)
+    {
+      PyMem_Free(name);
+      if (argtypes)
+        PyMem_Free(argtypes);
+      return NULL;
+    }
+  }
 
   if (callable == Py_None)
   {
@@ -2396,9 +4547,30 @@ Connection_createscalarfunction(Connection *self, PyObject *args, PyObject *kwar
       goto finally;
     cbinfo->name = name;
     cbinfo->scalarfunc = callable;
+    cbinfo->batch = batch;
+    cbinfo->argtypes = argtypes;
+    argtypes = NULL;
+    cbinfo->returntype = returntype;
     Py_INCREF(callable);
+    if (memoize)
+    {
+      cbinfo->memo = functionmemo_new(memoize, memoizebytes);
+      if (!cbinfo->memo)
+      {
+        Py_DECREF(cbinfo);
+        PyErr_NoMemory();
+        goto finally;
+      }
+      cbinfo->connection = self;
+      cbinfo->memokey = memokey;
+      Py_INCREF(memokey);
+    }
   }
 
+  /* the module gets its own reference, before the function could release ours */
+  if (batch)
+    Py_XINCREF(cbinfo);
+
   PYSQLITE_CON_CALL(
       res = sqlite3_create_function_v2(self->db,
                                        name,
@@ -2408,19 +4580,67 @@ Connection_createscalarfunction(Connection *self, PyObject *args, PyObject *kwar
                                        cbinfo ? cbdispatch_func : NULL,
                                        NULL,
                                        NULL,
-                                       apsw_free_func));
+                                       apsw_free_scalarfunc));
   if (res)
   {
     /* Note: On error sqlite3_create_function_v2 calls the
-	 destructor (apsw_free_func)! */
+	 destructor (apsw_free_scalarfunc)! */
     SET_EXC(res, self->db);
+    if (batch)
+      Py_XDECREF(cbinfo);
     goto finally;
   }
 
+  /* SQLite has replaced any earlier registration, whose destructor
+     removed it from memofunctions */
+  if (cbinfo && cbinfo->memo)
+  {
+    if (!self->memofunctions)
+      self->memofunctions = PyDict_New();
+    if (!self->memofunctions || PyDict_SetItem(self->memofunctions, memokey, (PyObject *)cbinfo))
+      goto finally;
+  }
+
+  if (batch)
+  {
+    PyObject *batchkey, *onumargs = NULL;
+
+    /* a NULL module removes it.  On error the destructor is called */
+    PYSQLITE_CON_CALL(res = sqlite3_create_module_v2(self->db, name, cbinfo ? &apswbatch_module : NULL, cbinfo,
+                                                     cbinfo ? apsw_free_func : NULL));
+    if (res)
+    {
+      SET_EXC(res, self->db);
+      goto finally;
+    }
+    if (!self->batchmodules)
+      self->batchmodules = PyDict_New();
+    if (!self->batchmodules)
+      goto finally;
+    batchkey = foldfunctionname(name);
+    if (batchkey && cbinfo)
+    {
+      onumargs = PyLong_FromLong(numargs);
+      if (onumargs)
+        PyDict_SetItem(self->batchmodules, batchkey, onumargs);
+    }
+    else if (batchkey && PyDict_GetItem(self->batchmodules, batchkey))
+      PyDict_DelItem(self->batchmodules, batchkey);
+    Py_XDECREF(onumargs);
+    Py_XDECREF(batchkey);
+    if (PyErr_Occurred())
+      goto finally;
+  }
+  else if (Connection_dropbatchmodule(self, name, numargs))
+    goto finally;
+
   if (callable == Py_None)
     PyMem_Free(name);
 
 finally:
+  Py_XDECREF(memokey);
+  if (argtypes)
+    PyMem_Free(argtypes);
   if (PyErr_Occurred())
     return NULL;
   Py_RETURN_NONE;
@@ -2523,6 +4743,146 @@ Connection_createaggregatefunction(Connection *self, PyObject *args)
     goto finally;
   }
 
+  Connection_dropbatchmodule(self, name, numargs);
+
+  if (callable == Py_None)
+    PyMem_Free(name);
+
+finally:
+  if (PyErr_Occurred())
+    return NULL;
+  Py_RETURN_NONE;
+}
+
+/** .. method:: createwindowfunction(name, factory[, numargs=-1])
+
+  Registers an aggregate `window function
+  <https://sqlite.org/windowfunctions.html#user_defined_aggregate_window_functions>`__.
+  As rows enter and leave the frame of each row (eg ``OVER (ORDER BY
+  x ROWS BETWEEN 9 PRECEDING AND CURRENT ROW)``) your functions are
+  told about the changes, so the result for each row doesn't have to
+  be calculated from scratch.  They also work as regular aggregate
+  functions.
+
+  :param name: The string name of the function.  It should be less than 255 characters
+  :param factory: Called at the start of each aggregation.  Use :const:`None` to delete the function.
+  :param numargs: How many arguments the function takes, with -1 meaning any number
+
+  The *factory* can return an object with these methods:
+
+    step(*args)
+      Called with the function arguments of a row added to the frame
+
+    inverse(*args)
+      Called with the function arguments of a row that left the
+      frame.  It is always the oldest row added by step still in the
+      frame.
+
+    value()
+      Returns the result for the current frame
+
+    final()
+      Returns the result for the frame and is the last call.  It is
+      always called, even if there was an exception, so resources can
+      be cleaned up.
+
+  Alternatively it can return a tuple of ``(object, stepfunction,
+  finalfunction, valuefunction, inversefunction)`` in the same style as
+  :meth:`~Connection.createaggregatefunction`, where the object is
+  passed as the first parameter to each function.
+
+  .. code-block:: python
+
+    class windowsum:
+        def __init__(self):
+            self.total = 0
+
+        def step(self, value):
+            self.total += value
+
+        def inverse(self, value):
+            self.total -= value
+
+        def value(self):
+            return self.total
+
+        final = value
+
+    connection.createwindowfunction("wsum", windowsum, 1)
+
+    for row in connection.cursor().execute(
+        "select x, wsum(x) over (order by rowid rows between 2 preceding and current row) from t"):
+        print(row)
+
+  .. note::
+
+    You can register the same named function but with different
+    callables and *numargs*.  See
+    :meth:`~Connection.createscalarfunction` for an example.
+
+  -* sqlite3_create_window_function
+*/
+
+static PyObject *
+Connection_createwindowfunction(Connection *self, PyObject *args)
+{
+  int numargs = -1;
+  PyObject *callable;
+  char *name = 0;
+  FunctionCBInfo *cbinfo;
+  int res;
+
+  CHECK_USE(NULL);
+  CHECK_CLOSED(self, NULL);
+
+  if (!PyArg_ParseTuple(args, "esO|i:createwindowfunction(name, factory, numargs=-1)", STRENCODING, &name, &callable, &numargs))
+    return NULL;
+
+  assert(name);
+  assert(callable);
+
+  if (callable != Py_None && !PyCallable_Check(callable))
+  {
+    PyMem_Free(name);
+    PyErr_SetString(PyExc_TypeError, "parameter must be callable");
+    return NULL;
+  }
+
+  if (callable == Py_None)
+    cbinfo = 0;
+  else
+  {
+    cbinfo = allocfunccbinfo();
+    if (!cbinfo)
+      goto finally;
+
+    cbinfo->name = name;
+    cbinfo->aggregatefactory = callable;
+    Py_INCREF(callable);
+  }
+
+  PYSQLITE_CON_CALL(
+      res = sqlite3_create_window_function(self->db,
+                                           name,
+                                           numargs,
+                                           SQLITE_UTF8,
+                                           cbinfo,
+                                           cbinfo ? cbwindow_step : NULL,
+                                           cbinfo ? cbwindow_final : NULL,
+                                           cbinfo ? cbwindow_value : NULL,
+                                           cbinfo ? cbwindow_inverse : NULL,
+                                           apsw_free_func));
+
+  if (res)
+  {
+    /* Note: On error sqlite3_create_window_function calls the
+	 destructor (apsw_free_func)! */
+    SET_EXC(res, self->db);
+    goto finally;
+  }
+
+  Connection_dropbatchmodule(self, name, numargs);
+
   if (callable == Py_None)
     PyMem_Free(name);
 
@@ -2595,7 +4955,149 @@ collation_destroy(void *context)
   PyGILState_Release(gilstate);
 }
 
-/** .. method:: createcollation(name, callback)
+/* Key collations compare sort keys made by a Python function.  The
+   keys are cached by the utf8 of the string so most comparisons don't
+   need Python. */
+typedef struct
+{
+  PyObject *keyfunc;
+  FunctionMemo *cache; /* string to sort key */
+} CollationKeyInfo;
+
+/* Returns a new reference to the bytes sort key for a string */
+static PyObject *
+collation_getkey(CollationKeyInfo *info, const void *data, int len)
+{
+  PyObject *string, *key = NULL, *res = NULL;
+
+  string = convertutf8stringsize(data, len);
+  if (!string)
+    return NULL;
+  key = PyObject_CallFunctionObjArgs(info->keyfunc, string, NULL);
+  if (!key)
+    goto finally;
+  if (PyUnicode_Check(key))
+    res = PyUnicode_AsUTF8String(key);
+  else if (PyBytes_Check(key))
+  {
+    res = key;
+    Py_INCREF(res);
+  }
+  else
+    PyErr_Format(PyExc_TypeError, "Collation key function must return bytes or str");
+
+finally:
+  if (!res)
+    AddTraceBackHere(__FILE__, __LINE__, "Collation_key", "{s: O, s: O}", "callback", info->keyfunc, "string",
+                     string);
+  Py_DECREF(string);
+  Py_XDECREF(key);
+  return res;
+}
+
+static int
+collation_key_cb(void *context,
+                 int stringonelen, const void *stringonedata,
+                 int stringtwolen, const void *stringtwodata)
+{
+  CollationKeyInfo *info = (CollationKeyInfo *)context;
+  FunctionMemo *cache = info->cache;
+  const void *strings[2];
+  int lens[2];
+  const char *keys[2];
+  int keylens[2];
+  PyObject *pykeys[2] = {NULL, NULL};
+  PyGILState_STATE gilstate;
+  int i, usecache, havegil = 0, result = 0;
+
+  strings[0] = stringonedata;
+  lens[0] = stringonelen;
+  strings[1] = stringtwodata;
+  lens[1] = stringtwolen;
+
+  /* a recursive call from the key function can't use the cache, and
+     mustn't unpin the entry the outer call is still using */
+  usecache = !cache->busy;
+  if (usecache)
+    cache->pinned = NULL;
+
+  for (i = 0; i < 2; i++)
+  {
+    FunctionMemoEntry *entry = NULL;
+    unsigned hash = 0;
+    int cachethis = usecache && functionmemo_keyspace(cache, lens[i]);
+
+    if (cachethis)
+    {
+      memcpy(cache->key, strings[i], lens[i]);
+      hash = functionmemo_hash(cache->key, lens[i]);
+      entry = functionmemo_lookup(cache, lens[i], hash);
+      if (entry)
+        cache->st_hits++;
+      else
+        cache->st_misses++;
+    }
+
+    if (!entry)
+    {
+      if (!havegil)
+      {
+        gilstate = PyGILState_Ensure();
+        havegil = 1;
+        if (PyErr_Occurred())
+          goto finally; /* outstanding error */
+      }
+      if (cachethis)
+        cache->busy = 1;
+      pykeys[i] = collation_getkey(info, strings[i], lens[i]);
+      if (cachethis)
+        cache->busy = 0;
+      if (!pykeys[i])
+        goto finally;
+      keys[i] = PyBytes_AS_STRING(pykeys[i]);
+      keylens[i] = (int)PyBytes_GET_SIZE(pykeys[i]);
+      if (cachethis)
+        entry = functionmemo_insert(cache, lens[i], hash, SQLITE_BLOB, 0, 0, keys[i], keylens[i]);
+    }
+    else
+    {
+      keys[i] = (const char *)FUNCTIONMEMO_KEY(entry) + entry->keylen;
+      keylens[i] = entry->u.len;
+    }
+    /* so looking up the second string can't evict the first */
+    if (usecache)
+      cache->pinned = entry;
+  }
+
+  result = memcmp(keys[0], keys[1], keylens[0] < keylens[1] ? keylens[0] : keylens[1]);
+  if (!result)
+    result = keylens[0] - keylens[1];
+  result = (result > 0) - (result < 0);
+
+finally:
+  if (usecache)
+    cache->pinned = NULL;
+  if (havegil)
+  {
+    Py_XDECREF(pykeys[0]);
+    Py_XDECREF(pykeys[1]);
+    PyGILState_Release(gilstate);
+  }
+  return result;
+}
+
+static void
+collation_key_destroy(void *context)
+{
+  CollationKeyInfo *info = (CollationKeyInfo *)context;
+  PyGILState_STATE gilstate = PyGILState_Ensure();
+  Py_DECREF(info->keyfunc);
+  functionmemo_free(info->cache);
+  PyMem_Free(info);
+  PyGILState_Release(gilstate);
+}
+
+/** .. method:: createcollation(name, callback[, key=False, cachesize=65536, cachebytes=16777216])
 
   You can control how SQLite sorts (termed `collation
   <http://en.wikipedia.org/wiki/Collation>`_) when giving the
@@ -2615,6 +5117,24 @@ collation_destroy(void *context)
          if one > two:
              return 1
 
+  Sorting calls the *callback* for every comparison which is slow for
+  large amounts of data.  With *key* True the *callback* instead works
+  like the *key* for :func:`sorted`.  It is called with one string and
+  returns a sort key as bytes (or str which is compared by code
+  point).  Keys are remembered for the most recently seen *cachesize*
+  strings (and under *cachebytes* of memory if non-zero), and compared
+  without calling Python::
+
+     def numeric(s):
+         # sort numbers in the text by value
+         return "".join("%020d" % int(part) if part.isdigit() else part
+                        for part in re.split(r"(\d+)", s))
+
+     connection.createcollation("numeric", numeric, key=True)
+
+  A good source of sort keys is `PyICU <https://pypi.org/project/PyICU/>`__
+  ``Collator.getSortKey``.
+
   .. seealso::
 
     * :ref:`Example <collation-example>`
@@ -2623,16 +5143,20 @@ collation_destroy(void *context)
 */
 
 static PyObject *
-Connection_createcollation(Connection *self, PyObject *args)
+Connection_createcollation(Connection *self, PyObject *args, PyObject *kwargs)
 {
-  PyObject *callable = NULL;
+  static char *kwlist[] = {"name", "callback", "key", "cachesize", "cachebytes", NULL};
+  PyObject *callable = NULL, *okey = NULL;
   char *name = 0;
-  int res;
+  int res, key = 0, cachesize = 65536;
+  Py_ssize_t cachebytes = 16 * 1024 * 1024;
+  CollationKeyInfo *info = NULL;
 
   CHECK_USE(NULL);
   CHECK_CLOSED(self, NULL);
 
-  if (!PyArg_ParseTuple(args, "esO:createcollation(name,callback)", STRENCODING, &name, &callable))
+  if (!PyArg_ParseTupleAndKeywords(args, kwargs, "esO|O!in:createcollation(name, callback, key=False, cachesize=65536, cachebytes=16777216)",
+                                   kwlist, STRENCODING, &name, &callable, &PyBool_Type, &okey, &cachesize, &cachebytes))
     return NULL;
 
   assert(name);
@@ -2644,17 +5168,52 @@ Connection_createcollation(Connection *self, PyObject *args)
     PyErr_SetString(PyExc_TypeError, "parameter must be callable");
     return NULL;
   }
+  if (okey)
+  {
+    key = PyObject_IsTrue(okey);
+    if (key < 0)
+    {
+      PyMem_Free(name);
+      return NULL;
+    }
+  }
+  if (cachesize < 2 || cachebytes < 0)
+  {
+    PyMem_Free(name);
+    PyErr_SetString(PyExc_ValueError, "cachesize must be at least 2 and cachebytes can't be negative");
+    return NULL;
+  }
+
+  if (key && callable != Py_None)
+  {
+    info = PyMem_Malloc(sizeof(CollationKeyInfo));
+    if (info)
+      info->cache = functionmemo_new(cachesize, cachebytes);
+    if (!info || !info->cache)
+    {
+      PyMem_Free(info);
+      PyMem_Free(name);
+      PyErr_NoMemory();
+      return NULL;
+    }
+    info->keyfunc = callable;
+  }
 
   PYSQLITE_CON_CALL(
       res = sqlite3_create_collation_v2(self->db,
                                         name,
                                         SQLITE_UTF8,
-                                        (callable != Py_None) ? callable : NULL,
-                                        (callable != Py_None) ? collation_cb : NULL,
-                                        (callable != Py_None) ? collation_destroy : NULL));
+                                        info ? (void *)info : ((callable != Py_None) ? callable : NULL),
+                                        info ? collation_key_cb : ((callable != Py_None) ? collation_cb : NULL),
+                                        info ? collation_key_destroy : ((callable != Py_None) ? collation_destroy : NULL)));
   PyMem_Free(name);
   if (res != SQLITE_OK)
   {
+    if (info)
+    {
+      functionmemo_free(info->cache);
+      PyMem_Free(info);
+    }
     SET_EXC(res, self->db);
     return NULL;
   }
@@ -2895,16 +5454,29 @@ Connection_createmodule(Connection *self, PyObject *args)
   APSW_FAULT_INJECT(CreateModuleFail,
                     PYSQLITE_CON_CALL((res = sqlite3_create_module_v2(self->db, name, &apsw_vtable_module, vti, apswvtabFree), vti = NULL)),
                     res = SQLITE_IOERR);
-  PyMem_Free(name);
   SET_EXC(res, self->db);
 
   if (res != SQLITE_OK)
   {
+    PyMem_Free(name);
     if (vti)
       apswvtabFree(vti);
     return NULL;
   }
 
+  /* this replaced any batch table valued function of the same name */
+  if (self->batchmodules)
+  {
+    PyObject *key = foldfunctionname(name);
+
+    if (key && PyDict_GetItem(self->batchmodules, key))
+      PyDict_DelItem(self->batchmodules, key);
+    Py_XDECREF(key);
+  }
+  PyMem_Free(name);
+  if (PyErr_Occurred())
+    return NULL;
+
   Py_RETURN_NONE;
 }
 
@@ -3442,11 +6014,60 @@ Connection_getmainfilename(Connection *self)
   return convertutf8string(sqlite3_db_filename(self->db, "main"));
 }
 
+/** .. attribute:: rowfastpath
+
+  When True, each result row is fetched from SQLite in one go
+  releasing the GIL once for the row, rather than
+  releasing and reacquiring it for every column.  This is
+  considerably quicker for queries returning many columns.  The
+  default is False.
+
+  Cursors use this value unless :attr:`Cursor.rowfastpath` has been
+  set on them.
+
+  .. seealso::
+
+    * :ref:`speedtest`
+*/
+static PyObject *
+Connection_get_rowfastpath(Connection *self, APSW_ARGUNUSED void *unused)
+{
+  CHECK_USE(NULL);
+  CHECK_CLOSED(self, NULL);
+
+  return PyBool_FromLong(self->rowfastpath);
+}
+
+static int
+Connection_set_rowfastpath(Connection *self, PyObject *value, APSW_ARGUNUSED void *unused)
+{
+  int enabled;
+
+  CHECK_USE(-1);
+  CHECK_CLOSED(self, -1);
+
+  if (!value)
+  {
+    PyErr_Format(PyExc_TypeError, "rowfastpath can't be deleted");
+    return -1;
+  }
+
+  enabled = PyObject_IsTrue(value);
+  if (enabled < 0)
+    return -1;
+
+  self->rowfastpath = enabled;
+  return 0;
+}
+
 static PyGetSetDef Connection_getseters[] = {
     /* name getter setter doc closure */
     {"filename",
      (getter)Connection_getmainfilename, NULL,
      "Returns filename of the database", NULL},
+    {"rowfastpath",
+     (getter)Connection_get_rowfastpath, (setter)Connection_set_rowfastpath,
+     "Converts result rows with one GIL release per row", NULL},
     /* Sentinel */
     {NULL, NULL, NULL, NULL, NULL}};
 
@@ -3469,6 +6090,12 @@ static PyMemberDef Connection_members[] = {
 static PyMethodDef Connection_methods[] = {
     {"cursor", (PyCFunction)Connection_cursor, METH_NOARGS,
      "Create a new cursor"},
+    {"prepare", (PyCFunction)Connection_prepare, METH_VARARGS,
+     "Prepares a statement"},
+    {"statementcache_stats", (PyCFunction)Connection_statementcache_stats, METH_NOARGS,
+     "Returns statement cache statistics"},
+    {"memoize_stats", (PyCFunction)Connection_memoize_stats, METH_NOARGS,
+     "Returns memoized function statistics"},
     {"close", (PyCFunction)Connection_close, METH_VARARGS,
      "Closes the connection"},
     {"setbusytimeout", (PyCFunction)Connection_setbusytimeout, METH_VARARGS,
@@ -3479,6 +6106,8 @@ static PyMethodDef Connection_methods[] = {
      "Creates a scalar function"},
     {"createaggregatefunction", (PyCFunction)Connection_createaggregatefunction, METH_VARARGS,
      "Creates an aggregate function"},
+    {"createwindowfunction", (PyCFunction)Connection_createwindowfunction, METH_VARARGS,
+     "Creates a window function"},
     {"setbusyhandler", (PyCFunction)Connection_setbusyhandler, METH_O,
      "Sets the busy handler"},
     {"changes", (PyCFunction)Connection_changes, METH_NOARGS,
@@ -3487,7 +6116,7 @@ static PyMethodDef Connection_methods[] = {
      "Returns the total number of changes to database since it was opened"},
     {"getautocommit", (PyCFunction)Connection_getautocommit, METH_NOARGS,
      "Returns if the database is in auto-commit mode"},
-    {"createcollation", (PyCFunction)Connection_createcollation, METH_VARARGS,
+    {"createcollation", (PyCFunction)Connection_createcollation, METH_VARARGS | METH_KEYWORDS,
      "Creates a collation function"},
     {"last_insert_rowid", (PyCFunction)Connection_last_insert_rowid, METH_NOARGS,
      "Returns rowid for last insert"},
@@ -3501,6 +6130,8 @@ static PyMethodDef Connection_methods[] = {
      "Sets an update hook"},
     {"setrollbackhook", (PyCFunction)Connection_setrollbackhook, METH_O,
      "Sets a callable invoked before each rollback"},
+    {"blob_read_many", (PyCFunction)Connection_blob_read_many, METH_VARARGS | METH_KEYWORDS,
+     "Reads slices of many blobs"},
     {"blobopen", (PyCFunction)Connection_blobopen, METH_VARARGS,
      "Opens a blob for i/o"},
     {"setprogresshandler", (PyCFunction)Connection_setprogresshandler, METH_VARARGS,
@@ -3557,7 +6188,9 @@ static PyMethodDef Connection_methods[] = {
      "Return filename of main or attached database"},
     {"txn_state", (PyCFunction)Connection_txn_state, METH_VARARGS,
      "Return transaction state"},
-    {"serialize", (PyCFunction)Connection_serialize, METH_O,
+    {"deserialize", (PyCFunction)Connection_deserialize, METH_VARARGS | METH_KEYWORDS,
+     "Replaces a database with the supplied contents"},
+    {"serialize", (PyCFunction)Connection_serialize, METH_VARARGS | METH_KEYWORDS,
      "Return in memory copy of database"},
     {0, 0, 0, 0} /* Sentinel */
 };
@@ -150,6 +150,9 @@ struct APSWCursor
   PyObject *exectrace;
   PyObject *rowtrace;
 
+  /* row conversion fast path - negative means use the connection's setting */
+  int rowfastpath;
+
   /* weak reference support */
   PyObject *weakreflist;
 
@@ -167,6 +170,8 @@ static PyTypeObject APSWCursorType;
 
 #define EXECTRACE ((self->exectrace && self->exectrace != Py_None) ? self->exectrace : ((self->exectrace == Py_None) ? 0 : self->connection->exectrace))
 
+#define ROWFASTPATH ((self->rowfastpath >= 0) ? self->rowfastpath : self->connection->rowfastpath)
+
 /* Do finalization and free resources.  Returns the SQLITE error code.  If force is 2 then don't raise any exceptions */
 static int
 resetcursor(APSWCursor *self, int force)
@@ -312,6 +317,7 @@ APSWCursor_init(APSWCursor *self, Connection *connection)
   self->emoriginalquery = 0;
   self->exectrace = 0;
   self->rowtrace = 0;
+  self->rowfastpath = -1;
   self->inuse = 0;
   self->weakreflist = NULL;
   self->description_cache[0] = 0;
@@ -1191,6 +1197,338 @@ APSWCursor_executemany(APSWCursor *self, PyObject *args)
   return retval;
 }
 
+/* A column for executecolumns */
+typedef struct
+{
+  const char *buf;    /* first value */
+  Py_ssize_t stride;  /* bytes between values */
+  Py_ssize_t itemsize;
+  char kind;          /* 'i' for signed, 'u' for unsigned, 'f' for floating point */
+} executecolumns_column;
+
+/* how many rows are done each time the GIL is released */
+#define EXECUTECOLUMNS_CHUNK 4096
+
+/* Must be called with the GIL released and the database mutex held.
+   Binds, steps and resets the statement for each row. */
+static int
+executecolumns_rows(sqlite3_stmt *stmt, const executecolumns_column *columns, int ncols, Py_ssize_t start, Py_ssize_t end)
+{
+  int res = SQLITE_OK, col;
+  Py_ssize_t row;
+
+  for (row = start; row < end; row++)
+  {
+    for (col = 0; col < ncols; col++)
+    {
+      const executecolumns_column *column = columns + col;
+      const char *ptr = column->buf + row * column->stride;
+
+      if (column->kind == 'f')
+      {
+        double dv;
+        if (column->itemsize == sizeof(float))
+        {
+          float fv;
+          memcpy(&fv, ptr, sizeof(fv));
+          dv = fv;
+        }
+        else
+          memcpy(&dv, ptr, sizeof(dv));
+        res = sqlite3_bind_double(stmt, col + 1, dv); /* PYSQLITE_CALL done by caller */
+      }
+      else
+      {
+        sqlite3_int64 iv = 0;
+        switch (column->itemsize)
+        {
+        case 1:
+          iv = (column->kind == 'i') ? (sqlite3_int64) * (const signed char *)ptr : (sqlite3_int64) * (const unsigned char *)ptr;
+          break;
+        case 2:
+        {
+          short v;
+          memcpy(&v, ptr, sizeof(v));
+          iv = (column->kind == 'i') ? (sqlite3_int64)v : (sqlite3_int64)(unsigned short)v;
+          break;
+        }
+        case 4:
+        {
+          int v;
+          memcpy(&v, ptr, sizeof(v));
+          iv = (column->kind == 'i') ? (sqlite3_int64)v : (sqlite3_int64)(unsigned int)v;
+          break;
+        }
+        case 8:
+          /* unsigned values have already been checked to fit */
+          memcpy(&iv, ptr, sizeof(iv));
+          break;
+        }
+        res = sqlite3_bind_int64(stmt, col + 1, iv); /* PYSQLITE_CALL done by caller */
+      }
+      if (res != SQLITE_OK)
+        return res;
+    }
+
+    res = sqlite3_step(stmt); /* PYSQLITE_CALL done by caller */
+    if (res == SQLITE_ROW || res == SQLITE_DONE)
+      res = sqlite3_reset(stmt); /* PYSQLITE_CALL done by caller */
+    else
+      sqlite3_reset(stmt); /* PYSQLITE_CALL done by caller */
+    if (res != SQLITE_OK)
+      return res;
+  }
+  return res;
+}
+
+/* Fills in column from the buffer returning zero on success */
+static int
+executecolumns_getcolumn(executecolumns_column *column, Py_buffer *buffer, int colnum)
+{
+  const char *format = buffer->format ? buffer->format : "B";
+
+  if (buffer->ndim != 1)
+  {
+    PyErr_Format(PyExc_ValueError, "Column #%d must be one dimensional not %d", colnum, buffer->ndim);
+    return -1;
+  }
+
+  if (*format == '@' || *format == '=')
+    format++;
+#if PY_LITTLE_ENDIAN
+  else if (*format == '<')
+#else
+  else if (*format == '>' || *format == '!')
+#endif
+    format++;
+
+  column->kind = 0;
+  if (format[0] && !format[1])
+    switch (format[0])
+    {
+    case 'b':
+    case 'h':
+    case 'i':
+    case 'l':
+    case 'q':
+    case 'n':
+      column->kind = 'i';
+      break;
+    case 'B':
+    case 'H':
+    case 'I':
+    case 'L':
+    case 'Q':
+    case 'N':
+    case '?':
+      column->kind = 'u';
+      break;
+    case 'f':
+    case 'd':
+      column->kind = 'f';
+      break;
+    }
+
+  if (!column->kind || (column->kind == 'f' && buffer->itemsize != sizeof(float) && buffer->itemsize != sizeof(double)) || (column->kind != 'f' && buffer->itemsize != 1 && buffer->itemsize != 2 && buffer->itemsize != 4 && buffer->itemsize != 8))
+  {
+    PyErr_Format(PyExc_TypeError, "Column #%d has unsupported buffer format '%s' - only native integers and floating point are supported", colnum, buffer->format ? buffer->format : "B");
+    return -1;
+  }
+
+  column->buf = buffer->buf;
+  column->stride = buffer->strides ? buffer->strides[0] : buffer->itemsize;
+  column->itemsize = buffer->itemsize;
+
+  if (column->kind == 'u' && column->itemsize == 8)
+  {
+    Py_ssize_t row;
+    for (row = 0; row < buffer->shape[0]; row++)
+    {
+      unsigned long long v;
+      memcpy(&v, column->buf + row * column->stride, sizeof(v));
+      if (v > 0x7fffffffffffffffULL)
+      {
+        PyErr_Format(PyExc_OverflowError, "Column #%d row %zd value %llu is too big for a 64 bit signed integer", colnum, row, v);
+        return -1;
+      }
+    }
+  }
+  return 0;
+}
+
+/** .. method:: executecolumns(statement, columns) -> None
+
+  Executes *statement* once per row of *columns*, binding the value
+  from each column in turn to the corresponding parameter.  This is
+  intended for bulk loading numeric data without making a Python
+  object for every value.  Conceptually it does this::
+
+    for row in zip(*columns):
+        cursor.execute(statement, row)
+
+  Example::
+
+    import array
+    ids = array.array("q", range(1000000))
+    scores = array.array("d", (i / 3 for i in range(1000000)))
+
+    cursor.executecolumns("insert into nums values(?,?)", (ids, scores))
+
+  :param statement: A single SQL statement.  Any rows it returns are
+    discarded.
+  :param columns: A sequence of objects supporting the buffer protocol
+    with one column per parameter.  All must be one dimensional and
+    the same length.  Integer formats (``b``, ``B``, ``h``, ``H``,
+    ``i``, ``I``, ``l``, ``L``, ``q``, ``Q``, ``n``, ``N``, ``?``) and
+    floating point formats (``f``, ``d``) in native byte order are
+    supported, including `array.array`, `memoryview` and NumPy arrays.
+
+  The rows are processed in C with the GIL released in chunks of
+  many rows.  The :meth:`exec tracer <Cursor.setexectrace>` is called
+  once with the columns as the bindings.  If an error occurs then
+  the rows before it have been executed - use a transaction
+  (recommended for performance anyway) if you need all or nothing.
+
+  :raises BindingsError: The number of columns does not match the
+    number of parameters
+  :raises ValueError: The columns are of different lengths, not one
+    dimensional, or there are multiple statements
+  :raises TypeError: A column is of an unsupported format
+  :raises OverflowError: An unsigned 64 bit value is too big to be
+    stored
+
+  -* sqlite3_bind_int64 sqlite3_bind_double sqlite3_step sqlite3_reset
+*/
+static PyObject *
+APSWCursor_executecolumns(APSWCursor *self, PyObject *args)
+{
+  int res, nargs, ncols = 0, ngot = 0, i;
+  PyObject *query = NULL, *columnsarg = NULL;
+  Py_buffer *buffers = NULL;
+  executecolumns_column *columns = NULL;
+  Py_ssize_t nrows = 0, row;
+  sqlite3_stmt *stmt;
+
+  CHECK_USE(NULL);
+  CHECK_CURSOR_CLOSED(NULL);
+
+  res = resetcursor(self, /* force= */ 0);
+  if (res != SQLITE_OK)
+  {
+    assert(PyErr_Occurred());
+    return NULL;
+  }
+
+  assert(!self->bindings);
+  assert(self->status == C_DONE);
+
+  if (!PyArg_ParseTuple(args, "OO:executecolumns(statement, columns)", &query, &columnsarg))
+    return NULL;
+
+  self->bindings = PySequence_Fast(columnsarg, "columns must be a sequence");
+  if (!self->bindings)
+    return NULL;
+  ncols = (int)PySequence_Fast_GET_SIZE(self->bindings);
+
+  buffers = PyMem_Malloc(sizeof(Py_buffer) * (ncols + 1));
+  columns = PyMem_Malloc(sizeof(executecolumns_column) * (ncols + 1));
+  if (!buffers || !columns)
+  {
+    PyErr_NoMemory();
+    goto error;
+  }
+
+  for (ngot = 0; ngot < ncols; ngot++)
+  {
+    if (PyObject_GetBuffer(PySequence_Fast_GET_ITEM(self->bindings, ngot), buffers + ngot, PyBUF_STRIDES | PyBUF_FORMAT))
+      goto error;
+    if (executecolumns_getcolumn(columns + ngot, buffers + ngot, ngot))
+    {
+      ngot++;
+      goto error;
+    }
+    if (ngot == 0)
+      nrows = buffers[0].shape[0];
+    else if (buffers[ngot].shape[0] != nrows)
+    {
+      PyErr_Format(PyExc_ValueError, "All columns must be the same length.  Column #0 has %zd items while column #%d has %zd", nrows, ngot, buffers[ngot].shape[0]);
+      ngot++;
+      goto error;
+    }
+  }
+
+  assert(!self->statement);
+  INUSE_CALL(self->statement = statementcache_prepare(self->connection->stmtcache, query, 1));
+  if (!self->statement)
+  {
+    AddTraceBackHere(__FILE__, __LINE__, "APSWCursor_executecolumns.sqlite3_prepare", "{s: O, s: O}",
+                     "Connection", self->connection,
+                     "statement", query);
+    goto error;
+  }
+
+  if (self->statement->next)
+  {
+    PyErr_Format(PyExc_ValueError, "executecolumns only supports a single statement");
+    goto error;
+  }
+
+  stmt = self->statement->vdbestatement;
+  nargs = stmt ? sqlite3_bind_parameter_count(stmt) : 0;
+  if (nargs != ncols)
+  {
+    PyErr_Format(ExcBindings, "Incorrect number of columns supplied.  The statement uses %d and there are %d supplied", nargs, ncols);
+    goto error;
+  }
+
+  self->bindingsoffset = ncols;
+  if (EXECTRACE)
+  {
+    if (APSWCursor_doexectrace(self, 0))
+    {
+      assert(PyErr_Occurred());
+      goto error;
+    }
+  }
+
+  for (row = 0; stmt && row < nrows; row += EXECUTECOLUMNS_CHUNK)
+  {
+    Py_ssize_t end = (nrows - row > EXECUTECOLUMNS_CHUNK) ? row + EXECUTECOLUMNS_CHUNK : nrows;
+    PYSQLITE_CUR_CALL(res = executecolumns_rows(stmt, columns, ncols, row, end));
+    if (res != SQLITE_OK)
+    {
+      SET_EXC(res, self->connection->db);
+      goto error;
+    }
+  }
+
+  for (i = 0; i < ngot; i++)
+    PyBuffer_Release(buffers + i);
+  PyMem_Free(buffers);
+  PyMem_Free(columns);
+
+  res = resetcursor(self, 0);
+  if (res != SQLITE_OK)
+  {
+    assert(PyErr_Occurred());
+    return NULL;
+  }
+  Py_RETURN_NONE;
+
+error:
+  assert(PyErr_Occurred());
+  if (buffers)
+  {
+    for (i = 0; i < ngot; i++)
+      PyBuffer_Release(buffers + i);
+    PyMem_Free(buffers);
+  }
+  if (columns)
+    PyMem_Free(columns);
+  resetcursor(self, 1);
+  return NULL;
+}
+
 /** .. method:: close(force=False)
 
   It is very unlikely you will need to call this method.  It exists
@@ -1260,16 +1598,25 @@ again:
 
   /* return the row of data */
   numcols = sqlite3_data_count(self->statement->vdbestatement);
-  retval = PyTuple_New(numcols);
-  if (!retval)
-    goto error;
-
-  for (i = 0; i < numcols; i++)
+  if (ROWFASTPATH)
   {
-    INUSE_CALL(item = convert_column_to_pyobject(self->statement->vdbestatement, i));
-    if (!item)
+    INUSE_CALL(retval = convert_row_to_pyobject(self->statement->vdbestatement, numcols));
+    if (!retval)
       goto error;
-    PyTuple_SET_ITEM(retval, i, item);
+  }
+  else
+  {
+    retval = PyTuple_New(numcols);
+    if (!retval)
+      goto error;
+
+    for (i = 0; i < numcols; i++)
+    {
+      INUSE_CALL(item = convert_column_to_pyobject(self->statement->vdbestatement, i));
+      if (!item)
+        goto error;
+      PyTuple_SET_ITEM(retval, i, item);
+    }
   }
   if (ROWTRACE)
   {
@@ -1468,11 +1815,504 @@ APSWCursor_fetchone(APSWCursor *self)
   return res;
 }
 
+/* Steps and converts up to size rows into a list in one go */
+static PyObject *
+APSWCursor_internal_fetchmany(APSWCursor *self, Py_ssize_t size)
+{
+  PyObject *rows, *row;
+
+  CHECK_USE(NULL);
+  CHECK_CURSOR_CLOSED(NULL);
+
+  rows = PyList_New(0);
+  if (!rows)
+    return NULL;
+
+  while (PyList_GET_SIZE(rows) < size)
+  {
+    row = APSWCursor_next(self);
+    if (!row)
+    {
+      if (PyErr_Occurred())
+        goto error;
+      break;
+    }
+    if (PyList_Append(rows, row))
+    {
+      Py_DECREF(row);
+      goto error;
+    }
+    Py_DECREF(row);
+  }
+
+  return rows;
+
+error:
+  Py_DECREF(rows);
+  return NULL;
+}
+
+/** .. method:: fetchmany(size=1) -> list
+
+  Returns a list of up to *size* of the remaining result rows.  An
+  empty list is returned when there are no more rows.  This method is
+  defined in DBAPI.  The rows are stepped and converted in C so the
+  overhead of a Python call is paid once for the whole list rather
+  than once per row as when iterating.
+
+  .. seealso::
+
+    * :meth:`~Cursor.fetchbatches`
+*/
+static PyObject *
+APSWCursor_fetchmany(APSWCursor *self, PyObject *args, PyObject *kwds)
+{
+  static char *kwlist[] = {"size", NULL};
+  Py_ssize_t size = 1;
+
+  CHECK_USE(NULL);
+  CHECK_CURSOR_CLOSED(NULL);
+
+  if (!PyArg_ParseTupleAndKeywords(args, kwds, "|n:fetchmany(size=1)", kwlist, &size))
+    return NULL;
+
+  if (size < 0)
+    return PyErr_Format(PyExc_ValueError, "size must be zero or greater");
+
+  return APSWCursor_internal_fetchmany(self, size);
+}
+
+/* Called by the fetchbatches iterator with a tuple of the cursor and
+   batch size */
+static PyObject *
+fetchbatches_next(PyObject *cursorandsize, APSW_ARGUNUSED PyObject *unused)
+{
+  return APSWCursor_internal_fetchmany((APSWCursor *)PyTuple_GET_ITEM(cursorandsize, 0),
+                                       PyLong_AsSsize_t(PyTuple_GET_ITEM(cursorandsize, 1)));
+}
+
+static PyMethodDef fetchbatches_next_def = {"fetchbatch", (PyCFunction)fetchbatches_next, METH_NOARGS,
+                                            "Returns the next batch of rows"};
+
+/** .. method:: fetchbatches(size=1000) -> iterator
+
+  Returns an iterator where each item is a list of up to *size* result
+  rows, as returned by :meth:`~Cursor.fetchmany`.  Iteration stops
+  when there are no more rows.  This is the most efficient way of
+  processing large numbers of rows::
+
+    for batch in cursor.execute("select * from large").fetchbatches(5000):
+        process(batch)
+*/
+static PyObject *
+APSWCursor_fetchbatches(APSWCursor *self, PyObject *args, PyObject *kwds)
+{
+  static char *kwlist[] = {"size", NULL};
+  Py_ssize_t size = 1000;
+  PyObject *cursorandsize = NULL, *next = NULL, *sentinel = NULL, *iterator = NULL;
+
+  CHECK_USE(NULL);
+  CHECK_CURSOR_CLOSED(NULL);
+
+  if (!PyArg_ParseTupleAndKeywords(args, kwds, "|n:fetchbatches(size=1000)", kwlist, &size))
+    return NULL;
+
+  if (size < 1)
+    return PyErr_Format(PyExc_ValueError, "size must be at least one");
+
+  cursorandsize = Py_BuildValue("(On)", self, size);
+  if (!cursorandsize)
+    goto finally;
+  next = PyCFunction_New(&fetchbatches_next_def, cursorandsize);
+  if (!next)
+    goto finally;
+  /* the iterator stops when a batch compares equal to this */
+  sentinel = PyList_New(0);
+  if (!sentinel)
+    goto finally;
+  iterator = PyCallIter_New(next, sentinel);
+
+finally:
+  Py_XDECREF(cursorandsize);
+  Py_XDECREF(next);
+  Py_XDECREF(sentinel);
+  return iterator;
+}
+
+/** .. attribute:: rowfastpath
+
+  When True, each result row is fetched from SQLite releasing the GIL
+  once for the row rather than once per column.  Setting it to
+  :const:`None` reverts to using :attr:`Connection.rowfastpath`, which
+  is also the value you get back when it has not been set.
+*/
+static PyObject *
+APSWCursor_get_rowfastpath(APSWCursor *self, APSW_ARGUNUSED void *unused)
+{
+  CHECK_USE(NULL);
+  CHECK_CURSOR_CLOSED(NULL);
+
+  return PyBool_FromLong(ROWFASTPATH);
+}
+
+static int
+APSWCursor_set_rowfastpath(APSWCursor *self, PyObject *value, APSW_ARGUNUSED void *unused)
+{
+  int enabled;
+
+  CHECK_USE(-1);
+  CHECK_CURSOR_CLOSED(-1);
+
+  if (!value)
+  {
+    PyErr_Format(PyExc_TypeError, "rowfastpath can't be deleted");
+    return -1;
+  }
+
+  if (value == Py_None)
+  {
+    self->rowfastpath = -1;
+    return 0;
+  }
+
+  enabled = PyObject_IsTrue(value);
+  if (enabled < 0)
+    return -1;
+
+  self->rowfastpath = enabled;
+  return 0;
+}
+
+#if PY_VERSION_HEX >= 0x03030000
+/* Column being accumulated by fetchcolumns */
+typedef struct
+{
+  int coltype;          /* SQLITE_INTEGER/FLOAT/TEXT/BLOB or zero for Python objects */
+  PyObject *values;     /* bytearray of values or offsets, or a list for Python objects */
+  Py_ssize_t valuesize; /* bytes of values in use */
+  PyObject *data;       /* bytearray of text/blob contents */
+  Py_ssize_t datasize;  /* bytes of data in use */
+} fetchcolumns_column;
+
+/* Works out which type of column to use from the declared type,
+   following the SQLite rules for determining column affinity.
+   Columns without a declared type (including expressions) and those
+   with NUMERIC affinity are returned as Python objects. */
+static int
+fetchcolumns_coltype(const char *decltype)
+{
+  const char *p;
+  int hasblob = 0, hastext = 0, hasreal = 0;
+
+  if (!decltype)
+    return 0;
+
+  for (p = decltype; *p; p++)
+  {
+    if (0 == PyOS_strnicmp(p, "INT", 3))
+      return SQLITE_INTEGER;
+    if (0 == PyOS_strnicmp(p, "CHAR", 4) || 0 == PyOS_strnicmp(p, "CLOB", 4) || 0 == PyOS_strnicmp(p, "TEXT", 4))
+      hastext = 1;
+    if (0 == PyOS_strnicmp(p, "BLOB", 4))
+      hasblob = 1;
+    if (0 == PyOS_strnicmp(p, "REAL", 4) || 0 == PyOS_strnicmp(p, "FLOA", 4) || 0 == PyOS_strnicmp(p, "DOUB", 4))
+      hasreal = 1;
+  }
+  if (hastext)
+    return SQLITE_TEXT;
+  if (hasblob)
+    return SQLITE_BLOB;
+  if (hasreal)
+    return SQLITE_FLOAT;
+  return 0;
+}
+
+/* Appends to a bytearray, over allocating so repeated appends are
+   cheap.  *used is the number of bytes actually in use. */
+static int
+fetchcolumns_append(PyObject *bytearray, Py_ssize_t *used, const void *data, Py_ssize_t len)
+{
+  Py_ssize_t allocated = PyByteArray_GET_SIZE(bytearray);
+
+  if (*used + len > allocated)
+  {
+    if (allocated < 256)
+      allocated = 256;
+    while (allocated < *used + len)
+      allocated *= 2;
+    if (PyByteArray_Resize(bytearray, allocated))
+      return -1;
+  }
+  if (len)
+    memcpy(PyByteArray_AS_STRING(bytearray) + *used, data, len);
+  *used += len;
+  return 0;
+}
+
+/* Trims the bytearray to what is in use and returns a memoryview of it with the format */
+static PyObject *
+fetchcolumns_memoryview(PyObject *bytearray, Py_ssize_t used, const char *format)
+{
+  PyObject *view, *res;
+
+  if (PyByteArray_Resize(bytearray, used))
+    return NULL;
+  view = PyMemoryView_FromObject(bytearray);
+  if (!view || !format)
+    return view;
+  res = PyObject_CallMethod(view, "cast", "s", format);
+  Py_DECREF(view);
+  return res;
+}
+
+/** .. method:: fetchcolumns(maxrows=-1) -> tuple
+
+  Returns up to *maxrows* (all if negative) of the remaining rows of
+  the current statement as columns rather than rows.  The rows are
+  stepped in C and each value added directly to its column, avoiding
+  making a Python object per value for most columns.
+
+  The tuple has an item per result column, with the representation
+  chosen by the `declared type
+  <https://sqlite.org/datatype3.html#determination_of_column_affinity>`__
+  of the column (see :meth:`~Cursor.getdescription`):
+
+  .. list-table::
+    :header-rows: 1
+    :widths: auto
+
+    * - Affinity
+      - Column
+    * - INTEGER
+      - memoryview of 64 bit integers (format ``q``).  Null is 0.
+    * - REAL
+      - memoryview of doubles (format ``d``).  Null is NaN.
+    * - TEXT
+      - tuple of offsets and data.  The offsets are a memoryview of
+        64 bit integers (format ``q``) with one more entry than there
+        are rows, with the value for row ``i`` being UTF-8 data
+        ``data[offsets[i]:offsets[i+1]]``.  Null is an empty string.
+    * - BLOB
+      - tuple of offsets and data as for TEXT, with the values being
+        the bytes.
+    * - NUMERIC or no declared type (eg expressions)
+      - list of the values as usual
+
+  Values are converted to the column type using SQLite's rules.  The
+  memoryviews use the buffer protocol so they can be used by
+  `array.array`, `NumPy <https://numpy.org/>`__ (eg
+  ``numpy.frombuffer``) and similar without copying.  Row tracers
+  are not called.
+
+  If the query has multiple statements then only rows from the
+  current statement are returned.  Use :meth:`~Cursor.fetchcolumns`
+  again to get the rows of the following statements.  An empty tuple
+  is returned when all statements have completed.
+
+  -* sqlite3_column_decltype
+*/
+static PyObject *
+APSWCursor_fetchcolumns(APSWCursor *self, PyObject *args, PyObject *kwds)
+{
+  static char *kwlist[] = {"maxrows", NULL};
+  Py_ssize_t maxrows = -1, nrows = 0;
+  PyObject *description = NULL, *result = NULL;
+  fetchcolumns_column *columns = NULL;
+  apsw_column_value *values = NULL;
+  int *coerce = NULL;
+  sqlite3_stmt *stmt;
+  int numcols = 0, i;
+
+  CHECK_USE(NULL);
+  CHECK_CURSOR_CLOSED(NULL);
+
+  if (!PyArg_ParseTupleAndKeywords(args, kwds, "|n:fetchcolumns(maxrows=-1)", kwlist, &maxrows))
+    return NULL;
+
+  if (self->status == C_BEGIN && !APSWCursor_step(self))
+  {
+    assert(PyErr_Occurred());
+    return NULL;
+  }
+  if (self->status == C_DONE)
+    return PyTuple_New(0);
+
+  /* The description cache is cleared when moving on to another
+     statement so holding a reference to it tells us when that
+     happens */
+  description = APSWCursor_internal_getdescription(self, 0);
+  if (!description)
+    return NULL;
+
+  stmt = self->statement->vdbestatement;
+  numcols = sqlite3_column_count(stmt);
+
+  columns = PyMem_Malloc(sizeof(fetchcolumns_column) * (numcols + 1));
+  values = PyMem_Malloc(sizeof(apsw_column_value) * (numcols + 1));
+  coerce = PyMem_Malloc(sizeof(int) * (numcols + 1));
+  if (!columns || !values || !coerce)
+  {
+    PyErr_NoMemory();
+    goto error;
+  }
+  memset(columns, 0, sizeof(fetchcolumns_column) * (numcols + 1));
+
+  for (i = 0; i < numcols; i++)
+  {
+    const char *decltype;
+
+    PYSQLITE_VOID_CALL(decltype = sqlite3_column_decltype(stmt, i));
+    coerce[i] = columns[i].coltype = fetchcolumns_coltype(decltype);
+    if (columns[i].coltype)
+      columns[i].values = PyByteArray_FromStringAndSize(NULL, 0);
+    else
+      columns[i].values = PyList_New(0);
+    if (!columns[i].values)
+      goto error;
+    if (columns[i].coltype == SQLITE_TEXT || columns[i].coltype == SQLITE_BLOB)
+    {
+      sqlite3_int64 offset = 0;
+      columns[i].data = PyByteArray_FromStringAndSize(NULL, 0);
+      if (!columns[i].data || fetchcolumns_append(columns[i].values, &columns[i].valuesize, &offset, sizeof(offset)))
+        goto error;
+    }
+  }
+
+  while (self->status == C_ROW && self->description_cache[0] == description && (maxrows < 0 || nrows < maxrows))
+  {
+    self->status = C_BEGIN;
+
+    INUSE_CALL(_PYSQLITE_CALL_V(fetch_row_values(stmt, numcols, values, coerce)));
+
+    for (i = 0; i < numcols; i++)
+    {
+      fetchcolumns_column *column = columns + i;
+      apsw_column_value *value = values + i;
+      int isnull = value->coltype == SQLITE_NULL;
+
+      switch (column->coltype)
+      {
+      case SQLITE_INTEGER:
+      {
+        sqlite3_int64 v = isnull ? 0 : value->intval;
+        if (fetchcolumns_append(column->values, &column->valuesize, &v, sizeof(v)))
+          goto error;
+        break;
+      }
+      case SQLITE_FLOAT:
+      {
+        double v = isnull ? Py_NAN : value->doubleval;
+        if (fetchcolumns_append(column->values, &column->valuesize, &v, sizeof(v)))
+          goto error;
+        break;
+      }
+      case SQLITE_TEXT:
+      case SQLITE_BLOB:
+      {
+        sqlite3_int64 offset;
+        if (!isnull && fetchcolumns_append(column->data, &column->datasize, value->data, value->len))
+          goto error;
+        offset = column->datasize;
+        if (fetchcolumns_append(column->values, &column->valuesize, &offset, sizeof(offset)))
+          goto error;
+        break;
+      }
+      default:
+      {
+        PyObject *item = convert_column_value_to_pyobject(value);
+        if (!item)
+          goto error;
+        if (PyList_Append(column->values, item))
+        {
+          Py_DECREF(item);
+          goto error;
+        }
+        Py_DECREF(item);
+        break;
+      }
+      }
+    }
+    nrows++;
+
+    if (maxrows >= 0 && nrows >= maxrows)
+      break;
+
+    if (!APSWCursor_step(self))
+    {
+      assert(PyErr_Occurred());
+      goto error;
+    }
+  }
+
+  result = PyTuple_New(numcols);
+  if (!result)
+    goto error;
+
+  for (i = 0; i < numcols; i++)
+  {
+    fetchcolumns_column *column = columns + i;
+    PyObject *item = NULL;
+
+    switch (column->coltype)
+    {
+    case SQLITE_INTEGER:
+      item = fetchcolumns_memoryview(column->values, column->valuesize, "q");
+      break;
+    case SQLITE_FLOAT:
+      item = fetchcolumns_memoryview(column->values, column->valuesize, "d");
+      break;
+    case SQLITE_TEXT:
+    case SQLITE_BLOB:
+    {
+      PyObject *offsets = fetchcolumns_memoryview(column->values, column->valuesize, "q");
+      PyObject *data = offsets ? fetchcolumns_memoryview(column->data, column->datasize, NULL) : NULL;
+      if (data)
+        item = PyTuple_Pack(2, offsets, data);
+      Py_XDECREF(offsets);
+      Py_XDECREF(data);
+      break;
+    }
+    default:
+      item = column->values;
+      Py_INCREF(item);
+      break;
+    }
+    if (!item)
+      goto error;
+    PyTuple_SET_ITEM(result, i, item);
+  }
+  goto finally;
+
+error:
+  assert(PyErr_Occurred());
+  Py_CLEAR(result);
+
+finally:
+  if (columns)
+  {
+    for (i = 0; i < numcols; i++)
+    {
+      Py_XDECREF(columns[i].values);
+      Py_XDECREF(columns[i].data);
+    }
+    PyMem_Free(columns);
+  }
+  if (values)
+    PyMem_Free(values);
+  if (coerce)
+    PyMem_Free(coerce);
+  Py_XDECREF(description);
+  return result;
+}
+#endif
+
 static PyMethodDef APSWCursor_methods[] = {
     {"execute", (PyCFunction)APSWCursor_execute, METH_VARARGS,
      "Executes one or more statements"},
     {"executemany", (PyCFunction)APSWCursor_executemany, METH_VARARGS,
      "Repeatedly executes statements on sequence"},
+    {"executecolumns", (PyCFunction)APSWCursor_executecolumns, METH_VARARGS,
+     "Repeatedly executes a statement binding values from columns"},
     {"setexectrace", (PyCFunction)APSWCursor_setexectrace, METH_O,
      "Installs a function called for every statement executed"},
     {"setrowtrace", (PyCFunction)APSWCursor_setrowtrace, METH_O,
@@ -1491,12 +2331,21 @@ static PyMethodDef APSWCursor_methods[] = {
      "Fetches all result rows"},
     {"fetchone", (PyCFunction)APSWCursor_fetchone, METH_NOARGS,
      "Fetches next result row"},
+    {"fetchmany", (PyCFunction)APSWCursor_fetchmany, METH_VARARGS | METH_KEYWORDS,
+     "Fetches a list of result rows"},
+    {"fetchbatches", (PyCFunction)APSWCursor_fetchbatches, METH_VARARGS | METH_KEYWORDS,
+     "Iterates over lists of result rows"},
+#if PY_VERSION_HEX >= 0x03030000
+    {"fetchcolumns", (PyCFunction)APSWCursor_fetchcolumns, METH_VARARGS | METH_KEYWORDS,
+     "Fetches result rows as columns"},
+#endif
 
     {0, 0, 0, 0} /* Sentinel */
 };
 
 static PyGetSetDef APSWCursor_getset[] = {
     {"description", (getter)APSWCursor_getdescription_dbapi, NULL, "Subset of DB-API description attribute", NULL},
+    {"rowfastpath", (getter)APSWCursor_get_rowfastpath, (setter)APSWCursor_set_rowfastpath, "Converts result rows with one GIL release per row", NULL},
     {NULL, NULL, NULL, NULL, NULL}};
 
 static PyTypeObject APSWCursorType = {
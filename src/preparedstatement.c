@@ -0,0 +1,620 @@
+/*
+  Prepared statement handles
+
+  See the accompanying LICENSE file.
+*/
+
+/**
+
+.. _preparedstatements:
+
+Prepared Statements
+*******************
+
+:meth:`Cursor.execute` looks up the SQL text in the :ref:`statement
+cache <statementcache>`, binds the values, and then runs the
+statement through the cursor state machine which handles multiple
+statements, tracers and :meth:`~Cursor.executemany`.  That is
+convenient but each call has to hash the SQL text and go through all
+those steps.
+
+A :class:`PreparedStatement` holds onto one prepared statement so it
+can be bound, stepped and reset directly.  It is intended for tight
+loops where the same statement is executed many times.  The
+:meth:`exec <Cursor.setexectrace>` and :meth:`row
+<Cursor.setrowtrace>` tracers are not called.
+
+Example::
+
+    stmt = connection.prepare("insert into nums values(?, ?)")
+    for i in range(1000):
+        stmt.bind(1, i)
+        stmt.bind(2, i * i)
+        stmt.step()
+        stmt.reset()
+
+    # same thing
+    stmt.run_many((i, i * i) for i in range(1000))
+
+    stmt = connection.prepare("select x, y from nums where x > ?")
+    stmt.bind(1, 500)
+    while stmt.step():
+        print(stmt.column(0), stmt.row())
+    stmt.close()
+
+*/
+
+struct APSWPreparedStatement
+{
+  PyObject_HEAD
+      APSWCursor *cursor;  /* owns the statement and connection, and does the binding */
+  unsigned inuse;          /* track if we are in use preventing concurrent thread mangling */
+  int hasrow;              /* if the last step returned a row */
+  PyObject *weakreflist;   /* weak reference tracking */
+};
+
+typedef struct APSWPreparedStatement APSWPreparedStatement;
+
+static PyTypeObject APSWPreparedStatementType;
+
+/* call from prepared statement code */
+#define PYSQLITE_PS_CALL(y) INUSE_CALL(_PYSQLITE_CALL_E(self->cursor->connection->db, y))
+
+#define CHECK_PREPAREDSTATEMENT_CLOSED(e)                                                                           \
+  do                                                                                                                \
+  {                                                                                                                 \
+    if (!self->cursor || !self->cursor->statement || !self->cursor->connection->db)                                 \
+    {                                                                                                               \
+      PyErr_Format(ExcConnectionClosed, "The prepared statement has been closed or its connection has been closed"); \
+      return e;                                                                                                     \
+    }                                                                                                               \
+  } while (0)
+
+#define PSSTMT (self->cursor->statement->vdbestatement)
+
+/** .. class:: PreparedStatement
+
+  This object is created by :meth:`Connection.prepare` and provides
+  direct access to a single prepared statement.  At the C level it
+  wraps a `sqlite3_stmt <https://sqlite.org/c3ref/stmt.html>`__.
+*/
+
+/* Returns zero on success.  On failure the object should be
+   deallocated which will clean up. */
+static int
+APSWPreparedStatement_init(APSWPreparedStatement *self, Connection *connection, PyObject *query)
+{
+  APSWCursor *cursor;
+
+  self->cursor = NULL;
+  self->inuse = 0;
+  self->hasrow = 0;
+  self->weakreflist = NULL;
+
+  cursor = PyObject_New(APSWCursor, &APSWCursorType);
+  if (!cursor)
+    return -1;
+  Py_INCREF(connection);
+  APSWCursor_init(cursor, connection);
+  self->cursor = cursor;
+
+  INUSE_CALL(cursor->statement = statementcache_prepare(connection->stmtcache, query, 1));
+  if (!cursor->statement)
+  {
+    AddTraceBackHere(__FILE__, __LINE__, "Connection.prepare", "{s: O, s: O}",
+                     "Connection", connection,
+                     "statement", query);
+    return -1;
+  }
+
+  if (cursor->statement->next)
+  {
+    PyErr_Format(PyExc_ValueError, "A prepared statement can only contain one SQL statement");
+    return -1;
+  }
+
+  if (!cursor->statement->vdbestatement)
+  {
+    PyErr_Format(PyExc_ValueError, "No SQL statement was supplied");
+    return -1;
+  }
+
+  return 0;
+}
+
+static int
+APSWPreparedStatement_close_internal(APSWPreparedStatement *self, int force)
+{
+  Connection *connection;
+  int res = 0;
+
+  if (!self->cursor)
+    return 0;
+
+  connection = self->cursor->connection;
+  Py_XINCREF(connection);
+
+  /* the statement is returned to the statement cache */
+  res = APSWCursor_close_internal(self->cursor, force);
+  Py_CLEAR(self->cursor);
+  self->hasrow = 0;
+
+  /* Remove from connection dependents list.  Has to be done before we
+     decref connection otherwise connection could dealloc and we'd
+     still be in list */
+  if (connection)
+  {
+    Connection_remove_dependent(connection, (PyObject *)self);
+    Py_DECREF(connection);
+  }
+
+  return res;
+}
+
+static void
+APSWPreparedStatement_dealloc(APSWPreparedStatement *self)
+{
+  APSW_CLEAR_WEAKREFS;
+
+  APSWPreparedStatement_close_internal(self, 2);
+
+  Py_TYPE(self)->tp_free((PyObject *)self);
+}
+
+/** .. method:: bind(index, value)
+
+  Binds *value* to the parameter at *index*.  Parameters are numbered
+  the same way SQLite does which means the first one is 1 (not zero).
+  The value must be one of the :ref:`supported types <types>`.
+  Bindings stay in place until changed, so only those that change
+  need to be bound again after :meth:`reset`.
+
+  You can only change bindings after :meth:`reset`, or before the
+  first :meth:`step`.
+
+  -* sqlite3_bind_int64 sqlite3_bind_null sqlite3_bind_text sqlite3_bind_double sqlite3_bind_blob sqlite3_bind_zeroblob
+*/
+static PyObject *
+APSWPreparedStatement_bind(APSWPreparedStatement *self, PyObject *args)
+{
+  int index;
+  PyObject *value;
+
+  CHECK_USE(NULL);
+  CHECK_PREPAREDSTATEMENT_CLOSED(NULL);
+
+  if (!PyArg_ParseTuple(args, "iO:bind(index, value)", &index, &value))
+    return NULL;
+
+  if (APSWCursor_dobinding(self->cursor, index, value))
+  {
+    assert(PyErr_Occurred());
+    return NULL;
+  }
+
+  Py_RETURN_NONE;
+}
+
+/** .. method:: clearbindings()
+
+  Sets all the parameters back to null.
+
+  -* sqlite3_clear_bindings
+*/
+static PyObject *
+APSWPreparedStatement_clearbindings(APSWPreparedStatement *self)
+{
+  int res;
+
+  CHECK_USE(NULL);
+  CHECK_PREPAREDSTATEMENT_CLOSED(NULL);
+
+  PYSQLITE_PS_CALL(res = sqlite3_clear_bindings(PSSTMT));
+  SET_EXC(res, self->cursor->connection->db);
+  if (res != SQLITE_OK)
+    return NULL;
+
+  Py_RETURN_NONE;
+}
+
+/** .. method:: step() -> bool
+
+  Executes the statement until the next row is available, returning
+  True, or until it completes returning False.  Use :meth:`column` and
+  :meth:`row` to get the values of the current row.  Call
+  :meth:`reset` to run the statement again.
+
+  If an error occurs then the statement is reset.
+
+  -* sqlite3_step
+*/
+static PyObject *
+APSWPreparedStatement_step(APSWPreparedStatement *self)
+{
+  int res;
+
+  CHECK_USE(NULL);
+  CHECK_PREPAREDSTATEMENT_CLOSED(NULL);
+
+  self->hasrow = 0;
+  PYSQLITE_PS_CALL(res = sqlite3_step(PSSTMT));
+
+  if (res == SQLITE_ROW || res == SQLITE_DONE)
+  {
+    if (PyErr_Occurred())
+      return NULL;
+    self->hasrow = (res == SQLITE_ROW);
+    return PyBool_FromLong(self->hasrow);
+  }
+
+  if (!PyErr_Occurred())
+    SET_EXC(res, self->cursor->connection->db);
+  PYSQLITE_VOID_CALL(sqlite3_reset(PSSTMT));
+  return NULL;
+}
+
+/** .. method:: reset()
+
+  Resets the statement so that it can be executed again by
+  :meth:`step`.  The bindings are not changed.
+
+  -* sqlite3_reset
+*/
+static PyObject *
+APSWPreparedStatement_reset(APSWPreparedStatement *self)
+{
+  CHECK_USE(NULL);
+  CHECK_PREPAREDSTATEMENT_CLOSED(NULL);
+
+  self->hasrow = 0;
+  /* any error would have been reported by step */
+  PYSQLITE_VOID_CALL(sqlite3_reset(PSSTMT));
+
+  Py_RETURN_NONE;
+}
+
+/** .. method:: column(index) -> value
+
+  Returns the value of the column at *index* (starting at zero) of
+  the current row.
+
+  :raises ExecutionCompleteError: There is no current row (the last
+    :meth:`step` returned False, or there hasn't been one since
+    :meth:`reset`)
+
+  -* sqlite3_column_type sqlite3_column_int64 sqlite3_column_double sqlite3_column_text sqlite3_column_blob
+*/
+static PyObject *
+APSWPreparedStatement_column(APSWPreparedStatement *self, PyObject *args)
+{
+  int index;
+  PyObject *res;
+
+  CHECK_USE(NULL);
+  CHECK_PREPAREDSTATEMENT_CLOSED(NULL);
+
+  if (!PyArg_ParseTuple(args, "i:column(index)", &index))
+    return NULL;
+
+  if (!self->hasrow)
+    return PyErr_Format(ExcComplete, "There is no current row");
+
+  if (index < 0 || index >= sqlite3_column_count(PSSTMT))
+    return PyErr_Format(PyExc_IndexError, "Column index %d is out of range", index);
+
+  INUSE_CALL(res = convert_column_to_pyobject(PSSTMT, index));
+  return res;
+}
+
+/** .. method:: row() -> tuple
+
+  Returns all the values of the current row.
+
+  :raises ExecutionCompleteError: There is no current row
+*/
+static PyObject *
+APSWPreparedStatement_row(APSWPreparedStatement *self)
+{
+  PyObject *res;
+
+  CHECK_USE(NULL);
+  CHECK_PREPAREDSTATEMENT_CLOSED(NULL);
+
+  if (!self->hasrow)
+    return PyErr_Format(ExcComplete, "There is no current row");
+
+  INUSE_CALL(res = convert_row_to_pyobject(PSSTMT, sqlite3_column_count(PSSTMT)));
+  return res;
+}
+
+/* Must be called with the GIL released and the database mutex held.
+   Runs the statement to completion discarding any rows, and then
+   resets it ready for the next bindings. */
+static int
+preparedstatement_run(sqlite3_stmt *stmt)
+{
+  int res;
+
+  do
+  {
+    res = sqlite3_step(stmt); /* PYSQLITE_CALL done by caller */
+  } while (res == SQLITE_ROW);
+
+  if (res == SQLITE_DONE)
+    res = sqlite3_reset(stmt); /* PYSQLITE_CALL done by caller */
+  else
+    sqlite3_reset(stmt); /* PYSQLITE_CALL done by caller */
+  sqlite3_clear_bindings(stmt); /* PYSQLITE_CALL done by caller */
+  return res;
+}
+
+/** .. method:: run_many(sequenceofbindings)
+
+  Runs the statement to completion once for each item of
+  *sequenceofbindings*, discarding any rows.  Each item is a sequence
+  or dictionary of bindings as for :meth:`Cursor.execute`.  This is
+  equivalent to::
+
+    for bindings in sequenceofbindings:
+        stmt.clearbindings()
+        for index, value in enumerate(bindings, 1):
+            stmt.bind(index, value)
+        while stmt.step():
+            pass
+        stmt.reset()
+
+  The statement is reset with bindings cleared at the start and end.
+*/
+static PyObject *
+APSWPreparedStatement_run_many(APSWPreparedStatement *self, PyObject *args)
+{
+  PyObject *theiterable = NULL, *iterator = NULL, *next = NULL;
+  APSWCursor *cursor;
+  int res;
+
+  CHECK_USE(NULL);
+  CHECK_PREPAREDSTATEMENT_CLOSED(NULL);
+
+  if (!PyArg_ParseTuple(args, "O:run_many(sequenceofbindings)", &theiterable))
+    return NULL;
+
+  iterator = PyObject_GetIter(theiterable);
+  if (!iterator)
+    return NULL;
+
+  cursor = self->cursor;
+  self->hasrow = 0;
+  PYSQLITE_VOID_CALL(sqlite3_reset(PSSTMT));
+  PYSQLITE_VOID_CALL(sqlite3_clear_bindings(PSSTMT));
+
+  while ((next = PyIter_Next(iterator)))
+  {
+    assert(!cursor->bindings);
+    if (PyDict_Check(next))
+      cursor->bindings = next;
+    else
+    {
+      cursor->bindings = PySequence_Fast(next, "You must supply a dict or a sequence");
+      Py_DECREF(next);
+      if (!cursor->bindings)
+        goto error;
+    }
+    cursor->bindingsoffset = 0;
+    res = APSWCursor_dobindings(cursor);
+    Py_CLEAR(cursor->bindings);
+    if (res)
+      goto error;
+
+    PYSQLITE_PS_CALL(res = preparedstatement_run(PSSTMT));
+    if (PyErr_Occurred())
+      goto error;
+    if (res != SQLITE_OK)
+    {
+      SET_EXC(res, cursor->connection->db);
+      goto error;
+    }
+  }
+  if (PyErr_Occurred())
+    goto error;
+
+  Py_DECREF(iterator);
+  Py_RETURN_NONE;
+
+error:
+  assert(PyErr_Occurred());
+  Py_XDECREF(iterator);
+  PYSQLITE_VOID_CALL(sqlite3_reset(PSSTMT));
+  PYSQLITE_VOID_CALL(sqlite3_clear_bindings(PSSTMT));
+  return NULL;
+}
+
+/** .. method:: close(force=False)
+
+  Returns the statement to the :ref:`statement cache
+  <statementcache>`.  Any operations on the object after this will
+  give an exception.  The prepared statement is automatically closed
+  when it is garbage collected or the connection is closed.
+
+  :param force: Ignores any errors during close.
+*/
+static PyObject *
+APSWPreparedStatement_close(APSWPreparedStatement *self, PyObject *args)
+{
+  int force = 0;
+
+  CHECK_USE(NULL);
+
+  if (args && !PyArg_ParseTuple(args, "|i:close(force=False)", &force))
+    return NULL;
+
+  if (APSWPreparedStatement_close_internal(self, !!force))
+  {
+    assert(PyErr_Occurred());
+    return NULL;
+  }
+
+  Py_RETURN_NONE;
+}
+
+/** .. method:: __enter__() -> context
+
+  You can use a prepared statement as a `context manager
+  <http://docs.python.org/reference/datamodel.html#with-statement-context-managers>`_
+  as defined in :pep:`0343`.  When you use *with* statement, the
+  prepared statement is always :meth:`closed
+  <~PreparedStatement.close>` on exit from the block, even if an
+  exception occurred in the block.
+*/
+static PyObject *
+APSWPreparedStatement_enter(APSWPreparedStatement *self)
+{
+  CHECK_USE(NULL);
+  CHECK_PREPAREDSTATEMENT_CLOSED(NULL);
+
+  Py_INCREF(self);
+  return (PyObject *)self;
+}
+
+/** .. method:: __exit__() -> False
+
+  Implements context manager in conjunction with
+  :meth:`~PreparedStatement.__enter__`.  Any exception that happened
+  in the *with* block is raised after closing the prepared statement.
+*/
+static PyObject *
+APSWPreparedStatement_exit(APSWPreparedStatement *self, APSW_ARGUNUSED PyObject *args)
+{
+  PyObject *res;
+
+  CHECK_USE(NULL);
+  CHECK_PREPAREDSTATEMENT_CLOSED(NULL);
+
+  res = APSWPreparedStatement_close(self, NULL);
+  Py_XDECREF(res);
+  if (!res)
+    return NULL;
+
+  Py_RETURN_FALSE;
+}
+
+/** .. attribute:: sql
+
+  The SQL text of the statement.
+*/
+static PyObject *
+APSWPreparedStatement_get_sql(APSWPreparedStatement *self, APSW_ARGUNUSED void *unused)
+{
+  CHECK_USE(NULL);
+  CHECK_PREPAREDSTATEMENT_CLOSED(NULL);
+
+  return convertutf8buffersizetounicode(self->cursor->statement->utf8, self->cursor->statement->querylen);
+}
+
+/** .. attribute:: columncount
+
+  How many columns the rows returned by the statement have.
+
+  -* sqlite3_column_count
+*/
+static PyObject *
+APSWPreparedStatement_get_columncount(APSWPreparedStatement *self, APSW_ARGUNUSED void *unused)
+{
+  CHECK_USE(NULL);
+  CHECK_PREPAREDSTATEMENT_CLOSED(NULL);
+
+  return PyInt_FromLong(sqlite3_column_count(PSSTMT));
+}
+
+/** .. attribute:: parametercount
+
+  How many parameters the statement has.
+
+  -* sqlite3_bind_parameter_count
+*/
+static PyObject *
+APSWPreparedStatement_get_parametercount(APSWPreparedStatement *self, APSW_ARGUNUSED void *unused)
+{
+  CHECK_USE(NULL);
+  CHECK_PREPAREDSTATEMENT_CLOSED(NULL);
+
+  return PyInt_FromLong(sqlite3_bind_parameter_count(PSSTMT));
+}
+
+static PyMethodDef APSWPreparedStatement_methods[] = {
+    {"bind", (PyCFunction)APSWPreparedStatement_bind, METH_VARARGS,
+     "Binds a value to a parameter"},
+    {"clearbindings", (PyCFunction)APSWPreparedStatement_clearbindings, METH_NOARGS,
+     "Sets all parameters to null"},
+    {"step", (PyCFunction)APSWPreparedStatement_step, METH_NOARGS,
+     "Executes until the next row"},
+    {"reset", (PyCFunction)APSWPreparedStatement_reset, METH_NOARGS,
+     "Resets the statement so it can be executed again"},
+    {"column", (PyCFunction)APSWPreparedStatement_column, METH_VARARGS,
+     "Returns a column value of the current row"},
+    {"row", (PyCFunction)APSWPreparedStatement_row, METH_NOARGS,
+     "Returns the current row"},
+    {"run_many", (PyCFunction)APSWPreparedStatement_run_many, METH_VARARGS,
+     "Runs the statement for each set of bindings"},
+    {"close", (PyCFunction)APSWPreparedStatement_close, METH_VARARGS,
+     "Closes the prepared statement"},
+    {"__enter__", (PyCFunction)APSWPreparedStatement_enter, METH_NOARGS,
+     "Context manager entry"},
+    {"__exit__", (PyCFunction)APSWPreparedStatement_exit, METH_VARARGS,
+     "Context manager exit"},
+    {0, 0, 0, 0} /* Sentinel */
+};
+
+static PyGetSetDef APSWPreparedStatement_getset[] = {
+    {"sql", (getter)APSWPreparedStatement_get_sql, NULL, "SQL text of the statement", NULL},
+    {"columncount", (getter)APSWPreparedStatement_get_columncount, NULL, "Number of columns in rows", NULL},
+    {"parametercount", (getter)APSWPreparedStatement_get_parametercount, NULL, "Number of parameters", NULL},
+    {NULL, NULL, NULL, NULL, NULL}};
+
+static PyTypeObject APSWPreparedStatementType = {
+    APSW_PYTYPE_INIT
+    "apsw.PreparedStatement",                         /*tp_name*/
+    sizeof(APSWPreparedStatement),                    /*tp_basicsize*/
+    0,                                                /*tp_itemsize*/
+    (destructor)APSWPreparedStatement_dealloc,        /*tp_dealloc*/
+    0,                                                /*tp_print*/
+    0,                                                /*tp_getattr*/
+    0,                                                /*tp_setattr*/
+    0,                                                /*tp_compare*/
+    0,                                                /*tp_repr*/
+    0,                                                /*tp_as_number*/
+    0,                                                /*tp_as_sequence*/
+    0,                                                /*tp_as_mapping*/
+    0,                                                /*tp_hash */
+    0,                                                /*tp_call*/
+    0,                                                /*tp_str*/
+    0,                                                /*tp_getattro*/
+    0,                                                /*tp_setattro*/
+    0,                                                /*tp_as_buffer*/
+    Py_TPFLAGS_DEFAULT | Py_TPFLAGS_HAVE_VERSION_TAG, /*tp_flags*/
+    "APSW prepared statement object",                 /* tp_doc */
+    0,                                                /* tp_traverse */
+    0,                                                /* tp_clear */
+    0,                                                /* tp_richcompare */
+    offsetof(APSWPreparedStatement, weakreflist),     /* tp_weaklistoffset */
+    0,                                                /* tp_iter */
+    0,                                                /* tp_iternext */
+    APSWPreparedStatement_methods,                    /* tp_methods */
+    0,                                                /* tp_members */
+    APSWPreparedStatement_getset,                     /* tp_getset */
+    0,                                                /* tp_base */
+    0,                                                /* tp_dict */
+    0,                                                /* tp_descr_get */
+    0,                                                /* tp_descr_set */
+    0,                                                /* tp_dictoffset */
+    0,                                                /* tp_init */
+    0,                                                /* tp_alloc */
+    0,                                                /* tp_new */
+    0,                                                /* tp_free */
+    0,                                                /* tp_is_gc */
+    0,                                                /* tp_bases */
+    0,                                                /* tp_mro */
+    0,                                                /* tp_cache */
+    0,                                                /* tp_subclasses */
+    0,                                                /* tp_weaklist */
+    0                                                 /* tp_del */
+    APSW_PYTYPE_VERSION};
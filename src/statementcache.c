@@ -16,7 +16,13 @@
    - The utf8 of the original text (APSWBuffer)
    - The utf8 of the first statement (APSWBuffer)
 
-   Currently only the first two are implemented.
+   Currently only the first two are implemented.  Each statement of a
+   multi-statement query is cached individually, keyed by the utf8 of
+   the text from that statement onwards.  That text is the same
+   APSWBuffer as the previous statement's next, so executing the same
+   query again finds each statement in turn, usually by identity.  A
+   key of just the statement's own text can't be used because next
+   belongs to the statement.
 
  */
 
@@ -27,11 +33,18 @@
    the interpreter gc intervals. */
 #define SC_NRECYCLE 32
 
-/* The maximum length of something in bytes that we would consider putting in the statement cache */
+/* The maximum length of a statement in bytes that we would consider
+   putting in the statement cache when there is no byte budget */
 #define SC_MAXSIZE 16384
 
-/* Define to do statement cache statistics */
-/* #define SC_STATS */
+/* Eviction policies */
+#define SC_POLICY_LRU 0  /* least recently used */
+#define SC_POLICY_COST 1 /* cheapest to prepare per byte amongst the least recently used */
+#define SC_POLICY_ARC 2  /* adaptive replacement cache */
+
+/* How many of the least recently used entries the cost policy
+   considers for eviction */
+#define SC_COSTWINDOW 16
 
 typedef struct APSWStatement {
   PyObject_HEAD
@@ -44,8 +57,20 @@ typedef struct APSWStatement {
   PyObject *origquery;              /* The original query object, also a key in the cache pointing to this same statement - could be NULL */
   struct APSWStatement *lru_prev;   /* previous item in lru list (ie more recently used than this one) */
   struct APSWStatement *lru_next;   /* next item in lru list (ie less recently used than this one) */
+  unsigned lrulist;                 /* which lru list the item is (or will be) in - always 0 except for ARC */
+  Py_ssize_t cachesize;             /* bytes counted against the cache budget */
+  sqlite3_int64 preparetime;        /* nanoseconds the most recent prepare took */
 } APSWStatement;
 
+/* A recently evicted key for ARC.  The tag is also the value in the
+   ghosts dict so that we can tell if the key has since been added
+   again. */
+typedef struct
+{
+  PyObject *key;
+  sqlite3_uint64 tag;
+} StatementCacheGhost;
+
 static PyTypeObject APSWStatementType;
 
 
@@ -55,24 +80,152 @@ typedef struct StatementCache {
   unsigned numentries;              /* how many APSWStatement entries
                                        we have in cache */
   unsigned maxentries;              /* maximum number of entries */
-  APSWStatement *mru;               /* most recently used entry (head of the list) */
-  APSWStatement *lru;               /* least recently used entry (tail of the list) */
-#ifdef SC_STATS
-  unsigned st_cachemiss;            /* entry was not in cache */
-  unsigned st_cachehit;             /* entry was in cache */
-  unsigned st_hitinuse;             /* was a hit but was inuse */
-#endif
+  Py_ssize_t numbytes;              /* cachesize total of entries */
+  Py_ssize_t maxbytes;              /* byte budget - zero for none */
+  int policy;                       /* SC_POLICY_ eviction policy */
+  /* Entries not in use are in a lru list.  ARC uses list 0 for
+     entries used once recently and list 1 for those used more
+     often.  The other policies only use list 0. */
+  APSWStatement *mru[2];            /* most recently used entry (head of the list) */
+  APSWStatement *lru[2];            /* least recently used entry (tail of the list) */
+  unsigned listcount[2];            /* how many entries in each list */
+  /* ARC */
+  unsigned arcp;                    /* target size of list 0 */
+  PyObject *ghosts;                 /* dict of recently evicted keys to tags */
+  StatementCacheGhost *ghostring[2]; /* recently evicted keys from each list, oldest first */
+  unsigned ghoststart[2];           /* index of oldest in ghostring */
+  unsigned ghostused[2];            /* entries used in ghostring */
+  unsigned ghostcount[2];           /* how many ghostring entries are still in ghosts */
+  sqlite3_uint64 ghosttag;          /* last tag used */
+  /* statistics - see statementcache_stats */
+  sqlite3_uint64 st_cachehit;       /* entry was in cache */
+  sqlite3_uint64 st_cachemiss;      /* entry was not in cache */
+  sqlite3_uint64 st_hitinuse;       /* was a hit but was inuse */
+  sqlite3_uint64 st_evictions;      /* entries removed to make space */
+  sqlite3_uint64 st_recycled;       /* statement objects reused from the recycle list */
+  sqlite3_uint64 st_prepares;       /* calls to sqlite3_prepare */
+  sqlite3_int64 st_preparetime;     /* nanoseconds spent in sqlite3_prepare */
+  sqlite3_uint64 st_toobig;         /* statements not cached because they were too big */
 #if SC_NRECYCLE > 0
   APSWStatement* recyclelist[SC_NRECYCLE];   /* recycle these rather than go through repeated malloc/free */
   unsigned nrecycle;                /* index of last entry in recycle list */
 #endif
 } StatementCache;
 
+/* Process wide cache of query text shared by all connections.  A
+   sqlite3_stmt can't be shared between connections, but the utf8
+   conversion, the split into statements and the APSWBuffer keys
+   (including their cached hash) can.  Connections in a pool running
+   the same SQL then use the same key objects, which also makes their
+   own cache lookups identity comparisons.  The dicts are cleared when
+   they reach sharedquery_maxentries. */
+static PyObject *sharedquery_queries = NULL; /* str -> APSWBuffer of its utf8 */
+static PyObject *sharedquery_tails = NULL;   /* APSWBuffer -> APSWBuffer of the statements after the first */
+static Py_ssize_t sharedquery_maxentries = 0;
+static sqlite3_uint64 sharedquery_hits = 0, sharedquery_misses = 0;
+
+/* Returns a new reference to the shared utf8 for query, or NULL if
+   there isn't one */
+static PyObject *
+sharedquery_get(PyObject *query)
+{
+  PyObject *utf8=PyDict_GetItem(sharedquery_queries, query);
+
+  if(utf8)
+    {
+      sharedquery_hits++;
+      Py_INCREF(utf8);
+    }
+  else
+    sharedquery_misses++;
+  return utf8;
+}
+
+static void
+sharedquery_add(PyObject *query, PyObject *utf8)
+{
+  if(PyDict_Size(sharedquery_queries)>=sharedquery_maxentries)
+    PyDict_Clear(sharedquery_queries);
+  /* failing to share isn't an error */
+  if(PyDict_SetItem(sharedquery_queries, query, utf8))
+    PyErr_Clear();
+}
+
+/* Returns a new reference to the remaining statements of utf8
+   starting at offset */
+static PyObject *
+sharedquery_tail(PyObject *utf8, Py_ssize_t offset)
+{
+  PyObject *tail;
+  Py_ssize_t len=APSWBuffer_GET_SIZE(utf8)-offset;
+
+  /* where SQLite ends a statement only depends on the text so the
+     length check is just defensive */
+  tail=PyDict_GetItem(sharedquery_tails, utf8);
+  if(tail && APSWBuffer_GET_SIZE(tail)==len)
+    {
+      Py_INCREF(tail);
+      return tail;
+    }
+
+  tail=APSWBuffer_FromObject(utf8, offset, len);
+  if(!tail)
+    return NULL;
+
+  if(PyDict_Size(sharedquery_tails)>=sharedquery_maxentries)
+    PyDict_Clear(sharedquery_tails);
+  if(PyDict_SetItem(sharedquery_tails, utf8, tail))
+    PyErr_Clear();
+  return tail;
+}
+
+/* Sets the maximum entries, returning the previous value or -1 on
+   error.  Zero disables and frees the shared cache */
+static Py_ssize_t
+sharedquery_setmaxentries(Py_ssize_t maxentries)
+{
+  Py_ssize_t old=sharedquery_maxentries;
+
+  if(maxentries<=0)
+    {
+      Py_CLEAR(sharedquery_queries);
+      Py_CLEAR(sharedquery_tails);
+      sharedquery_maxentries=0;
+      return old;
+    }
+
+  if(!sharedquery_queries)
+    {
+      sharedquery_queries=PyDict_New();
+      sharedquery_tails=PyDict_New();
+      if(!sharedquery_queries || !sharedquery_tails)
+        {
+          Py_CLEAR(sharedquery_queries);
+          Py_CLEAR(sharedquery_tails);
+          sharedquery_maxentries=0;
+          return -1;
+        }
+    }
+  sharedquery_maxentries=maxentries;
+  return old;
+}
+
+static PyObject *
+sharedquery_stats(void)
+{
+  return Py_BuildValue("{s: K, s: K, s: n, s: n, s: n}",
+                       "hits", (unsigned long long)sharedquery_hits,
+                       "misses", (unsigned long long)sharedquery_misses,
+                       "queries", sharedquery_queries?PyDict_Size(sharedquery_queries):0,
+                       "tails", sharedquery_tails?PyDict_Size(sharedquery_tails):0,
+                       "maxentries", sharedquery_maxentries);
+}
+
 #ifndef NDEBUG
 static void
 statementcache_sanity_check(StatementCache *sc)
 {
-  unsigned itemcountfwd, itemcountbackwd, i;
+  unsigned itemcountfwd, itemcountbackwd, i, list;
   APSWStatement *last, *item;
 
 #if SC_NRECYCLE > 0
@@ -82,76 +235,88 @@ statementcache_sanity_check(StatementCache *sc)
   assert(sc->nrecycle<=SC_NRECYCLE);
 #endif
 
-  /* make sure everything is fine */
-  if(!sc->mru || !sc->lru)
-    {
-      /* list should be empty */
-      assert(!sc->mru);
-      assert(!sc->lru);
-      return;
-    }
+  assert(sc->listcount[0]+sc->listcount[1]<=sc->numentries);
+  assert(sc->policy==SC_POLICY_ARC || !sc->mru[1]);
 
-  if(sc->mru == sc->lru)
+  for(list=0; list<2; list++)
     {
-      /* should be exactly one item */
-      assert(!sc->mru->lru_prev);
-      assert(!sc->mru->lru_next);
-      assert(sc->mru->incache);
-      assert(sc->mru->vdbestatement);
-      assert(!sc->mru->inuse);
-      return;
-    }
+      /* make sure everything is fine */
+      if(!sc->mru[list] || !sc->lru[list])
+        {
+          /* list should be empty */
+          assert(!sc->mru[list]);
+          assert(!sc->lru[list]);
+          assert(!sc->listcount[list]);
+          continue;
+        }
 
-  /* Must be two or more items.  If there are any loops then this function will
-     execute forever. */
+      if(sc->mru[list] == sc->lru[list])
+        {
+          /* should be exactly one item */
+          assert(!sc->mru[list]->lru_prev);
+          assert(!sc->mru[list]->lru_next);
+          assert(sc->mru[list]->incache);
+          assert(sc->mru[list]->vdbestatement);
+          assert(!sc->mru[list]->inuse);
+          assert(sc->mru[list]->lrulist==list);
+          assert(sc->listcount[list]==1);
+          continue;
+        }
 
-  /* check items going forward */
-  last=NULL;
-  itemcountfwd=0;
-  item=sc->mru;
+      /* Must be two or more items.  If there are any loops then this function will
+         execute forever. */
 
-  while(item)
-    {
-      /* check item thinks it is in cache */
-      assert(item->incache==1);
-      /* should not be inuse - inuse items are removed from lru list */
-      assert(!item->inuse);
-      /* does prev actually go to prev? */
-      assert(item->lru_prev==last);
-      /* check for loops */
-      assert(item->lru_prev!=item);
-      assert(item->lru_next!=item);
-      assert(item->lru_prev!=item->lru_next);
+      /* check items going forward */
+      last=NULL;
+      itemcountfwd=0;
+      item=sc->mru[list];
 
-      itemcountfwd++;
-      last=item;
-      item=item->lru_next;
-    }
-  assert(sc->lru==last);
+      while(item)
+        {
+          /* check item thinks it is in cache */
+          assert(item->incache==1);
+          /* should not be inuse - inuse items are removed from lru list */
+          assert(!item->inuse);
+          /* and in this list */
+          assert(item->lrulist==list);
+          /* does prev actually go to prev? */
+          assert(item->lru_prev==last);
+          /* check for loops */
+          assert(item->lru_prev!=item);
+          assert(item->lru_next!=item);
+          assert(item->lru_prev!=item->lru_next);
+
+          itemcountfwd++;
+          last=item;
+          item=item->lru_next;
+        }
+      assert(sc->lru[list]==last);
 
-  /* check items going backwards */
-  last=NULL;
-  itemcountbackwd=0;
-  item=sc->lru;
+      /* check items going backwards */
+      last=NULL;
+      itemcountbackwd=0;
+      item=sc->lru[list];
 
-  while(item)
-    {
-      /* does next actually go to next? */
-      assert(item->lru_next==last);
-      /* check for loops */
-      assert(item->lru_next!=item);
-      assert(item->lru_prev!=item);
-      assert(item->lru_prev!=item->lru_next);
-      /* statement not null */
-      assert(item->vdbestatement);
+      while(item)
+        {
+          /* does next actually go to next? */
+          assert(item->lru_next==last);
+          /* check for loops */
+          assert(item->lru_next!=item);
+          assert(item->lru_prev!=item);
+          assert(item->lru_prev!=item->lru_next);
+          /* statement not null */
+          assert(item->vdbestatement);
+
+          itemcountbackwd++;
+          last=item;
+          item=item->lru_prev;
+        }
 
-      itemcountbackwd++;
-      last=item;
-      item=item->lru_prev;
+      /* count should be same going forwards as going back */
+      assert(itemcountbackwd==itemcountfwd);
+      assert(itemcountfwd==sc->listcount[list]);
     }
-
-  /* count should be same going forwards as going back */
-  assert(itemcountbackwd==itemcountfwd);
 }
 
 /* verifies a particular value is not in the dictionary */
@@ -169,6 +334,226 @@ static void assert_not_in_dict(PyObject *dict, PyObject *check)
 #endif
 
 
+/* removes an entry from its lru list */
+static void
+statementcache_unlink(StatementCache *sc, APSWStatement *stmt)
+{
+  unsigned list=stmt->lrulist;
+
+  if(sc->mru[list]==stmt)
+    sc->mru[list]=stmt->lru_next;
+  if(sc->lru[list]==stmt)
+    sc->lru[list]=stmt->lru_prev;
+  if(stmt->lru_prev)
+    {
+      assert(stmt->lru_prev->lru_next==stmt);
+      stmt->lru_prev->lru_next=stmt->lru_next;
+    }
+  if(stmt->lru_next)
+    {
+      assert(stmt->lru_next->lru_prev==stmt);
+      stmt->lru_next->lru_prev=stmt->lru_prev;
+    }
+  stmt->lru_prev=stmt->lru_next=0;
+  assert(sc->listcount[list]);
+  sc->listcount[list]--;
+}
+
+/* plumbs an entry into the head of its lru list */
+static void
+statementcache_link(StatementCache *sc, APSWStatement *stmt)
+{
+  unsigned list=stmt->lrulist;
+
+  stmt->lru_next=sc->mru[list];
+  stmt->lru_prev=NULL;
+  if(sc->mru[list])
+    sc->mru[list]->lru_prev=stmt;
+  sc->mru[list]=stmt;
+  if(!sc->lru[list])
+    sc->lru[list]=stmt;
+  sc->listcount[list]++;
+}
+
+/* Forgets the oldest ghost of the list */
+static void
+statementcache_ghost_pop(StatementCache *sc, unsigned list)
+{
+  StatementCacheGhost *ghost=sc->ghostring[list]+sc->ghoststart[list];
+  PyObject *tag;
+
+  assert(sc->ghostused[list]);
+  tag=PyDict_GetItem(sc->ghosts, ghost->key);
+  if(tag && PyLong_AsUnsignedLongLong(tag)==ghost->tag)
+    {
+      if(PyDict_DelItem(sc->ghosts, ghost->key))
+        PyErr_Clear();
+      sc->ghostcount[list]--;
+    }
+  Py_CLEAR(ghost->key);
+  sc->ghoststart[list]=(sc->ghoststart[list]+1)%sc->maxentries;
+  sc->ghostused[list]--;
+}
+
+/* Remembers a key just evicted from the list */
+static void
+statementcache_ghost_add(StatementCache *sc, PyObject *key, unsigned list)
+{
+  StatementCacheGhost *ghost;
+  PyObject *tag, *existing;
+
+  if(sc->ghostused[list]==sc->maxentries)
+    statementcache_ghost_pop(sc, list);
+
+  existing=PyDict_GetItem(sc->ghosts, key);
+  if(existing)
+    sc->ghostcount[PyLong_AsUnsignedLongLong(existing)&1]--;
+
+  /* the bottom bit of the tag is the list */
+  sc->ghosttag+=2;
+  tag=PyLong_FromUnsignedLongLong(sc->ghosttag+list);
+  if(!tag || PyDict_SetItem(sc->ghosts, key, tag))
+    {
+      /* we just won't remember this one */
+      Py_XDECREF(tag);
+      if(existing)
+        PyDict_DelItem(sc->ghosts, key);
+      PyErr_Clear();
+      return;
+    }
+  Py_DECREF(tag);
+
+  ghost=sc->ghostring[list]+(sc->ghoststart[list]+sc->ghostused[list])%sc->maxentries;
+  Py_INCREF(key);
+  ghost->key=key;
+  ghost->tag=sc->ghosttag+list;
+  sc->ghostused[list]++;
+  sc->ghostcount[list]++;
+}
+
+/* If key was recently evicted then ARC adapts the target size of
+   list 0 and the key is forgotten.  Returns non-zero if it was a
+   ghost. */
+static int
+statementcache_ghost_hit(StatementCache *sc, PyObject *key)
+{
+  PyObject *tag=PyDict_GetItem(sc->ghosts, key);
+  unsigned list, delta, mine, other;
+
+  if(!tag)
+    return 0;
+  list=(unsigned)(PyLong_AsUnsignedLongLong(tag)&1);
+
+  /* a hit in the list 0 ghosts means list 0 should have been bigger
+     and vice versa */
+  mine=sc->ghostcount[list];
+  other=sc->ghostcount[!list];
+  delta=(other>mine)?other/mine:1;
+  if(list==0)
+    sc->arcp=(sc->arcp+delta>sc->maxentries)?sc->maxentries:sc->arcp+delta;
+  else
+    sc->arcp=(sc->arcp>delta)?sc->arcp-delta:0;
+
+  if(PyDict_DelItem(sc->ghosts, key))
+    PyErr_Clear();
+  else
+    sc->ghostcount[list]--;
+  return 1;
+}
+
+/* Removes one entry from the cache according to the policy.  Returns
+   zero if there was nothing to evict */
+static int
+statementcache_evict(StatementCache *sc)
+{
+  APSWStatement *evictee=NULL;
+
+  switch(sc->policy)
+    {
+    case SC_POLICY_ARC:
+      /* take from the recent list when it is bigger than its target */
+      if(sc->lru[0] && (sc->listcount[0]>sc->arcp || !sc->lru[1]))
+        evictee=sc->lru[0];
+      else
+        evictee=sc->lru[1];
+      break;
+
+    case SC_POLICY_COST:
+      {
+        APSWStatement *item;
+        double value, lowest=0;
+        unsigned i;
+
+        for(item=sc->lru[0], i=0; item && i<SC_COSTWINDOW; item=item->lru_prev, i++)
+          {
+            value=(double)item->preparetime/(double)(item->cachesize>0?item->cachesize:1);
+            if(!evictee || value<lowest)
+              {
+                evictee=item;
+                lowest=value;
+              }
+          }
+      }
+      break;
+
+    default:
+      evictee=sc->lru[0];
+      break;
+    }
+
+  /* no possibles to evict? */
+  if(!evictee)
+    return 0;
+
+  statementcache_unlink(sc, evictee);
+
+  assert(!evictee->inuse);
+  assert(evictee->incache);
+  statementcache_sanity_check(sc);
+
+  if(sc->ghosts)
+    statementcache_ghost_add(sc, evictee->utf8, evictee->lrulist);
+
+  /* only references should be the dict */
+  assert(Py_REFCNT(evictee)==1+!!evictee->origquery);
+
+  /* accounted for before deleting from the dict since that could free it */
+  sc->numentries -= 1;
+  sc->numbytes -= evictee->cachesize;
+  sc->st_evictions++;
+
+#if SC_NRECYCLE > 0
+  /* we don't gc to run on object */
+  Py_INCREF(evictee);
+#endif
+  if(evictee->origquery)
+    {
+      assert(evictee==(APSWStatement*)PyDict_GetItem(sc->cache, evictee->origquery));
+      PyDict_DelItem(sc->cache, evictee->origquery);
+      Py_DECREF(evictee->origquery);
+      evictee->origquery=NULL;
+    }
+  assert(evictee==(APSWStatement*)PyDict_GetItem(sc->cache, evictee->utf8));
+  PyDict_DelItem(sc->cache, evictee->utf8);
+  assert_not_in_dict(sc->cache, (PyObject*)evictee);
+  assert(!PyErr_Occurred());
+
+#if SC_NRECYCLE > 0
+  if(sc->nrecycle<SC_NRECYCLE)
+    {
+      assert(Py_REFCNT(evictee)==1);
+      sc->recyclelist[sc->nrecycle++]=evictee;
+      evictee->incache=0;
+    }
+  else
+    {
+      Py_DECREF(evictee);
+    }
+#endif
+  statementcache_sanity_check(sc);
+  return 1;
+}
+
 /* re-prepare for SQLITE_SCHEMA */
 static int
 statementcache_reprepare(StatementCache *sc, APSWStatement *statement)
@@ -179,16 +564,21 @@ statementcache_reprepare(StatementCache *sc, APSWStatement *statement)
   const char *buffer;
   Py_ssize_t buflen;
   int usepreparev2;
+  sqlite3_int64 starttime;
 
   usepreparev2=sqlite3_bind_parameter_count(statement->vdbestatement);
   buffer=APSWBuffer_AS_STRING(statement->utf8);
   buflen=APSWBuffer_GET_SIZE(statement->utf8);
   /* see statementcache_prepare */
   assert(buffer[buflen+1-1]==0);
+  starttime=apsw_monotonic_ns();
   PYSQLITE_SC_CALL(res=usepreparev2?
 		   sqlite3_prepare_v2(sc->db, buffer, buflen+1, &newvdbe, &tail):  /* PYSQLITE_SC_CALL */
 		   sqlite3_prepare(sc->db, buffer, buflen+1, &newvdbe, &tail)      /* PYSQLITE_SC_CALL */
 		   );
+  statement->preparetime=apsw_monotonic_ns()-starttime;
+  sc->st_preparetime+=statement->preparetime;
+  sc->st_prepares++;
   if(res!=SQLITE_OK)
     goto error;
 
@@ -226,16 +616,20 @@ statementcache_prepare(StatementCache *sc, PyObject *query, int usepreparev2)
   Py_ssize_t buflen;
   int res;
   PyObject *utf8=NULL;
+  sqlite3_int64 starttime;
 
   if(!APSWBuffer_Check(query))
     {
-      /* Check to see if query is already in cache.  The size checks are to
-         avoid calculating hashes on long strings */
-      if( sc->cache && sc->numentries && ((PyUnicode_CheckExact(query) && PyUnicode_GET_DATA_SIZE(query) < SC_MAXSIZE)
+      /* subclasses could have different hashing and equality */
+      int exact=PyUnicode_CheckExact(query)
 #if PY_MAJOR_VERSION < 3
-          || (PyString_CheckExact(query) && PyString_GET_SIZE(query) < SC_MAXSIZE)
+        || PyString_CheckExact(query)
 #endif
-                        ))
+        ;
+
+      /* Check to see if query is already in cache.  The string caches
+         its hash so repeated lookups are cheap */
+      if( sc->cache && sc->numentries && exact)
         {
           val=(APSWStatement*)PyDict_GetItem(sc->cache, query);
           if(val)
@@ -246,18 +640,28 @@ statementcache_prepare(StatementCache *sc, PyObject *query, int usepreparev2)
             }
         }
 
-      utf8=getutf8string(query);
+      /* another connection may already have converted it */
+      if(sharedquery_queries && exact)
+        utf8=sharedquery_get(query);
 
       if(!utf8)
-        return NULL;
+        {
+          utf8=getutf8string(query);
 
-      {
-        /* Make a buffer of utf8 which then owns underlying bytes */
-        PyObject *tmp=APSWBuffer_FromObject(utf8, 0, PyBytes_GET_SIZE(utf8));
-        Py_DECREF(utf8);
-        if(!tmp) return NULL;
-        utf8=tmp;
-      }
+          if(!utf8)
+            return NULL;
+
+          {
+            /* Make a buffer of utf8 which then owns underlying bytes */
+            PyObject *tmp=APSWBuffer_FromObject(utf8, 0, PyBytes_GET_SIZE(utf8));
+            Py_DECREF(utf8);
+            if(!tmp) return NULL;
+            utf8=tmp;
+          }
+
+          if(sharedquery_queries && exact)
+            sharedquery_add(query, utf8);
+        }
     }
   else
     {
@@ -268,8 +672,8 @@ statementcache_prepare(StatementCache *sc, PyObject *query, int usepreparev2)
 
   assert(APSWBuffer_Check(utf8));
 
-  /* if we have cache and utf8 is reasonable size? */
-  if(sc->cache && sc->numentries && APSWBuffer_GET_SIZE(utf8) < SC_MAXSIZE)
+  /* if we have cache? */
+  if(sc->cache && sc->numentries)
     {
       /* then is it in the cache? */
       val=(APSWStatement*)PyDict_GetItem(sc->cache, utf8);
@@ -279,7 +683,6 @@ statementcache_prepare(StatementCache *sc, PyObject *query, int usepreparev2)
  cachehit:
   assert(APSWBuffer_Check(utf8));
 
-#ifdef SC_STATS
   if(val)
     {
       sc->st_cachehit++;
@@ -288,7 +691,6 @@ statementcache_prepare(StatementCache *sc, PyObject *query, int usepreparev2)
     }
   else
     sc->st_cachemiss++;
-#endif
 
 
   if(val)
@@ -301,21 +703,10 @@ statementcache_prepare(StatementCache *sc, PyObject *query, int usepreparev2)
           val->inuse=1;
 
           /* unlink from lru tracking */
-          if(sc->mru==val)
-            sc->mru=val->lru_next;
-          if(sc->lru==val)
-            sc->lru=val->lru_prev;
-          if(val->lru_prev)
-            {
-              assert(val->lru_prev->lru_next==val);
-              val->lru_prev->lru_next=val->lru_next;
-            }
-          if(val->lru_next)
-            {
-              assert(val->lru_next->lru_prev==val);
-              val->lru_next->lru_prev=val->lru_prev;
-            }
-          val->lru_prev=val->lru_next=0;
+          statementcache_unlink(sc, val);
+          /* ARC promotes it to the frequently used list */
+          if(sc->policy==SC_POLICY_ARC)
+            val->lrulist=1;
           statementcache_sanity_check(sc);
 
           _PYSQLITE_CALL_V(sqlite3_clear_bindings(val->vdbestatement));
@@ -332,6 +723,7 @@ statementcache_prepare(StatementCache *sc, PyObject *query, int usepreparev2)
   if(sc->nrecycle)
     {
       val=sc->recyclelist[--sc->nrecycle];
+      sc->st_recycled++;
       assert(Py_REFCNT(val)==1);
       assert(!val->incache);
       assert(!val->inuse);
@@ -364,6 +756,11 @@ statementcache_prepare(StatementCache *sc, PyObject *query, int usepreparev2)
   val->next=NULL;
   val->vdbestatement=NULL;
   val->inuse=1;
+  val->cachesize=0;
+  val->preparetime=0;
+  /* ARC puts recently evicted statements straight into the frequently
+     used list */
+  val->lrulist=(sc->ghosts && statementcache_ghost_hit(sc, utf8))?1:0;
   Py_XINCREF(query);
   val->origquery=query;
 
@@ -375,9 +772,13 @@ statementcache_prepare(StatementCache *sc, PyObject *query, int usepreparev2)
      will always have had an extra zero on the end.  The assert is just to make
      sure */
   assert(buffer[buflen+1-1]==0);
+  starttime=apsw_monotonic_ns();
   PYSQLITE_SC_CALL(res=(usepreparev2)?
 		   sqlite3_prepare_v2(sc->db, buffer, buflen+1, &val->vdbestatement, &tail):  /* PYSQLITE_SC_CALL */
 		   sqlite3_prepare(sc->db, buffer, buflen+1, &val->vdbestatement, &tail));    /* PYSQLITE_SC_CALL */
+  val->preparetime=apsw_monotonic_ns()-starttime;
+  sc->st_preparetime+=val->preparetime;
+  sc->st_prepares++;
 
   /* Handle error.  We would have a Python error if vtable.FindFunction had an error */
   if(res!=SQLITE_OK || PyErr_Occurred())
@@ -394,7 +795,9 @@ statementcache_prepare(StatementCache *sc, PyObject *query, int usepreparev2)
   if(tail-buffer<buflen)
     {
       /* there are more statements */
-      val->next=APSWBuffer_FromObject(utf8, tail-buffer, buflen-(tail-buffer));
+      val->next=sharedquery_tails?
+        sharedquery_tail(utf8, tail-buffer):
+        APSWBuffer_FromObject(utf8, tail-buffer, buflen-(tail-buffer));
       if(!val->next) goto error;
     }
   return val;
@@ -450,8 +853,21 @@ statementcache_finalize(StatementCache *sc, APSWStatement *stmt, int reprepare_o
         return SQLITE_SCHEMA;
     }
 
+  if(!stmt->incache && sc->cache && stmt->vdbestatement)
+    {
+      int memused;
+
+      /* the statement text plus what SQLite allocated for it */
+      _PYSQLITE_CALL_V(memused=sqlite3_stmt_status(stmt->vdbestatement, SQLITE_STMTSTATUS_MEMUSED, 0));
+      stmt->cachesize=stmt->querylen+memused;
+      if(sc->maxbytes ? stmt->cachesize > sc->maxbytes : stmt->querylen >= SC_MAXSIZE)
+        sc->st_toobig++;
+    }
+
   /* is it going to be put in cache? */
-  if(stmt->incache || (sc->cache && stmt->vdbestatement && APSWBuffer_GET_SIZE(stmt->utf8) < SC_MAXSIZE && !PyDict_Contains(sc->cache, stmt->utf8)))
+  if(stmt->incache || (sc->cache && stmt->vdbestatement
+                       && (sc->maxbytes ? stmt->cachesize <= sc->maxbytes : stmt->querylen < SC_MAXSIZE)
+                       && !PyDict_Contains(sc->cache, stmt->utf8)))
     {
       /* add ourselves to cache */
       if(!stmt->incache)
@@ -467,89 +883,23 @@ statementcache_finalize(StatementCache *sc, APSWStatement *stmt, int reprepare_o
                 PyDict_SetItem(sc->cache, stmt->origquery, (PyObject*)stmt);
           stmt->incache=1;
           sc->numentries += 1;
+          sc->numbytes += stmt->cachesize;
         }
 
       assert(PyDict_Contains(sc->cache, stmt->utf8));
 
-      /* do we need to do an evict? */
-      while(sc->numentries > sc->maxentries)
-        {
-          APSWStatement *evictee=sc->lru;
-          statementcache_sanity_check(sc);
-          assert(evictee!=stmt);      /* we were inuse and so should not be on evict list */
-
-          /* no possibles to evict? */
-          if(!sc->lru)
-            break;
-
-          /* only entry? */
-          if(!evictee->lru_prev)
-            {
-              assert(sc->mru==evictee);   /* points to sole entry */
-              assert(sc->lru==evictee);   /* points to sole entry */
-              assert(!evictee->lru_prev); /* should be anyone before */
-              assert(!evictee->lru_next); /* or after */
-              sc->mru=NULL;
-              sc->lru=NULL;
-              goto delevictee;
-            }
-          /* take out lru member */
-          sc->lru=evictee->lru_prev;
-          assert(sc->lru->lru_next==evictee);
-          sc->lru->lru_next=NULL;
-
-        delevictee:
-          assert(!evictee->inuse);
-          assert(evictee->incache);
-          statementcache_sanity_check(sc);
-
-          /* only references should be the dict */
-          assert(Py_REFCNT(evictee)==1+!!evictee->origquery);
-
-#if SC_NRECYCLE > 0
-          /* we don't gc to run on object */
-          Py_INCREF(evictee);
-#endif
-          if(evictee->origquery)
-            {
-              assert(evictee==(APSWStatement*)PyDict_GetItem(sc->cache, evictee->origquery));
-              PyDict_DelItem(sc->cache, evictee->origquery);
-              Py_DECREF(evictee->origquery);
-              evictee->origquery=NULL;
-            }
-          assert(evictee==(APSWStatement*)PyDict_GetItem(sc->cache, evictee->utf8));
-          PyDict_DelItem(sc->cache, evictee->utf8);
-          assert_not_in_dict(sc->cache, (PyObject*)evictee);
-          assert(!PyErr_Occurred());
-
-#if SC_NRECYCLE > 0
-          if(sc->nrecycle<SC_NRECYCLE)
-            {
-              assert(Py_REFCNT(evictee)==1);
-              sc->recyclelist[sc->nrecycle++]=evictee;
-              evictee->incache=0;
-            }
-          else
-            {
-              Py_DECREF(evictee);
-            }
-#endif
-          sc->numentries -= 1;
-          statementcache_sanity_check(sc);
-        }
+      /* do we need to do an evict?  We were inuse and so can't be
+         evicted ourselves */
+      while(sc->numentries > sc->maxentries || (sc->maxbytes && sc->numbytes > sc->maxbytes))
+        if(!statementcache_evict(sc))
+          break;
 
       statementcache_sanity_check(sc);
 
       /* plumb ourselves into head of lru list */
       assert(stmt->inuse);
       stmt->inuse=0;
-      stmt->lru_next=sc->mru;
-      stmt->lru_prev=NULL;
-      if(sc->mru)
-        sc->mru->lru_prev=stmt;
-      sc->mru=stmt;
-      if(!sc->lru)
-        sc->lru=stmt;
+      statementcache_link(sc, stmt);
       statementcache_sanity_check(sc);
     }
 
@@ -602,8 +952,10 @@ statementcache_next(StatementCache *sc, APSWStatement **ppstmt, int usepreparev2
 
 
 
+static void statementcache_free(StatementCache *sc);
+
 static StatementCache*
-statementcache_init(sqlite3 *db, unsigned nentries)
+statementcache_init(sqlite3 *db, unsigned nentries, Py_ssize_t maxbytes, int policy)
 {
   StatementCache *sc=(StatementCache*)PyMem_Malloc(sizeof(StatementCache));
   if(!sc) return NULL;
@@ -623,12 +975,33 @@ statementcache_init(sqlite3 *db, unsigned nentries)
         }
     }
   sc->maxentries=nentries;
-  sc->mru=NULL;
-  sc->lru=NULL;
+  sc->maxbytes=maxbytes;
+  sc->policy=policy;
+  if(nentries && policy==SC_POLICY_ARC)
+    {
+      unsigned list;
+
+      sc->ghosts=PyDict_New();
+      if(!sc->ghosts)
+        goto error;
+      for(list=0; list<2; list++)
+        {
+          sc->ghostring[list]=PyMem_New(StatementCacheGhost, nentries);
+          if(!sc->ghostring[list])
+            {
+              PyErr_NoMemory();
+              goto error;
+            }
+        }
+    }
 #if SC_NRECYCLE > 0
   sc->nrecycle=0;
 #endif
   return sc;
+
+ error:
+  statementcache_free(sc);
+  return NULL;
 }
 
 static void
@@ -642,11 +1015,18 @@ statementcache_free(StatementCache *sc)
     }
 #endif
   Py_XDECREF(sc->cache);
-  PyMem_Free(sc);
+  if(sc->ghosts)
+    {
+      unsigned list;
 
-#ifdef SC_STATS
-  fprintf(stderr, "SC Miss: %u Hit: %u HitButInuse: %u\n", sc->st_cachemiss, sc->st_cachehit, sc->st_hitinuse);
-#endif
+      for(list=0; list<2; list++)
+        while(sc->ghostring[list] && sc->ghostused[list])
+          statementcache_ghost_pop(sc, list);
+      Py_DECREF(sc->ghosts);
+    }
+  PyMem_Free(sc->ghostring[0]);
+  PyMem_Free(sc->ghostring[1]);
+  PyMem_Free(sc);
 }
 
 static void
@@ -679,6 +1059,53 @@ convertutf8buffersizetounicode(PyObject *buffer, Py_ssize_t len)
   return convertutf8stringsize(APSWBuffer_AS_STRING(buffer), len);
 }
 
+/* Returns a dict of the statistics.  Entries are listed most recently
+   used first */
+static PyObject *
+statementcache_stats(StatementCache *sc)
+{
+  PyObject *entries=NULL, *res=NULL;
+  APSWStatement *item;
+  unsigned list;
+  static const char *const policies[]={"lru", "cost", "arc"};
+
+  entries=PyList_New(0);
+  if(!entries) goto error;
+
+  for(list=0; list<2; list++)
+    for(item=sc->mru[list]; item; item=item->lru_next)
+      {
+        PyObject *sql=convertutf8buffertounicode(item->utf8);
+        if(!sql) goto error;
+        if(PyList_Append(entries, sql))
+          {
+            Py_DECREF(sql);
+            goto error;
+          }
+        Py_DECREF(sql);
+      }
+
+  res=Py_BuildValue("{s: K, s: K, s: K, s: K, s: K, s: K, s: d, s: K, s: I, s: I, s: n, s: n, s: s, s: O}",
+                    "hits", (unsigned long long)sc->st_cachehit,
+                    "misses", (unsigned long long)sc->st_cachemiss,
+                    "hits_inuse", (unsigned long long)sc->st_hitinuse,
+                    "evictions", (unsigned long long)sc->st_evictions,
+                    "recycled", (unsigned long long)sc->st_recycled,
+                    "prepares", (unsigned long long)sc->st_prepares,
+                    "prepare_time", sc->st_preparetime/1e9,
+                    "too_big", (unsigned long long)sc->st_toobig,
+                    "size", sc->numentries,
+                    "maxentries", sc->maxentries,
+                    "bytes", sc->numbytes,
+                    "maxbytes", sc->maxbytes,
+                    "policy", policies[sc->policy],
+                    "entries", entries);
+
+ error:
+  Py_XDECREF(entries);
+  return res;
+}
+
 
 static PyTypeObject APSWStatementType =
   {
@@ -89,6 +89,26 @@
 #define APSW_ARGUNUSED
 #endif
 
+/* Monotonic clock in nanoseconds for measuring how long things take */
+static sqlite3_int64
+apsw_monotonic_ns(void)
+{
+#ifdef _WIN32
+  static LARGE_INTEGER frequency;
+  LARGE_INTEGER now;
+
+  if (!frequency.QuadPart)
+    QueryPerformanceFrequency(&frequency);
+  QueryPerformanceCounter(&now);
+  return (sqlite3_int64)((double)now.QuadPart * 1e9 / (double)frequency.QuadPart);
+#else
+  struct timespec ts;
+
+  clock_gettime(CLOCK_MONOTONIC, &ts);
+  return (sqlite3_int64)ts.tv_sec * 1000000000 + ts.tv_nsec;
+#endif
+}
+
 /* used to decide if we will use int (4 bytes) or long long (8 bytes) */
 #define APSW_INT32_MIN (-2147483647 - 1)
 #define APSW_INT32_MAX 2147483647
@@ -211,6 +231,63 @@ finally:
 
 #endif /* Py_UNICODE_SIZE */
 
+/* Integers and whole number floats in this range are very common
+   (counts, flags, small keys) so the Python objects are created once
+   and then shared, avoiding an allocation per value.  Both types are
+   immutable so sharing is safe. */
+#define APSW_NUMCACHE_MIN (-128)
+#define APSW_NUMCACHE_MAX 1024
+
+static PyObject *apsw_intcache[APSW_NUMCACHE_MAX - APSW_NUMCACHE_MIN];
+static PyObject *apsw_floatcache[APSW_NUMCACHE_MAX - APSW_NUMCACHE_MIN];
+
+/* Converts an integer to PyObject.  Returns a new reference. */
+static PyObject *
+convert_int64_to_pyobject(sqlite3_int64 val)
+{
+  PyObject **slot;
+
+  if (val < APSW_NUMCACHE_MIN || val >= APSW_NUMCACHE_MAX)
+  {
+#if PY_MAJOR_VERSION < 3
+    if (val >= LONG_MIN && val <= LONG_MAX)
+      return PyInt_FromLong((long)val);
+#endif
+    return PyLong_FromLongLong(val);
+  }
+
+  slot = &apsw_intcache[val - APSW_NUMCACHE_MIN];
+  if (!*slot)
+#if PY_MAJOR_VERSION < 3
+    *slot = PyInt_FromLong((long)val);
+#else
+    *slot = PyLong_FromLongLong(val);
+#endif
+  Py_XINCREF(*slot);
+  return *slot;
+}
+
+/* Converts a double to PyObject.  Returns a new reference. */
+static PyObject *
+convert_double_to_pyobject(double val)
+{
+  PyObject **slot;
+  int i;
+
+  /* the comparisons are false for NaN, and -0.0 must keep its sign */
+  if (!(val >= APSW_NUMCACHE_MIN && val < APSW_NUMCACHE_MAX))
+    return PyFloat_FromDouble(val);
+  i = (int)val;
+  if (i != val || (i == 0 && copysign(1.0, val) < 0))
+    return PyFloat_FromDouble(val);
+
+  slot = &apsw_floatcache[i - APSW_NUMCACHE_MIN];
+  if (!*slot)
+    *slot = PyFloat_FromDouble(val);
+  Py_XINCREF(*slot);
+  return *slot;
+}
+
 /* Converts sqlite3_value to PyObject.  Returns a new reference. */
 static PyObject *
 convert_value_to_pyobject(sqlite3_value *value)
@@ -224,15 +301,11 @@ convert_value_to_pyobject(sqlite3_value *value)
   case SQLITE_INTEGER:
   {
     sqlite3_int64 val = sqlite3_value_int64(value);
-#if PY_MAJOR_VERSION < 3
-    if (val >= LONG_MIN && val <= LONG_MAX)
-      return PyInt_FromLong((long)val);
-#endif
-    return PyLong_FromLongLong(val);
+    return convert_int64_to_pyobject(val);
   }
 
   case SQLITE_FLOAT:
-    return PyFloat_FromDouble(sqlite3_value_double(value));
+    return convert_double_to_pyobject(sqlite3_value_double(value));
 
   case SQLITE_TEXT:
     return convertutf8stringsize((const char *)sqlite3_value_text(value), sqlite3_value_bytes(value));
@@ -269,18 +342,14 @@ convert_column_to_pyobject(sqlite3_stmt *stmt, int col)
   {
     sqlite3_int64 val;
     _PYSQLITE_CALL_V(val = sqlite3_column_int64(stmt, col));
-#if PY_MAJOR_VERSION < 3
-    if (val >= LONG_MIN && val <= LONG_MAX)
-      return PyInt_FromLong((long)val);
-#endif
-    return PyLong_FromLongLong(val);
+    return convert_int64_to_pyobject(val);
   }
 
   case SQLITE_FLOAT:
   {
     double d;
     _PYSQLITE_CALL_V(d = sqlite3_column_double(stmt, col));
-    return PyFloat_FromDouble(d);
+    return convert_double_to_pyobject(d);
   }
   case SQLITE_TEXT:
   {
@@ -309,6 +378,136 @@ convert_column_to_pyobject(sqlite3_stmt *stmt, int col)
   return NULL;
 }
 
+/* The row fast path.  convert_column_to_pyobject releases and
+   reacquires the GIL for every SQLite call it makes which adds up for
+   rows with many columns.  Instead we release the GIL once, get the
+   values of every column while holding the database mutex, and then
+   make the Python objects. */
+
+typedef struct
+{
+  int coltype;
+  sqlite3_int64 intval;
+  double doubleval;
+  const void *data;
+  int len;
+} apsw_column_value;
+
+/* rows with up to this many columns don't need memory allocated */
+#define ROW_FASTPATH_STACK_COLUMNS 32
+
+/* Must be called with the GIL released.  Pointers to text and blob
+   data are valid until the statement is next stepped, reset or
+   finalized.  If coerce is not NULL then non-null values of a column
+   with a non-zero entry are converted to that SQLITE_ type. */
+static void
+fetch_row_values(sqlite3_stmt *stmt, int numcols, apsw_column_value *values, const int *coerce)
+{
+  sqlite3_mutex *mutex = sqlite3_db_mutex(sqlite3_db_handle(stmt)); /* PYSQLITE_CALL done by caller */
+  int i;
+
+  sqlite3_mutex_enter(mutex); /* PYSQLITE_CALL done by caller */
+  for (i = 0; i < numcols; i++)
+  {
+    apsw_column_value *value = values + i;
+
+    value->coltype = sqlite3_column_type(stmt, i); /* PYSQLITE_CALL done by caller */
+    if (coerce && coerce[i] && value->coltype != SQLITE_NULL)
+      value->coltype = coerce[i];
+    switch (value->coltype)
+    {
+    case SQLITE_INTEGER:
+      value->intval = sqlite3_column_int64(stmt, i); /* PYSQLITE_CALL done by caller */
+      break;
+    case SQLITE_FLOAT:
+      value->doubleval = sqlite3_column_double(stmt, i); /* PYSQLITE_CALL done by caller */
+      break;
+    case SQLITE_TEXT:
+      value->data = sqlite3_column_text(stmt, i); /* PYSQLITE_CALL done by caller */
+      value->len = sqlite3_column_bytes(stmt, i); /* PYSQLITE_CALL done by caller */
+      break;
+    case SQLITE_BLOB:
+      value->data = sqlite3_column_blob(stmt, i); /* PYSQLITE_CALL done by caller */
+      value->len = sqlite3_column_bytes(stmt, i); /* PYSQLITE_CALL done by caller */
+      break;
+    }
+  }
+  sqlite3_mutex_leave(mutex); /* PYSQLITE_CALL done by caller */
+}
+
+/* Converts a value from fetch_row_values.  Returns a new reference. */
+static PyObject *
+convert_column_value_to_pyobject(apsw_column_value *value)
+{
+  int coltype = value->coltype;
+
+  APSW_FAULT_INJECT(UnknownColumnType, , coltype = 12348);
+
+  switch (coltype)
+  {
+  case SQLITE_INTEGER:
+    return convert_int64_to_pyobject(value->intval);
+
+  case SQLITE_FLOAT:
+    return convert_double_to_pyobject(value->doubleval);
+
+  case SQLITE_TEXT:
+    return convertutf8stringsize(value->data, value->len);
+
+  case SQLITE_NULL:
+    Py_RETURN_NONE;
+
+  case SQLITE_BLOB:
+    return converttobytes(value->data, value->len);
+
+  default:
+    return PyErr_Format(APSWException, "Unknown sqlite column type %d!", coltype);
+  }
+  /* can't get here */
+  assert(0);
+  return NULL;
+}
+
+/* Converts all the columns of the current row into a tuple.  Returns
+   a new reference. */
+static PyObject *
+convert_row_to_pyobject(sqlite3_stmt *stmt, int numcols)
+{
+  apsw_column_value stackvalues[ROW_FASTPATH_STACK_COLUMNS];
+  apsw_column_value *values = stackvalues;
+  PyObject *row = NULL, *item;
+  int i;
+
+  if (numcols > ROW_FASTPATH_STACK_COLUMNS)
+  {
+    values = PyMem_Malloc(sizeof(apsw_column_value) * numcols);
+    if (!values)
+      return PyErr_NoMemory();
+  }
+
+  _PYSQLITE_CALL_V(fetch_row_values(stmt, numcols, values, NULL));
+
+  row = PyTuple_New(numcols);
+  if (!row)
+    goto finally;
+
+  for (i = 0; i < numcols; i++)
+  {
+    item = convert_column_value_to_pyobject(values + i);
+    if (!item)
+    {
+      Py_CLEAR(row);
+      goto finally;
+    }
+    PyTuple_SET_ITEM(row, i, item);
+  }
+
+finally:
+  if (values != stackvalues)
+    PyMem_Free(values);
+  return row;
+}
+
 /* Some macros used for frequent operations */
 
 /* used by Connection and Cursor */
@@ -370,3 +569,84 @@ static size_t apsw_strnlen(const char *s, size_t maxlen)
   }
   return res;
 }
+
+#if PY_MAJOR_VERSION >= 3
+/* Owns memory from sqlite3_malloc, providing it via the buffer
+   protocol so memoryviews can use it without copying.  size is what
+   is provided which can be less than allocated. */
+typedef struct
+{
+  PyObject_HEAD
+  void *data;
+  Py_ssize_t size;
+  Py_ssize_t allocated;
+  int readonly;
+} APSWSQLiteMemory;
+
+static void
+APSWSQLiteMemory_dealloc(APSWSQLiteMemory *self)
+{
+  sqlite3_free(self->data); /* PYSQLITE_CALL not needed - no error message */
+  Py_TYPE(self)->tp_free((PyObject *)self);
+}
+
+static int
+APSWSQLiteMemory_getbuffer(APSWSQLiteMemory *self, Py_buffer *view, int flags)
+{
+  return PyBuffer_FillInfo(view, (PyObject *)self, self->data, self->size, self->readonly, flags);
+}
+
+static PyBufferProcs APSWSQLiteMemory_as_buffer = {
+    (getbufferproc)APSWSQLiteMemory_getbuffer, /* bf_getbuffer */
+    0                                          /* bf_releasebuffer */
+};
+
+static PyTypeObject APSWSQLiteMemoryType = {
+    APSW_PYTYPE_INIT
+    "apsw.SQLiteMemory",                           /*tp_name*/
+    sizeof(APSWSQLiteMemory),                      /*tp_basicsize*/
+    0,                                             /*tp_itemsize*/
+    (destructor)APSWSQLiteMemory_dealloc,          /*tp_dealloc*/
+    0,                                             /*tp_print*/
+    0,                                             /*tp_getattr*/
+    0,                                             /*tp_setattr*/
+    0,                                             /*tp_compare*/
+    0,                                             /*tp_repr*/
+    0,                                             /*tp_as_number*/
+    0,                                             /*tp_as_sequence*/
+    0,                                             /*tp_as_mapping*/
+    0,                                             /*tp_hash */
+    0,                                             /*tp_call*/
+    0,                                             /*tp_str*/
+    0,                                             /*tp_getattro*/
+    0,                                             /*tp_setattro*/
+    &APSWSQLiteMemory_as_buffer,                   /*tp_as_buffer*/
+    Py_TPFLAGS_DEFAULT | Py_TPFLAGS_HAVE_VERSION_TAG, /*tp_flags*/
+    "Memory allocated by SQLite",                  /* tp_doc */
+    0,                                             /* tp_traverse */
+    0,                                             /* tp_clear */
+    0,                                             /* tp_richcompare */
+    0,                                             /* tp_weaklistoffset */
+    0,                                             /* tp_iter */
+    0,                                             /* tp_iternext */
+    0,                                             /* tp_methods */
+    0,                                             /* tp_members */
+    0,                                             /* tp_getset */
+    0,                                             /* tp_base */
+    0,                                             /* tp_dict */
+    0,                                             /* tp_descr_get */
+    0,                                             /* tp_descr_set */
+    0,                                             /* tp_dictoffset */
+    0,                                             /* tp_init */
+    0,                                             /* tp_alloc */
+    0,                                             /* tp_new */
+    0,                                             /* tp_free */
+    0,                                             /* tp_is_gc */
+    0,                                             /* tp_bases */
+    0,                                             /* tp_mro */
+    0,                                             /* tp_cache */
+    0,                                             /* tp_subclasses */
+    0,                                             /* tp_weaklist */
+    0                                              /* tp_del */
+    APSW_PYTYPE_VERSION};
+#endif
@@ -320,6 +320,7 @@ class APSW(unittest.TestCase):
 
     connection_nargs={ # number of args for function.  those not listed take zero
         'createaggregatefunction': 2,
+        'createwindowfunction': 2,
         'createcollation': 2,
         'createscalarfunction': 3,
         'collationneeded': 1,
@@ -344,6 +345,8 @@ class APSW(unittest.TestCase):
         'readonly': 1,
         'db_filename': 1,
         'set_last_insert_rowid': 1,
+        'serialize': 1,
+        'deserialize': 2,
         }
 
     cursor_nargs = {
@@ -869,6 +872,329 @@ class APSW(unittest.TestCase):
         finally:
             sys.setdefaultencoding(enc)
 
+    def testRowFastPath(self):
+        "Check the row conversion fast path gives identical results"
+        self.assertEqual(False, self.db.rowfastpath)
+        c = self.db.cursor()
+        self.assertEqual(False, c.rowfastpath)
+        # more columns than are handled without allocating memory
+        numcols = 70
+        vals = [v for v in test_types_vals if not hasattr(v, "__len__") or len(v) < 10000]
+        c.execute("create table foo(%s)" % (",".join("c%d" % i for i in range(numcols)), ))
+        for i in range(len(vals)):
+            row = [vals[(i + j) % len(vals)] for j in range(numcols)]
+            c.execute("insert into foo values(%s)" % (",".join("?" * numcols), ), row)
+        for sql in ("select * from foo", "select c0, c1, c2 from foo", "select 3, 'abc', x'aabb', 1.5, null"):
+            expected = c.execute(sql).fetchall()
+            self.db.rowfastpath = True
+            self.assertEqual(True, c.rowfastpath)
+            self.assertEqual(expected, c.execute(sql).fetchall())
+            self.assertEqual(expected, self.db.cursor().execute(sql).fetchall())
+            self.db.rowfastpath = False
+            # cursor setting overrides connection
+            c.rowfastpath = True
+            self.assertEqual(True, c.rowfastpath)
+            self.assertEqual(expected, c.execute(sql).fetchall())
+            c.rowfastpath = None
+            self.assertEqual(False, c.rowfastpath)
+        # row tracers still apply
+        c.rowfastpath = True
+        c.setrowtrace(lambda cur, row: row[0] * 2 if row[0] % 2 else None)
+        self.assertEqual([2, 6], c.execute("select 1 union all select 2 union all select 3").fetchall())
+        c.setrowtrace(None)
+        # non-bool values use their truthiness
+        self.db.rowfastpath = 7
+        self.assertEqual(True, self.db.rowfastpath)
+        c.rowfastpath = []
+        self.assertEqual(False, c.rowfastpath)
+
+        def delattrs():
+            del self.db.rowfastpath
+
+        self.assertRaises(TypeError, delattrs)
+
+    def testFetchMany(self):
+        "Check fetchmany and fetchbatches"
+        c = self.db.cursor()
+        c.execute("create table foo(x); insert into foo values(1)")
+        for i in range(9):
+            c.execute("insert into foo select max(x)+1 from foo")
+        self.assertEqual([], c.fetchmany())
+        c.execute("select x from foo order by x")
+        self.assertEqual([(1, )], c.fetchmany())
+        self.assertEqual([], c.fetchmany(0))
+        self.assertEqual([(2, ), (3, ), (4, )], c.fetchmany(3))
+        self.assertEqual([(5, ), (6, ), (7, )], c.fetchmany(size=3))
+        self.assertEqual([(8, ), (9, ), (10, )], c.fetchmany(100))
+        self.assertEqual([], c.fetchmany(3))
+        self.assertRaises(ValueError, c.fetchmany, -1)
+        self.assertRaises(TypeError, c.fetchmany, "three")
+        # multiple statements
+        c.execute("select 1; select 2, 3; select 4")
+        self.assertEqual([(1, ), (2, 3)], c.fetchmany(2))
+        self.assertEqual([(4, )], c.fetchmany(2))
+        # row tracer skipping rows
+        c.setrowtrace(lambda cur, row: row if row[0] % 2 else None)
+        self.assertEqual([(1, ), (3, ), (5, )], c.execute("select x from foo order by x").fetchmany(3))
+        c.setrowtrace(None)
+        # batches
+        c.execute("select x from foo order by x")
+        self.assertEqual([[(i, ) for i in range(j, min(j + 4, 11))] for j in (1, 5, 9)], list(c.fetchbatches(4)))
+        self.assertEqual([], list(c.fetchbatches(4)))
+        self.assertEqual([[(x, ) for x in range(1, 11)]], list(c.execute("select x from foo order by x").fetchbatches()))
+        self.assertEqual([], list(c.execute("select x from foo where x>100").fetchbatches()))
+        self.assertRaises(ValueError, c.fetchbatches, 0)
+        self.assertRaises(TypeError, c.fetchbatches, size="three")
+
+        # errors part way through
+        def fail(x):
+            if x == 5:
+                1 / 0
+            return x
+
+        self.db.createscalarfunction("fail", fail)
+        c.execute("select fail(x) from foo")
+        self.assertRaises(ZeroDivisionError, c.fetchmany, 10)
+        batches = c.execute("select fail(x) from foo").fetchbatches(3)
+        self.assertEqual([(1, ), (2, ), (3, )], _realnext(batches))
+        self.assertRaises(ZeroDivisionError, _realnext, batches)
+
+    def testFetchColumns(self):
+        "Check fetchcolumns"
+        if not hasattr(apsw.Cursor, "fetchcolumns"):
+            return
+        import math
+        c = self.db.cursor()
+        c.execute("create table foo(i integer, r real, t text, b blob, n numeric, a)")
+        rows = [
+            (1, 1.5, "one", b(r"\x01"), 1, "x"),
+            (None, None, None, None, None, None),
+            (-3, 2, u(r"\N{BLACK STAR}"), b(r""), 2.5, 3),
+            (9223372036854775807, -1e300, "", b(r"abc\0d"), "n", b(r"z")),
+        ]
+        c.executemany("insert into foo values(?,?,?,?,?,?)", rows)
+        self.assertEqual((), c.fetchcolumns())
+        i, r, t, bl, n, a = c.execute("select * from foo").fetchcolumns()
+        self.assertEqual([1, 0, -3, 9223372036854775807], i.tolist())
+        self.assertEqual("q", i.format)
+        self.assertEqual("d", r.format)
+        self.assertEqual(1.5, r[0])
+        self.assertTrue(math.isnan(r[1]))
+        self.assertEqual([2.0, -1e300], r.tolist()[2:])
+        offsets, data = t
+        self.assertEqual([0, 3, 3, 6, 6], offsets.tolist())
+        self.assertEqual(["one", "", u(r"\N{BLACK STAR}"), ""],
+                         [data[offsets[x]:offsets[x + 1]].tobytes().decode("utf8") for x in range(4)])
+        offsets, data = bl
+        self.assertEqual([b(r"\x01"), b(r""), b(r""), b(r"abc\0d")], [data[offsets[x]:offsets[x + 1]].tobytes() for x in range(4)])
+        self.assertEqual([1, None, 2.5, "n"], n)
+        self.assertEqual(["x", None, 3, b(r"z")], a)
+        self.assertEqual((), c.fetchcolumns())
+        # expressions have no declared type
+        self.assertEqual(["3", 4.7], c.execute("select '3' union all select 4.7").fetchcolumns()[0])
+        # values are converted to the declared type
+        c.execute("create table co(i integer, r real, b blob); insert into co values('abc', 'def', 3.5)")
+        i, r, bl = c.execute("select * from co").fetchcolumns()
+        self.assertEqual([0], i.tolist())
+        self.assertEqual([0.0], r.tolist())
+        self.assertEqual(b("3.5"), bl[1].tobytes())
+        # maxrows and continuing
+        c.execute("select i from foo")
+        self.assertEqual([1, 0], c.fetchcolumns(2)[0].tolist())
+        self.assertEqual([], c.fetchcolumns(0)[0].tolist())
+        self.assertEqual((-3, ), c.fetchone())
+        self.assertEqual([9223372036854775807], c.fetchcolumns(10)[0].tolist())
+        self.assertEqual((), c.fetchcolumns())
+        self.assertRaises(TypeError, c.fetchcolumns, "three")
+        # multiple statements stop at each statement
+        c.execute("select i from foo where i>0; select t, r from foo where r>0; select 7")
+        self.assertEqual([1, 9223372036854775807], c.fetchcolumns()[0].tolist())
+        t, r = c.fetchcolumns()
+        self.assertEqual([1.5, 2.0], r.tolist())
+        self.assertEqual([7], c.fetchcolumns()[0])
+        self.assertEqual((), c.fetchcolumns())
+        # executemany bindings are each a statement
+        c.executemany("select i from foo where i=?", ((1, ), (-3, )))
+        self.assertEqual([1], c.fetchcolumns()[0].tolist())
+        self.assertEqual([-3], c.fetchcolumns()[0].tolist())
+        # usable with array
+        import array
+        self.assertEqual(array.array("q", [1, 0, -3, 9223372036854775807]),
+                         array.array("q", c.execute("select i from foo").fetchcolumns()[0]))
+
+        # errors part way through
+        def fail(x):
+            if x == 3:
+                1 / 0
+            return x
+
+        self.db.createscalarfunction("fail", fail)
+        c.execute("create table bar(x integer); insert into bar values(1),(2),(3),(4)")
+        c.execute("select cast(fail(x) as integer) from bar")
+        self.assertRaises(ZeroDivisionError, c.fetchcolumns)
+
+    def testExecuteColumns(self):
+        "Check executecolumns"
+        import array
+        c = self.db.cursor()
+        c.execute("create table foo(x,y,z)")
+        ints = array.array("q", [1, -2, 9223372036854775807, -9223372036854775808])
+        doubles = array.array("d", [0.5, -1e300, 3, 4])
+        shorts = array.array("H", [0, 1, 65535, 7])
+        self.assertEqual(None, c.executecolumns("insert into foo values(?,?,?)", (ints, doubles, shorts)))
+        self.assertEqual(list(zip(ints, doubles, shorts)), c.execute("select * from foo").fetchall())
+        # every supported format
+        import struct
+        for fmt in "bBhHiIlLqQnNfd?":
+            vals = [1, 0, 1] if fmt == "?" else [1, 2, 3]
+            c.execute("delete from foo")
+            c.executecolumns("insert into foo(x,y) values(?, ?)",
+                             (array.array("q", range(3)), memoryview(struct.pack("@3" + fmt, *vals)).cast(fmt)))
+            self.assertEqual(vals, [row[0] for row in c.execute("select y from foo order by x")])
+        # strided and empty
+        c.execute("delete from foo")
+        c.executecolumns("insert into foo(x) values(?)", (memoryview(array.array("i", range(10)))[::3], ))
+        self.assertEqual([0, 3, 6, 9], [row[0] for row in c.execute("select x from foo order by x")])
+        c.executecolumns("insert into foo(x) values(?)", (array.array("i"), ))
+        self.assertEqual(4, c.execute("select count(*) from foo").fetchall()[0][0])
+        # more rows than are done at once
+        c.execute("delete from foo")
+        c.execute("begin")
+        c.executecolumns("insert into foo(x) values(?)", (array.array("l", range(10000)), ))
+        c.execute("end")
+        self.assertEqual([(10000, 49995000)], c.execute("select count(*), sum(x) from foo").fetchall())
+        # returned rows are discarded
+        self.assertEqual(None, c.executecolumns("select ?", (array.array("i", [1, 2]), )))
+        # errors
+        self.assertRaises(TypeError, c.executecolumns, "select ?")
+        self.assertRaises(TypeError, c.executecolumns, "select ?", 3)
+        self.assertRaises(TypeError, c.executecolumns, "select ?", (3, ))
+        self.assertRaises(TypeError, c.executecolumns, "select ?", (memoryview(b("abc")).cast("c"), ))
+        self.assertRaises(apsw.BindingsError, c.executecolumns, "select ?, ?", (array.array("i", [1]), ))
+        self.assertRaises(apsw.BindingsError, c.executecolumns, "select 3", (array.array("i", [1]), ))
+        self.assertRaises(ValueError, c.executecolumns, "select ?; select 4", (array.array("i", [1]), ))
+        self.assertRaises(ValueError, c.executecolumns, "select ?, ?", (array.array("i", [1]), array.array("i", [1, 2])))
+        self.assertRaises(ValueError, c.executecolumns, "select ?", (memoryview(array.array("i", [1, 2])).cast("b").cast("i", (1, 2)), ))
+        self.assertRaises(OverflowError, c.executecolumns, "select ?", (array.array("Q", [1, 2**63]), ))
+        self.assertRaises(apsw.SQLError, c.executecolumns, "select * from nosuchtable where x=?", (array.array("i", [1]), ))
+        c.execute("create table uniq(x unique)")
+        self.assertRaises(apsw.ConstraintError, c.executecolumns, "insert into uniq values(?)", (array.array("i", [1, 2, 2, 3]), ))
+        self.assertEqual([(1, ), (2, )], c.execute("select * from uniq order by x").fetchall())
+        # the cursor is still usable
+        self.assertEqual([(1, )], c.execute("select 1").fetchall())
+        # exec tracer
+        calls = []
+
+        def tracer(cur, sql, bindings):
+            calls.append((sql, bindings))
+            return len(calls) < 2
+
+        c.setexectrace(tracer)
+        col = array.array("i", [7, 8])
+        c.executecolumns("insert into uniq values(?)", (col, ))
+        self.assertEqual([("insert into uniq values(?)", [col])], [(sql, list(bindings)) for sql, bindings in calls])
+        self.assertRaises(apsw.ExecTraceAbort, c.executecolumns, "insert into uniq values(?)", (array.array("i", [9]), ))
+        c.setexectrace(None)
+        self.assertEqual([(1, ), (2, ), (7, ), (8, )], c.execute("select * from uniq order by x").fetchall())
+
+    def testPreparedStatement(self):
+        "Check prepared statements"
+        c = self.db.cursor()
+        c.execute("create table foo(x, y)")
+        stmt = self.db.prepare("insert into foo values(?, ?)")
+        self.assertTrue(isinstance(stmt, apsw.PreparedStatement))
+        self.assertEqual("insert into foo values(?, ?)", stmt.sql)
+        self.assertEqual(2, stmt.parametercount)
+        self.assertEqual(0, stmt.columncount)
+        for i in range(5):
+            stmt.bind(1, i)
+            stmt.bind(2, u(r"\N{BLACK STAR}") * i)
+            self.assertEqual(False, stmt.step())
+            stmt.reset()
+        # bindings are kept
+        stmt.bind(1, 5)
+        stmt.step()
+        stmt.reset()
+        self.assertEqual([(i, u(r"\N{BLACK STAR}") * i) for i in range(5)] + [(5, u(r"\N{BLACK STAR}") * 4)],
+                         c.execute("select * from foo order by rowid").fetchall())
+        stmt.clearbindings()
+        stmt.step()
+        stmt.reset()
+        self.assertEqual([(None, None)], c.execute("select * from foo where x is null").fetchall())
+        c.execute("delete from foo")
+        # run_many
+        stmt.run_many((i, i * 2.5) for i in range(100))
+        stmt.run_many([])
+        self.assertEqual([(100, 12375.0)], c.execute("select count(*), sum(y) from foo").fetchall())
+        with self.db.prepare("insert into foo values(:one, :two)") as s2:
+            s2.run_many(({"one": 1000, "two": 7}, {"one": 1001}))
+        self.assertEqual([(1000, 7), (1001, None)], c.execute("select * from foo where x>=1000 order by x").fetchall())
+        self.assertRaises(apsw.ConnectionClosedError, s2.step)
+        self.assertRaises(apsw.BindingsError, stmt.run_many, [(1, )])
+        self.assertRaises(TypeError, stmt.run_many, [3])
+        self.assertRaises(TypeError, stmt.run_many, 3)
+        self.assertRaises(TypeError, stmt.run_many, [(1, self)])
+        self.assertEqual(102, c.execute("select count(*) from foo").fetchall()[0][0])
+        # queries
+        q = self.db.prepare("select x, y from foo where x<? order by x")
+        self.assertEqual(2, q.columncount)
+        self.assertRaises(apsw.ExecutionCompleteError, q.row)
+        self.assertRaises(apsw.ExecutionCompleteError, q.column, 0)
+        q.bind(1, 3)
+        rows = []
+        while q.step():
+            rows.append(q.row())
+            self.assertEqual(rows[-1][1], q.column(1))
+        self.assertEqual([(0, 0.0), (1, 2.5), (2, 5.0)], rows)
+        self.assertRaises(apsw.ExecutionCompleteError, q.row)
+        q.reset()
+        self.assertTrue(q.step())
+        self.assertRaises(IndexError, q.column, 2)
+        self.assertRaises(IndexError, q.column, -1)
+        self.assertRaises(TypeError, q.column, "0")
+        # can't bind while running
+        self.assertRaises(apsw.MisuseError, q.bind, 1, 2)
+        q.reset()
+        q.bind(1, 2)
+        self.assertRaises(apsw.RangeError, q.bind, 2, 2)
+        self.assertRaises(apsw.RangeError, q.bind, 0, 2)
+        self.assertRaises(TypeError, q.bind, 1, self)
+        self.assertRaises(TypeError, q.bind, "1", 3)
+        q.close()
+        q.close()
+        # errors
+        self.assertRaises(ValueError, self.db.prepare, "select 3; select 4")
+        self.assertRaises(ValueError, self.db.prepare, "  ")
+        self.assertRaises(apsw.SQLError, self.db.prepare, "select * from nosuchtable")
+        self.assertRaises(TypeError, self.db.prepare, 3)
+
+        def fail(x):
+            if x == 2:
+                1 / 0
+            return x
+
+        self.db.createscalarfunction("fail", fail)
+        q = self.db.prepare("select fail(x) from foo")
+        self.assertTrue(q.step())
+        self.assertTrue(q.step())
+        self.assertRaises(ZeroDivisionError, q.step)
+        c.execute("create table uniq(x unique)")
+        q = self.db.prepare("insert into uniq values(?)")
+        self.assertRaises(apsw.ConstraintError, q.run_many, ((1, ), (2, ), (1, ), (3, )))
+        self.assertEqual([(1, ), (2, )], c.execute("select * from uniq").fetchall())
+        q.bind(1, 2)
+        self.assertRaises(apsw.ConstraintError, q.step)
+        q.bind(1, 3)
+        self.assertEqual(False, q.step())
+        # statements go back into the cache and are closed with the connection
+        self.db.close()
+        for func, args in ((q.step, ()), (q.reset, ()), (q.row, ()), (q.column, (0, )), (q.bind, (1, 2)),
+                           (q.run_many, ([], )), (q.clearbindings, ()), (q.__enter__, ()), (q.__exit__, (None, None, None))):
+            self.assertRaises(apsw.ConnectionClosedError, func, *args)
+        for attr in ("sql", "columncount", "parametercount"):
+            self.assertRaises(apsw.ConnectionClosedError, getattr, q, attr)
+        q.close()
+
     def testFormatSQLValue(self):
         "Verify text formatting of values"
         vals = (
@@ -1347,6 +1673,259 @@ class APSW(unittest.TestCase):
         self.assertEqual(c.execute("select unspecdeterministic()=unspecdeterministic()").fetchall()[0][0], 0)
         self.assertRaises(apsw.SQLError, c.execute, "create index tdb on td(b) where nondeterministic()")
 
+    def testBatchFunctions(self):
+        "Verify batch scalar functions"
+        c = self.db.cursor()
+        self.assertRaises(TypeError, self.db.createscalarfunction, "mul", lambda x: x, batch=1)
+        batches = []
+
+        def mul(xs, ys):
+            batches.append(len(xs))
+            return [None if x is None else x * y for x, y in zip(xs, ys)]
+
+        self.db.createscalarfunction("mul", mul, 2, batch=True)
+        c.execute("create table foo(id integer primary key, x, y)")
+        c.execute("begin")
+        c.executemany("insert into foo values(?,?,?)", [(i, None if i % 10 == 0 else i, 2) for i in range(2500)])
+        c.execute("commit")
+
+        # used normally each call is a batch of one
+        self.assertEqual(c.execute("select mul(3, 4), mul('a', 2), mul(null, 1)").fetchall(), [(12, 'aa', None)])
+        self.assertEqual(batches, [1, 1, 1])
+
+        # table valued form
+        del batches[:]
+        res = c.execute("select key, value from mul('select id, x, y from foo')").fetchall()
+        self.assertEqual(res, [(i, None if i % 10 == 0 else i * 2) for i in range(2500)])
+        self.assertEqual(batches, [1024, 1024, 452])
+        del batches[:]
+        res = c.execute("select key, value from mul('select ''k''||id, x, 0.5 from foo', 1000)").fetchall()
+        self.assertEqual(res[1], ("k1", 0.5))
+        self.assertEqual(len(res), 2500)
+        self.assertEqual(batches, [1000, 1000, 500])
+        del batches[:]
+        self.assertEqual(c.execute("select count(*) from mul('select id, x, y from foo where id<0')").fetchall(),
+                         [(0, )])
+        self.assertEqual(batches, [])
+        # joined back
+        c.execute("create table bar(id integer primary key, v)")
+        c.execute("insert into bar select id, null from foo")
+        c.execute("update bar set v=b.value from mul('select id, x, y from foo', 100) as b where b.key=bar.id")
+        self.assertEqual(c.execute("select sum(v) from bar").fetchall()[0][0],
+                         sum(2 * i for i in range(2500) if i % 10))
+
+        # errors
+        self.assertRaises(apsw.SQLError, c.execute, "select * from mul()")
+        self.assertRaises(apsw.SQLError, c.execute, "select * from mul('select id, x, y from foo', 0)")
+        self.assertRaises(apsw.SQLError, c.execute, "select * from mul('select id from foo')")
+        self.assertRaises(apsw.SQLError, c.execute, "select * from mul('select syntax error')")
+        # the query can't change the database
+        for sql in ("delete from foo returning id, x, y", "insert into bar values(-1, 1) returning id, v, v"):
+            self.assertRaises(apsw.SQLError, c.execute, "select * from mul(?)", (sql, ))
+        self.assertEqual(c.execute("select count(*) from foo").fetchall(), [(2500, )])
+        self.assertEqual(c.execute("select count(*) from bar where id=-1").fetchall(), [(0, )])
+        self.assertRaises(TypeError, c.execute, "select * from mul('select id, x from foo')")
+        self.db.createscalarfunction("bad", lambda xs: [1], 1, batch=True)
+        self.assertRaises(ValueError, c.execute, "select * from bad('select id, x from foo')")
+        self.db.createscalarfunction("bad", lambda xs: [], 1, batch=True)
+        self.assertRaises(ValueError, c.execute, "select bad(1)")
+        self.db.createscalarfunction("bad", lambda xs: 3, 1, batch=True)
+        self.assertRaises(TypeError, c.execute, "select bad(1)")
+        self.assertRaises(TypeError, c.execute, "select * from bad('select id, x from foo')")
+        self.db.createscalarfunction("bad", lambda xs: 1 / 0, 1, batch=True)
+        self.assertRaises(ZeroDivisionError, c.execute, "select * from bad('select id, x from foo')")
+
+        # removal
+        self.db.createscalarfunction("mul", None, 2, batch=True)
+        self.assertRaises(apsw.SQLError, c.execute, "select * from mul('select id, x, y from foo')")
+        self.assertRaises(apsw.SQLError, c.execute, "select mul(1, 2)")
+        # replacing or deleting the function without batch also removes the
+        # table valued function, matching names the way SQLite does
+        nobatch = "select * from bad('select id, x from foo')"
+        self.db.createscalarfunction("bad", lambda xs: xs, 1, batch=True)
+        self.db.createscalarfunction("BaD", lambda x: x, 1)
+        self.assertEqual([(3, )], c.execute("select bad(3)").fetchall())
+        self.assertRaises(apsw.SQLError, c.execute, nobatch)
+        self.db.createscalarfunction("bad", lambda xs: xs, 1, batch=True)
+        self.db.createscalarfunction("bad", lambda x: x, 2)
+        self.assertEqual(2500, len(c.execute(nobatch).fetchall()))
+        self.db.createscalarfunction("bad", None, 1)
+        self.assertRaises(apsw.SQLError, c.execute, nobatch)
+        for create in (self.db.createaggregatefunction, self.db.createwindowfunction):
+            self.db.createscalarfunction("bad", lambda xs: xs, 1, batch=True)
+            create("bad", None, 1)
+            self.assertRaises(apsw.SQLError, c.execute, nobatch)
+        # a virtual table module of the same name replaces it
+        self.db.createscalarfunction("bad", lambda xs: xs, 1, batch=True)
+        self.db.createmodule("bad", object())
+        self.db.createscalarfunction("bad", None, 1)
+        self.assertRaises(AttributeError, c.execute, "create virtual table vbad using bad()")
+
+    def testMemoizedFunctions(self):
+        "Verify memoizing scalar functions"
+        c = self.db.cursor()
+        self.assertEqual(self.db.memoize_stats(), {})
+        self.assertRaises(ValueError, self.db.createscalarfunction, "f", lambda x: x, memoize=10)
+        self.assertRaises(ValueError, self.db.createscalarfunction, "f", lambda x: x, deterministic=True, memoize=-1)
+        self.assertRaises(ValueError,
+                          self.db.createscalarfunction,
+                          "f",
+                          lambda x: x,
+                          deterministic=True,
+                          memoize=1,
+                          memoizebytes=-1)
+        calls = []
+
+        def f(*args):
+            calls.append(args)
+            return args[0] if len(args) == 1 else repr(args)
+
+        self.db.createscalarfunction("f", f, 1, deterministic=True, memoize=100)
+        c.execute("create table foo(x)")
+        c.executemany("insert into foo values(?)", [(i % 5, ) for i in range(100)])
+        self.assertEqual(c.execute("select sum(f(x)) from foo").fetchall(), [(200, )])
+        self.assertEqual(sorted(calls), [(i, ) for i in range(5)])
+        stats = self.db.memoize_stats()[("f", 1)]
+        self.assertEqual((stats["hits"], stats["misses"], stats["size"], stats["maxentries"], stats["maxbytes"]),
+                         (95, 5, 5, 100, 0))
+        # each type and value is distinct, and results of each type are remembered
+        del calls[:]
+        vals = (7, 7.0, "7", b"7", None, 2**40, "ሴ" * 100, b"\x00" * 100)
+        for i in range(2):
+            for v in vals:
+                res = c.execute("select f(?)", (v, )).fetchall()[0][0]
+                self.assertEqual(res, v)
+                self.assertEqual(type(res), type(v))
+        self.assertEqual(calls, [(v, ) for v in vals])
+        # results that aren't remembered
+        del calls[:]
+        self.db.createscalarfunction("g", lambda x: calls.append(x) or bytearray(b"ab"), 1, deterministic=True,
+                                     memoize=10)
+        self.assertEqual(c.execute("select g(1), g(1)").fetchall(), [(b"ab", b"ab")])
+        self.assertEqual(calls, [1, 1])
+        # any number of arguments
+        self.db.createscalarfunction("f", f, -1, deterministic=True, memoize=10)
+        self.assertEqual(c.execute("select f(1, 2), f(1, '2'), f(1, 2)").fetchall(),
+                         [("(1, 2)", "(1, '2')", "(1, 2)")])
+        self.assertEqual(self.db.memoize_stats()[("f", -1)]["hits"], 1)
+
+        # limits
+        self.db.createscalarfunction("f", f, 1, deterministic=True, memoize=3)
+        c.execute("select f(x) from foo where rowid<=12").fetchall()
+        stats = self.db.memoize_stats()[("f", 1)]
+        self.assertEqual((stats["hits"], stats["misses"], stats["size"]), (0, 12, 3))
+        self.assertEqual(stats["evictions"], 9)
+        self.db.createscalarfunction("f", f, 1, deterministic=True, memoize=1000, memoizebytes=1000)
+        c.execute("select f(x) from foo").fetchall()
+        stats = self.db.memoize_stats()[("f", 1)]
+        self.assertEqual((stats["hits"], stats["misses"], stats["size"]), (95, 5, 5))
+        self.assertTrue(0 < stats["bytes"] <= 1000)
+        c.execute("select f(randomblob(300)) from foo").fetchall()
+        stats = self.db.memoize_stats()[("f", 1)]
+        self.assertTrue(stats["bytes"] <= 1000)
+        self.assertTrue(stats["evictions"] > 90)
+        # too big to remember
+        del calls[:]
+        c.execute("select f(zeroblob(2000)), f(zeroblob(2000))").fetchall()
+        self.assertEqual(len(calls), 2)
+
+        # recursive calls work but don't use the memo
+        def r(x):
+            return 0 if x <= 0 else self.db.cursor().execute("select r(?)", (x - 1, )).fetchall()[0][0] + 1
+
+        self.db.createscalarfunction("r", r, 1, deterministic=True, memoize=10)
+        self.assertEqual(c.execute("select r(5), r(3), r(5)").fetchall(), [(5, 3, 5)])
+        stats = self.db.memoize_stats()[("r", 1)]
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 2))
+
+        # exceptions aren't remembered
+        self.db.createscalarfunction("e", lambda x: calls.append(x) or 1 / 0, 1, deterministic=True, memoize=10)
+        del calls[:]
+        for i in range(2):
+            self.assertRaises(ZeroDivisionError, c.execute, "select e(1)")
+        self.assertEqual(calls, [1, 1])
+
+        # replacing without memoize
+        self.db.createscalarfunction("r", None, 1)
+        self.db.createscalarfunction("f", f, 1)
+        self.assertEqual(sorted(self.db.memoize_stats().keys()), [("e", 1), ("f", -1), ("g", 1)])
+        # names are matched ignoring case the same way as SQLite
+        self.db.createscalarfunction("Ab", f, 1, deterministic=True, memoize=10)
+        self.db.createscalarfunction("aB", f, 1, deterministic=True, memoize=20)
+        self.assertEqual(self.db.memoize_stats()[("ab", 1)]["maxentries"], 20)
+        self.db.createscalarfunction("AB", None, 1)
+        self.db.createscalarfunction("\u00c9", f, 1, deterministic=True, memoize=10)
+        self.db.createscalarfunction("\u00e9", f, 1, deterministic=True, memoize=10)
+        self.db.createscalarfunction("\u00e9", None, 1)
+        self.assertEqual(sorted(self.db.memoize_stats().keys()), [("e", 1), ("f", -1), ("g", 1), ("\u00c9", 1)])
+        # other kinds of function replacing them are noticed
+        self.db.createaggregatefunction("G", lambda: (None, lambda *args: None, lambda *args: 1), 1)
+        self.db.createwindowfunction("E", None, 1)
+        self.assertEqual(sorted(self.db.memoize_stats().keys()), [("f", -1), ("\u00c9", 1)])
+
+    def testFunctionTypes(self):
+        "Verify scalar function declared types and arguments"
+        c = self.db.cursor()
+        f = lambda *args: args
+        self.assertRaises(ValueError, self.db.createscalarfunction, "f", f, argtypes=(int, ))
+        self.assertRaises(ValueError, self.db.createscalarfunction, "f", f, 2, argtypes=(int, ))
+        self.assertRaises(TypeError, self.db.createscalarfunction, "f", f, 1, argtypes=3)
+        self.assertRaises(TypeError, self.db.createscalarfunction, "f", f, 1, argtypes=(list, ))
+        self.assertRaises(TypeError, self.db.createscalarfunction, "f", f, 1, returntype=list)
+
+        # arguments are converted as CAST does, except NULL
+        self.db.createscalarfunction("f", lambda *args: repr(args), 5, argtypes=(int, float, str, bytes, None))
+        self.assertEqual(
+            c.execute("select f('12', 3, 4.5, 'ab', 2.5), f(null, null, null, null, null)").fetchall(),
+            [(repr((12, 3.0, "4.5", b"ab", 2.5)), repr((None, ) * 5))])
+
+        # results of the declared type, and of other types
+        for rtype, vals in ((int, (1, -2**63)), (float, (1.5, 1)),
+                            (str, (u(r"\N{LATIN SMALL LETTER E WITH CIRCUMFLEX}"), 1)), (bytes, (b"\x00\x01", "ab", None))):
+            self.db.createscalarfunction("r", lambda x: x, 1, returntype=rtype)
+            for v in vals:
+                self.assertEqual(c.execute("select r(?)", (v, )).fetchall(), [(v, )])
+        self.db.createscalarfunction("r", lambda x: x * 2, 1, returntype=int)
+        self.assertRaises(OverflowError, c.execute, "select r(?)", (2**62, ))
+        self.db.createscalarfunction("r", lambda x: [x], 1, returntype=int)
+        self.assertRaises(TypeError, c.execute, "select r(1)")
+
+        # converted numbers
+        self.db.createscalarfunction("f", lambda *args: args[0], 1)
+        for v in (0, -1, 1023, 1024, -128, -129, 0.0, -0.0, 3.0, 1000.0, 1e100, float("inf")):
+            res = c.execute("select f(?), ?", (v, v)).fetchall()[0]
+            self.assertEqual(res, (v, v))
+            self.assertEqual([repr(r) for r in res], [repr(v)] * 2)
+        res = c.execute("select f(?)", (float("nan"), )).fetchall()[0][0]
+        self.assertEqual(res, None)  # SQLite turns NaN into NULL
+
+        # arguments a function keeps aren't changed by later calls
+        kept = []
+
+        class Keep(Exception):
+            def __init__(self, *args):
+                kept.append(self)
+
+        self.db.createscalarfunction("keep", Keep, argtypes=None)
+        for i in range(3):
+            self.assertRaises(TypeError, c.execute, "select keep(?, ?)", (i, str(i)))
+        self.assertEqual([k.args for k in kept], [(0, "0"), (1, "1"), (2, "2")])
+        # no argument tuple is left where the garbage collector can find it half built
+        self.db.createscalarfunction("f2", lambda a, b: a, 2)
+        c.execute("select f2(1000000, 2000000)").fetchall()
+        for o in gc.get_objects():
+            if type(o) is tuple and len(o) == 2:
+                list(o)
+        # and one found that way isn't changed by later calls
+        found = [o for o in gc.get_objects() if type(o) is tuple and o == (None, None)]
+        self.assertEqual([(3, )], c.execute("select f2(3, 4)").fetchall())
+        self.assertEqual(found, [(None, None)] * len(found))
+        self.assertEqual([(5, )], c.execute("select f2(5, 6)").fetchall())
+        self.db.createscalarfunction("g", lambda *args: repr(args))
+        self.assertEqual(
+            c.execute("select g(), g(1), g(1, 2), g(3), g(g(4))").fetchall(),
+            [("()", "(1,)", "(1, 2)", "(3,)", "('(4,)',)")])
+
     def testAggregateFunctions(self):
         "Verify aggregate functions"
         c = self.db.cursor()
@@ -1496,6 +2075,108 @@ class APSW(unittest.TestCase):
         self.db.createaggregatefunction("badfunc", badfactory)
         self.assertRaises(ZeroDivisionError, c.execute, "select badfunc(x) from foo")
 
+    def testWindowFunctions(self):
+        "Verify window functions"
+        c = self.db.cursor()
+        self.assertRaises(TypeError, self.db.createwindowfunction, "wsum", 3)
+        self.assertRaises(TypeError, self.db.createwindowfunction, "wsum")
+        c.execute("create table foo(x)")
+        c.executemany("insert into foo values(?)", [(i, ) for i in range(100)])
+        calls = {}
+
+        class wsum:
+            def __init__(self):
+                self.total = 0
+
+            def _call(self, name):
+                calls[name] = calls.get(name, 0) + 1
+
+            def step(self, v):
+                self._call("step")
+                self.total += v
+
+            def inverse(self, v):
+                self._call("inverse")
+                self.total -= v
+
+            def value(self):
+                self._call("value")
+                return self.total
+
+            def final(self):
+                self._call("final")
+                return self.total
+
+        def tuplefactory():
+            return ([0], lambda c, v: c.__setitem__(0, c[0] + v), lambda c: c[0], lambda c: c[0],
+                    lambda c, v: c.__setitem__(0, c[0] - v))
+
+        self.db.createwindowfunction("wsum", wsum, 1)
+        self.db.createwindowfunction("tsum", tuplefactory)
+        frame = "over (order by x rows between 4 preceding and current row)"
+        expected = [sum(range(max(0, i - 4), i + 1)) for i in range(100)]
+        for func in "wsum", "tsum", "sum":
+            self.assertEqual([r[0] for r in c.execute("select %s(x) %s from foo" % (func, frame))], expected)
+        # rows leaving the frame are removed rather than starting again
+        self.assertEqual(calls, {"step": 100, "inverse": 95, "value": 100, "final": 1})
+        # also usable as a regular aggregate
+        self.assertEqual(c.execute("select wsum(x), tsum(x) from foo").fetchall(), [(4950, 4950)])
+        self.assertEqual(c.execute("select wsum(x), tsum(x) from foo where x<0").fetchall(), [(0, 0)])
+
+        def run(sql):
+            return c.execute(sql).fetchall()
+
+        # errors in each method
+        for name in "step", "inverse", "value", "final":
+
+            class bad(wsum):
+                pass
+
+            setattr(bad, name, lambda *args: 1 / 0)
+            self.db.createwindowfunction("bad", bad, 1)
+            self.assertRaises(ZeroDivisionError, run, "select bad(x) %s from foo" % frame)
+            delattr(bad, name)
+            setattr(bad, name, 3)
+            self.assertRaises(TypeError, run, "select bad(x) %s from foo" % frame)
+        for factory in (lambda: 1 / 0, lambda: (1, 2), lambda: 3):
+            self.db.createwindowfunction("bad", factory, 1)
+            self.assertRaises((ZeroDivisionError, TypeError, AttributeError), run,
+                              "select bad(x) %s from foo" % frame)
+
+        # final is still called after an error so it can clean up
+        log = []
+
+        class failing(wsum):
+            def __init__(self):
+                log.append("init")
+                wsum.__init__(self)
+
+            def step(self, v):
+                log.append("step")
+                if len(log) > 3:
+                    1 / 0
+
+            def final(self):
+                log.append("final")
+                if self.raisefinal:
+                    raise ValueError()
+
+        for raisefinal in False, True:
+            failing.raisefinal = raisefinal
+            self.db.createwindowfunction("failing", failing, 1)
+            for sql in ("select failing(x) %s from foo" % frame, "select failing(x) from foo"):
+                del log[:]
+                if raisefinal:
+                    # the error from final can't replace the one from step
+                    self.assertRaisesUnraisable(Exception, self.assertRaises, ZeroDivisionError, run, sql)
+                else:
+                    self.assertRaises(ZeroDivisionError, run, sql)
+                self.assertEqual(log, ["init", "step", "step", "step", "final"])
+
+        # deletion
+        self.db.createwindowfunction("bad", None, 1)
+        self.assertRaises(apsw.SQLError, c.execute, "select bad(x) from foo")
+
     def testCollation(self):
         "Verify collations"
         # create a whole bunch to check they are freed
@@ -1609,6 +2290,60 @@ class APSW(unittest.TestCase):
         except apsw.SQLError:
             pass
 
+    def testCollationKey(self):
+        "Verify key collations"
+        c = self.db.cursor()
+        self.assertRaises(ValueError, self.db.createcollation, "k", lambda x: x, key=True, cachesize=1)
+        self.assertRaises(ValueError, self.db.createcollation, "k", lambda x: x, key=True, cachebytes=-1)
+        self.assertRaises(TypeError, self.db.createcollation, "k", lambda x: x, key=1)
+        calls = []
+
+        def numeric(s):
+            calls.append(s)
+            return "".join("%020d" % int(p) if p.isdigit() else p for p in re.split(r"(\d+)", s))
+
+        c.execute("create table foo(x)")
+        uni = u(r"\N{LATIN SMALL LETTER E WITH CIRCUMFLEX}")
+        vals = [uni + "file%d" % (i % 37) for i in range(500)]
+        c.executemany("insert into foo values(?)", [(v, ) for v in vals])
+        expected = sorted(vals, key=numeric)
+        for cachesize, cachebytes in ((65536, 0), (2, 0), (1000, 500)):
+            self.db.createcollation("numeric", numeric, key=True, cachesize=cachesize, cachebytes=cachebytes)
+            del calls[:]
+            self.assertEqual([r[0] for r in c.execute("select x from foo order by x collate numeric")], expected)
+            if cachesize == 65536:
+                # each distinct string only needs its key once
+                self.assertEqual(sorted(calls), sorted(set(vals)))
+        # a key function that uses the same collation, with a cache so small
+        # that every insert evicts everything not pinned
+        depth = []
+
+        def reentrant(s):
+            if not depth:
+                depth.append(1)
+                self.db.cursor().execute("select ? < ? collate reentrant", (s, s + "x")).fetchall()
+                depth.pop()
+            return numeric(s)
+
+        self.db.createcollation("reentrant", reentrant, key=True, cachesize=2, cachebytes=150)
+        self.assertEqual([r[0] for r in c.execute("select x from foo order by x collate reentrant")], expected)
+        # bytes keys, and indices
+        self.db.createcollation("rev", lambda s: bytes(255 - b for b in s.encode("utf8")) + b"\xff", key=True)
+        c.execute("create index foorev on foo(x collate rev)")
+        self.assertEqual([r[0] for r in c.execute("select distinct x from foo order by x collate rev")],
+                         sorted(set(vals), reverse=True))
+        self.assertEqual(c.execute("select count(*) from foo where x=? collate rev", (uni + "file3", )).fetchall(),
+                         [(14, )])
+
+        # errors
+        for bad in (lambda s: 1 / 0, lambda s: 3):
+            self.db.createcollation("bad", bad, key=True)
+            c2 = self.db.cursor()
+            self.assertRaises((ZeroDivisionError, TypeError), c2.execute, "select x from foo order by x collate bad")
+            c2.close()
+        self.db.createcollation("bad", None, key=True)
+        self.assertRaises(apsw.SQLError, c.execute, "select x from foo order by x collate bad")
+
     def testProgressHandler(self):
         "Verify progress handler"
         c = self.db.cursor()
@@ -2155,6 +2890,78 @@ class APSW(unittest.TestCase):
         # SQLite implementation detail: unknowndb gives back None instead of error
         self.assertEqual(None, self.db.serialize("nosuchdbname"))
 
+        # deserialize
+        c = self.db.cursor()
+        c.execute("insert into foo values(?)", (b(r"\x01\x02") * 1000, ))
+        contents = self.db.serialize("main")
+        self.assertRaises(TypeError, self.db.deserialize, "main")
+        self.assertRaises(TypeError, self.db.deserialize, "main", 3)
+        self.assertRaises(ValueError, self.db.deserialize, "main", contents, copy=False, resizeable=True)
+        self.assertRaises(TypeError, self.db.deserialize, "main", contents, copy=False)
+        self.assertRaises(TypeError, self.db.deserialize, "main", memoryview(bytearray(contents))[::2])
+        db = apsw.Connection(":memory:")
+        for kwargs in ({}, {"copy": True}, {"resizeable": False}, {"copy": False, "readonly": True}):
+            db.deserialize("main", contents, **kwargs)
+            self.assertEqual([(b(r"\x01\x02") * 1000, )], db.cursor().execute("select * from foo").fetchall())
+        # readonly
+        db.deserialize("main", contents, readonly=True)
+        self.assertRaises(apsw.ReadOnlyError, db.cursor().execute, "insert into foo values(3)")
+        # can't grow without resizeable
+        db.deserialize("main", contents, resizeable=False)
+        self.assertRaises(apsw.FullError, db.cursor().execute, "insert into foo values(randomblob(100000))")
+        db.deserialize("main", contents)
+        db.cursor().execute("insert into foo values(randomblob(100000))")
+        self.assertEqual(2, db.cursor().execute("select count(*) from foo").fetchall()[0][0])
+        # the original was copied
+        self.assertEqual(contents, self.db.serialize("main"))
+        # zero copy uses the memory directly
+        ba = bytearray(contents)
+        db.deserialize("main", ba, copy=False)
+        self.assertRaises(BufferError, ba.extend, b("abc"))
+        db.cursor().execute("update foo set x=x'aabbccdd'")
+        self.assertTrue(b(r"\xaa\xbb\xcc\xdd") in bytes(ba))
+        self.assertRaises(apsw.FullError, db.cursor().execute, "insert into foo values(randomblob(100000))")
+        # and releases it when replaced
+        db.deserialize("main", contents)
+        ba.extend(b("abc"))
+        # attached databases
+        db.cursor().execute("attach '' as other")
+        db.deserialize("other", ba, copy=False, readonly=True)
+        self.assertEqual([(b(r"\xaa\xbb\xcc\xdd"), )], db.cursor().execute("select * from other.foo").fetchall())
+        self.assertRaises(BufferError, ba.extend, b("abc"))
+        self.assertRaises(apsw.SQLError, db.deserialize, "nosuchdbname", contents)
+        # mmap
+        import mmap
+        with open(TESTFILEPREFIX + "testdb2", "wb") as f:
+            f.write(contents)
+        with open(TESTFILEPREFIX + "testdb2", "rb") as f:
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        db.deserialize("main", m, copy=False, readonly=True)
+        self.assertEqual([(b(r"\x01\x02") * 1000, )], db.cursor().execute("select * from foo").fetchall())
+        self.assertRaises(BufferError, m.close)
+        # closing releases everything
+        db.close()
+        ba.extend(b("abc"))
+        m.close()
+        # serialize without copying
+        if sys.version_info >= (3, 0):
+            self.assertEqual(None, self.db.serialize("nosuchdbname", copy=False))
+            mv = self.db.serialize("main", copy=False)
+            self.assertTrue(isinstance(mv, memoryview))
+            self.assertFalse(mv.readonly)
+            self.assertEqual(contents, mv.tobytes())
+            self.assertEqual(contents, self.db.serialize(name="main", copy=True))
+            db = apsw.Connection(":memory:")
+            db.deserialize("main", mv, copy=False)
+            self.assertEqual([(b(r"\x01\x02") * 1000, )], db.cursor().execute("select * from foo").fetchall())
+            db.cursor().execute("update foo set x=x'aabbccdd'")
+            self.assertTrue(b(r"\xaa\xbb\xcc\xdd") in mv.tobytes())
+            self.assertEqual(contents, self.db.serialize("main"))
+            # the memory outlives the memoryview
+            del mv
+            self.assertEqual([(b(r"\xaa\xbb\xcc\xdd"), )], db.cursor().execute("select * from foo").fetchall())
+            db.close()
+
     # A check that various extensions (such as fts3, rtree, icu)
     # actually work.  We don't know if they were supposed to be
     # compiled in or not so the assumption is that they aren't.
@@ -3781,6 +4588,181 @@ class APSW(unittest.TestCase):
         self.db = apsw.Connection(TESTFILEPREFIX + "testdb", statementcachesize=-1)
         self.testStatementCache(-1)
 
+    def testStatementCacheStats(self):
+        "Verify statement cache statistics"
+        db = apsw.Connection(":memory:", statementcachesize=3)
+        keys = set(("hits", "misses", "hits_inuse", "evictions", "recycled", "prepares", "prepare_time", "too_big",
+                    "size", "maxentries", "bytes", "maxbytes", "policy", "entries"))
+        stats = db.statementcache_stats()
+        self.assertEqual(keys, set(stats.keys()))
+        self.assertEqual(0, stats["size"])
+        self.assertEqual(3, stats["maxentries"])
+        cur = db.cursor()
+        for i in range(5):
+            cur.execute("select 1").fetchall()
+        stats = db.statementcache_stats()
+        self.assertEqual((4, 1, 1, 1), (stats["hits"], stats["misses"], stats["prepares"], stats["size"]))
+        self.assertEqual(["select 1"], stats["entries"])
+        self.assertTrue(stats["prepare_time"] >= 0)
+        # nested use of the same query
+        for row in cur.execute("select 1"):
+            db.cursor().execute("select 1").fetchall()
+        stats = db.statementcache_stats()
+        self.assertEqual(1, stats["hits_inuse"])
+        self.assertEqual(2, stats["prepares"])
+        # evictions
+        for i in range(2, 7):
+            cur.execute("select %d" % i).fetchall()
+        stats = db.statementcache_stats()
+        self.assertEqual(3, stats["size"])
+        self.assertEqual(["select 6", "select 5", "select 4"], stats["entries"])
+        self.assertEqual(3, stats["evictions"])
+        self.assertTrue(stats["recycled"] > 0)
+        # too big
+        cur.execute("select 1 -- " + "x" * 20000).fetchall()
+        self.assertEqual(1, db.statementcache_stats()["too_big"])
+        # schema changes cause a prepare
+        cur.execute("create table foo(x)")
+        cur.execute("select * from foo").fetchall()
+        prepares = db.statementcache_stats()["prepares"]
+        cur.execute("alter table foo add column y")
+        cur.execute("select * from foo").fetchall()
+        self.assertEqual(prepares + 2, db.statementcache_stats()["prepares"])
+        # each statement of multi-statement scripts is cached, even
+        # when the script is long
+        db2 = apsw.Connection(":memory:", statementcachesize=200)
+        script = ";\n".join("select %d, '%s'" % (i, "x" * 200) for i in range(150))
+        for i in range(3):
+            self.assertEqual([(i, "x" * 200) for i in range(150)], db2.cursor().execute(script).fetchall())
+        stats = db2.statementcache_stats()
+        self.assertEqual((150, 300, 150), (stats["prepares"], stats["hits"], stats["size"]))
+        # long texts only differing in the middle
+        for middle in "abc":
+            script = "select '%s'; select 1" % ("x" * 1000 + middle + "x" * 1000)
+            for i in range(2):
+                self.assertEqual([(script[8:2009], ), (1, )], db2.cursor().execute(script).fetchall())
+        # disabled cache
+        db2 = apsw.Connection(":memory:", statementcachesize=0)
+        for i in range(3):
+            db2.cursor().execute("select 1").fetchall()
+        stats = db2.statementcache_stats()
+        self.assertEqual((0, 3, 3, 0, []), (stats["hits"], stats["misses"], stats["prepares"], stats["size"], stats["entries"]))
+
+    def testStatementCachePolicies(self):
+        "Verify statement cache byte budget and eviction policies"
+        self.assertRaises(ValueError, apsw.Connection, ":memory:", statementcachepolicy="mru")
+        self.assertRaises(TypeError, apsw.Connection, ":memory:", statementcachebytes="1000")
+
+        def hotandscan(policy):
+            # a hot set of queries interleaved with scans of one-off
+            # queries that are bigger than the cache
+            db = apsw.Connection(":memory:", statementcachesize=20, statementcachepolicy=policy)
+            self.assertEqual(policy, db.statementcache_stats()["policy"])
+            cur = db.cursor()
+            for rnd in range(50):
+                for i in range(10):
+                    cur.execute("select %d" % i).fetchall()
+                for i in range(30):
+                    cur.execute("select 'scan', %d, %d" % (rnd, i)).fetchall()
+            stats = db.statementcache_stats()
+            self.assertEqual(20, stats["size"])
+            return stats["hits"]
+
+        lru = hotandscan("lru")
+        self.assertEqual(0, lru)
+        # arc keeps most of the hot set
+        self.assertTrue(hotandscan("arc") > 400)
+
+        def expensiveandcheap(policy):
+            # queries that are expensive to prepare mixed with cheap ones
+            db = apsw.Connection(":memory:", statementcachesize=10, statementcachepolicy=policy)
+            cur = db.cursor()
+            cur.execute("create table t(a,b,c)")
+            expensive = [
+                "select * from t as x " + " ".join("join t as y%d on y%d.a=x.b+%d" % (k, k, i) for k in range(12))
+                for i in range(5)
+            ]
+            for rnd in range(40):
+                for q in expensive:
+                    cur.execute(q).fetchall()
+                for i in range(16):
+                    cur.execute("select %d" % (rnd * 8 + i - 8)).fetchall()
+            return db.statementcache_stats()
+
+        # the cost policy uses measured prepare times which vary with
+        # machine load, so only check it does better than lru
+        lru = expensiveandcheap("lru")["hits"]
+        self.assertEqual(0, lru)
+        self.assertTrue(expensiveandcheap("cost")["hits"] > lru)
+
+        # byte budget
+        for policy in "lru", "cost", "arc":
+            db = apsw.Connection(":memory:", statementcachebytes=20000, statementcachepolicy=policy)
+            cur = db.cursor()
+            for i in range(100):
+                cur.execute("select %d" % i).fetchall()
+            stats = db.statementcache_stats()
+            self.assertEqual(20000, stats["maxbytes"])
+            self.assertTrue(0 < stats["bytes"] <= 20000)
+            self.assertTrue(0 < stats["size"] < 100)
+            self.assertEqual(100 - stats["size"], stats["evictions"])
+            self.assertEqual(stats["size"], len(stats["entries"]))
+            # too big for the budget but not too long
+            cur.execute("select 1, '%s'" % ("x" * 30000, )).fetchall()
+            self.assertEqual(1, db.statementcache_stats()["too_big"])
+            # and a long one that fits
+            db = apsw.Connection(":memory:", statementcachebytes=1000000, statementcachepolicy=policy)
+            for i in range(2):
+                db.cursor().execute("select 1, '%s'" % ("x" * 30000, )).fetchall()
+            self.assertEqual(1, db.statementcache_stats()["hits"])
+        # with the arc policy, run the general tests
+        self.db.close()
+        self.db = apsw.Connection(TESTFILEPREFIX + "testdb", statementcachesize=5, statementcachepolicy="arc")
+        self.testStatementCache(5)
+
+    def testSharedQueryCache(self):
+        "Verify query cache shared between connections"
+        self.assertRaises(TypeError, apsw.sharedquerycache, "10")
+        self.assertEqual(0, apsw.sharedquerycache(0))
+        try:
+            self.assertEqual(0, apsw.sharedquerycache(10))
+            self.assertEqual(10, apsw.sharedquerycache_stats()["maxentries"])
+            start = apsw.sharedquerycache_stats()
+            conns = [apsw.Connection(":memory:") for i in range(4)]
+            queries = ["select %d, 'x'; select 'y'; select 'z'" % i for i in range(5)]
+            for c in conns:
+                for q in queries:
+                    for i in range(3):
+                        self.assertEqual([(int(q.split()[1][:-1]), 'x'), ('y', ), ('z', )],
+                                         c.cursor().execute(q).fetchall())
+            stats = apsw.sharedquerycache_stats()
+            self.assertEqual(5, stats["misses"] - start["misses"])
+            self.assertEqual(15, stats["hits"] - start["hits"])
+            self.assertEqual(5, stats["queries"])
+            # the connection's own cache is used first, and the
+            # trailing statements are the same text in every query
+            for c in conns:
+                self.assertEqual([7, 38], [c.statementcache_stats()[k] for k in ("size", "hits")])
+            # bounded
+            for i in range(25):
+                conns[0].cursor().execute("select %d" % (i + 100, )).fetchall()
+            self.assertTrue(apsw.sharedquerycache_stats()["queries"] <= 10)
+            # subclasses are not shared
+            class str2(str):
+                pass
+
+            before = apsw.sharedquerycache_stats()
+            self.assertEqual([(7, )], conns[1].cursor().execute(str2("select 7")).fetchall())
+            self.assertEqual(before["misses"], apsw.sharedquerycache_stats()["misses"])
+            # disabled
+            self.assertEqual(10, apsw.sharedquerycache(0))
+            stats = apsw.sharedquerycache_stats()
+            self.assertEqual((0, 0, 0), (stats["queries"], stats["tails"], stats["maxentries"]))
+            for c in conns:
+                self.assertEqual([(8, )], c.cursor().execute("select 8").fetchall())
+        finally:
+            apsw.sharedquerycache(0)
+
     def testWikipedia(self):
         "Use front page of wikipedia to check unicode handling"
         # the text also includes characters that can't be represented in 16 bits
@@ -3808,7 +4790,7 @@ class APSW(unittest.TestCase):
         'sqlite3api': { # items of interest - sqlite3 calls
                         'match': re.compile(r"(sqlite3_[A-Za-z0-9_]+)\s*\("),
                         # what must also be on same or preceding line
-                        'needs': re.compile("PYSQLITE(_|_BLOB_|_CON_|_CUR_|_SC_|_VOID_|_BACKUP_)CALL"),
+                        'needs': re.compile("PYSQLITE(_|_BLOB_|_CON_|_CUR_|_SC_|_VOID_|_BACKUP_|_PS_)CALL"),
 
            # except if match.group(1) matches this - these don't
            # acquire db mutex so no need to wrap (determined by
@@ -3826,7 +4808,7 @@ class APSW(unittest.TestCase):
                         'desc': "sqlite3_ calls must wrap with PYSQLITE_CALL",
                         },
         'inuse':        {
-                        'match': re.compile(r"(convert_column_to_pyobject|statementcache_prepare|statementcache_finalize|statementcache_next)\s*\("),
+                        'match': re.compile(r"(convert_column_to_pyobject|convert_row_to_pyobject|statementcache_prepare|statementcache_finalize|statementcache_next)\s*\("),
                         'needs': re.compile("INUSE_CALL"),
                         'desc': "call needs INUSE wrapper",
                         },
@@ -3877,7 +4859,7 @@ class APSW(unittest.TestCase):
             },
             "Connection": {
                 "skip": ("internal_cleanup", "dealloc", "init", "close", "interrupt", "close_internal",
-                         "remove_dependent", "readonly", "getmainfilename", "db_filename"),
+                         "remove_dependent", "readonly", "getmainfilename", "db_filename", "dropbatchmodule"),
                 "req": {
                     "use": "CHECK_USE",
                     "closed": "CHECK_CLOSED",
@@ -3900,6 +4882,17 @@ class APSW(unittest.TestCase):
                 },
                 "order": ("use", "closed")
             },
+            "APSWPreparedStatement": {
+                "skip": ("dealloc", "init", "close", "close_internal"),
+                "req": {
+                    "use": "CHECK_USE",
+                    "closed": "CHECK_PREPAREDSTATEMENT_CLOSED"
+                },
+                "order": ("use", "closed")
+            },
+            "APSWSQLiteMemory": {
+                "skip": ("dealloc", "getbuffer"),
+            },
             "apswvfs": {
                 "req": {
                     "preamble": "VFSPREAMBLE",
@@ -3988,6 +4981,9 @@ class APSW(unittest.TestCase):
         if not os.path.exists("src/apsw.c"): return
 
         for filename in glob.glob("src/*.c"):
+            # files generated by setup.py from tools/*.py are Python source as string data
+            if os.path.exists(os.path.join("tools", os.path.basename(filename)[:-2] + ".py")):
+                continue
             # check not using C++ style comments
             code = read_whole_file(filename, "rt").replace("http://", "http:__").replace("https://", "https:__")
             if "//" in code:
@@ -4410,6 +5406,156 @@ class APSW(unittest.TestCase):
         self.assertRaises(apsw.SQLError, blobro.reopen, l("0x1ffffffff"))
         blobro.close()
 
+    def testBlobReadView(self):
+        "Verify blob readview"
+        c = self.db.cursor()
+        c.execute("create table foo(x)")
+        data = os.urandom(100000)
+        c.execute("insert into foo values(?)", (data, ))
+        blob = self.db.blobopen("main", "foo", "x", 1, False)
+        self.assertRaises(TypeError, blob.readview, "3")
+        if sys.version_info < (3, 0):
+            self.assertEqual(data[:10], blob.readview(10))
+            return
+        mv = blob.readview(10)
+        self.assertTrue(isinstance(mv, memoryview))
+        self.assertTrue(mv.readonly)
+        self.assertEqual(data[:10], mv.tobytes())
+        # previous view still in use so new memory
+        mv2 = blob.readview(20)
+        self.assertEqual(data[:10], mv.tobytes())
+        self.assertEqual(data[10:30], mv2.tobytes())
+        # memory is reused when nothing references it
+        del mv
+        objid = id(mv2.obj)
+        del mv2
+        mv3 = blob.readview()
+        self.assertEqual(objid, id(mv3.obj))
+        self.assertEqual(data[30:], mv3.tobytes())
+        self.assertEqual(0, len(blob.readview()))
+        self.assertEqual(0, len(blob.readview(5)))
+        blob.seek(99990)
+        self.assertEqual(data[-10:], blob.readview(1000).tobytes())
+        blob.close()
+        # views outlive the blob
+        self.assertEqual(data[30:], mv3.tobytes())
+        self.assertRaises(ValueError, blob.readview)
+
+    def testBlobReadMany(self):
+        "Verify reading slices of many blobs"
+        c = self.db.cursor()
+        c.execute("create table foo(x)")
+        c.executemany("insert into foo values(?)", ((os.urandom(i * 3), ) for i in range(100)))
+        blobs = dict(c.execute("select rowid, x from foo").fetchall())
+        self.assertRaises(TypeError, self.db.blob_read_many, "foo", "x", 3, 0, 10)
+        self.assertRaises(TypeError, self.db.blob_read_many, "foo", "x", ["1"], 0, 10)
+        self.assertRaises(ValueError, self.db.blob_read_many, "foo", "x", [1], -1, 10)
+        self.assertRaises(ValueError, self.db.blob_read_many, "foo", "x", [1], 0, -1)
+        self.assertRaises(apsw.SQLError, self.db.blob_read_many, "foo", "y", [1], 0, 10)
+        self.assertRaises(apsw.SQLError, self.db.blob_read_many, "foo", "x", [1, 2, 1000], 0, 10)
+        self.assertRaises(apsw.SQLError, self.db.blob_read_many, "foo", "x", [1], 0, 10, database="other")
+        self.assertEqual((b(""), []), self.db.blob_read_many("foo", "x", [], 0, 10))
+        rowids = list(range(100, 0, -1)) + [50]
+        for offset, length in ((0, 64), (10, 20), (0, 0), (500, 8)):
+            data, lengths = self.db.blob_read_many("foo", "x", tuple(rowids), offset, length)
+            self.assertEqual(len(rowids) * length, len(data))
+            for i, rowid in enumerate(rowids):
+                expected = blobs[rowid][offset:offset + length]
+                self.assertEqual(len(expected), lengths[i])
+                self.assertEqual(expected + b(r"\0") * (length - len(expected)), data[i * length:(i + 1) * length])
+        c.execute("attach '' as other; create table other.bar(x); insert into other.bar values('hello')").fetchall()
+        self.assertEqual((b("ell"), [3]), self.db.blob_read_many(table="bar", column="x", rowids=[1], offset=1, length=3,
+                                                               database="other"))
+        c.execute("insert into other.bar values(null)")
+        self.assertRaises(apsw.SQLError, self.db.blob_read_many, "bar", "x", [1, 2], 0, 3, database="other")
+
+    def testBlobStreams(self):
+        "Verify io module compatible blob streams"
+        import io
+        c = self.db.cursor()
+        c.execute("create table foo(x)")
+        data = os.urandom(300000)
+        c.execute("insert into foo values(?)", (data, ))
+        rowid = self.db.last_insert_rowid()
+        with apsw.blobstream(self.db, "foo", "x", rowid, buffersize=65536) as f:
+            self.assertTrue(isinstance(f.raw, apsw.BlobIO))
+            self.assertFalse(f.writable())
+            self.assertEqual(data[:10], f.read(10))
+            f.seek(-5, 2)
+            self.assertEqual(data[-5:], f.read())
+            self.assertEqual(b(""), f.read())
+            f.seek(1000)
+            out = io.BytesIO()
+            shutil.copyfileobj(f, out, 100000)
+            self.assertEqual(data[1000:], out.getvalue())
+            f.seek(0)
+            buf = bytearray(100)
+            self.assertEqual(100, f.readinto(buf))
+            self.assertEqual(data[:100], bytes(buf))
+        with apsw.blobstream(self.db, "foo", "x", rowid, writeable=True) as f:
+            self.assertTrue(f.writable())
+            f.seek(10)
+            f.write(b("hello"))
+            f.seek(0)
+            self.assertEqual(data[:10] + b("hello"), f.read(15))
+        self.assertEqual(data[:10] + b("hello") + data[15:], c.execute("select x from foo").fetchall()[0][0])
+        raw = apsw.BlobIO(self.db.blobopen("main", "foo", "x", rowid, False))
+        raw.close()
+        self.assertRaises(ValueError, raw.blob.read)
+        # chunked
+        self.assertRaises(ValueError, apsw.ChunkedBlobs, self.db, chunksize=0)
+        store = apsw.ChunkedBlobs(self.db, chunksize=100000)
+        self.assertEqual([], store.names())
+        self.assertRaises(KeyError, store.open, "nosuch")
+        self.assertRaises(KeyError, store.size, "nosuch")
+        with self.db:
+            with store.create("big", buffersize=30000) as f:
+                shutil.copyfileobj(io.BytesIO(data), f, 7000)
+        # chunks start small and grow
+        self.assertEqual([(65536, ), (100000, ), (100000, ), (34464, )],
+                         c.execute("select length(data) from blobchunks order by chunk").fetchall())
+        with store.create("big2") as f:
+            f.write(data + data[:1])
+        with store.create("empty") as f:
+            pass
+        self.assertEqual(sorted(["big", "big2", "empty"]), sorted(store.names()))
+        self.assertEqual((300000, 300001, 0), (store.size("big"), store.size("big2"), store.size("empty")))
+        with store.open("big", buffersize=4096) as f:
+            self.assertEqual(data, f.read())
+            # across a chunk boundary
+            f.seek(99990)
+            self.assertEqual(data[99990:100010], f.read(20))
+            f.seek(-10, 2)
+            self.assertEqual(data[-10:], f.read(100))
+            self.assertRaises((ValueError, OSError), f.seek, -1)
+            buf = bytearray(250000)
+            f.seek(0)
+            self.assertEqual(250000, f.readinto(buf))
+            self.assertEqual(data[:250000], bytes(buf))
+        self.assertEqual(data + data[:1], store.open("big2").read())
+        self.assertEqual(b(""), store.open("empty").read())
+        # replace
+        with store.create("big") as f:
+            f.write(b("abc"))
+        self.assertEqual(b("abc"), store.open("big").read())
+        store.delete("big")
+        store.delete("big")
+        self.assertRaises(KeyError, store.open, "big")
+        # attached database and own table name
+        c.execute("attach '' as other")
+        store = apsw.ChunkedBlobs(self.db, table="my chunks", dbname="other", chunksize=1000)
+        with store.create("x") as f:
+            f.write(data[:5500])
+        self.assertEqual(6, c.execute('select count(*) from other."my chunks"').fetchall()[0][0])
+        self.assertEqual(data[:5500], store.open("x").read())
+        # small objects don't need a whole chunk of space while being written
+        db = apsw.Connection(":memory:")
+        store = apsw.ChunkedBlobs(db)
+        with store.create("small") as f:
+            f.write(b("hello"))
+        self.assertEqual(b("hello"), store.open("small").read())
+        self.assertTrue(db.cursor().execute("pragma page_count").fetchall()[0][0] < 100)
+
     def testBlobReadError(self):
         "Ensure blob read errors are handled well"
         cur = self.db.cursor()
@@ -6034,6 +7180,207 @@ class APSW(unittest.TestCase):
         self.assertRaises(apsw.BusyError, b.__exit__, None, None, None)
         b.__exit__(None, None, None)
 
+    def testBackupRunner(self):
+        "Verify background throttled backups"
+        c = self.db.cursor()
+        c.execute("create table foo(x)")
+        with self.db:
+            c.executemany("insert into foo values(randomblob(?))", ((i * 20, ) for i in range(400)))
+        pagecount = c.execute("pragma page_count").fetchall()[0][0]
+        pagesize = c.execute("pragma page_size").fetchall()[0][0]
+        self.assertRaises(ValueError, apsw.BackupRunner, ":memory:", self.db, pages=0)
+        self.assertRaises(ValueError, apsw.BackupRunner, ":memory:", self.db, rate=0)
+        self.assertRaises(apsw.SQLError, apsw.BackupRunner, apsw.Connection(":memory:"), self.db, sourcedb="nosuchdb")
+        dest = TESTFILEPREFIX + "testdb2"
+        calls = []
+
+        def progress(remaining, pagecount, eta):
+            calls.append((remaining, pagecount, eta))
+            if len(calls) == 2:
+                # another connection changing the source makes the copy start again
+                apsw.Connection(TESTFILEPREFIX + "testdb").cursor().execute("insert into foo values(3)")
+
+        with apsw.BackupRunner(dest, self.db, pages=10, progress=progress, verify=True) as runner:
+            pass
+        self.assertTrue(runner.done)
+        self.assertFalse(runner.cancelled)
+        self.assertTrue(runner.restarts >= 1)
+        self.assertEqual((0, 0), calls[-1][0:3:2])
+        self.assertTrue(calls[3][2] > 0)
+        self.assertTrue(len(calls) > pagecount // 10 + 1)
+        expected = c.execute("select * from foo").fetchall()
+        self.assertEqual(expected, apsw.Connection(dest).cursor().execute("select * from foo").fetchall())
+        # throttled
+        calls = []
+        start = time.time()
+        runner = apsw.BackupRunner(":memory:", self.db, pages=10, rate=pagesize * pagecount * 4, progress=progress)
+        self.assertRaises(RuntimeError, runner.wait)
+        self.assertTrue(runner.start() is runner)
+        self.assertTrue(runner.wait())
+        self.assertTrue(time.time() - start > 0.2)
+        self.assertEqual(0, runner.remaining)
+        # into an existing connection with maxrestarts
+        db2 = apsw.Connection(":memory:")
+        calls = []
+        runner = apsw.BackupRunner(db2, self.db, pages=10, progress=progress, maxrestarts=1).start()
+        self.assertTrue(runner.wait())
+        self.assertEqual(1, runner.restarts)
+        self.assertEqual(c.execute("select * from foo").fetchall(), db2.cursor().execute("select * from foo").fetchall())
+        # errors and cancelling
+        def progress(*args):
+            1 / 0
+
+        runner = apsw.BackupRunner(db2, self.db, progress=progress, pages=1).start()
+        self.assertRaises(ZeroDivisionError, runner.wait)
+        before = db2.cursor().execute("select * from foo").fetchall()
+        runner = apsw.BackupRunner(db2, self.db, rate=pagesize, pages=1)
+        self.assertRaises(apsw.ThreadingViolationError, db2.cursor)
+        with runner:
+            runner.cancel()
+        self.assertTrue(runner.cancelled)
+        self.assertTrue(runner.remaining > 0)
+        self.assertEqual(before, db2.cursor().execute("select * from foo").fetchall())
+        # a source that stays busy fails rather than being retried forever
+        locker = apsw.Connection(TESTFILEPREFIX + "testdb")
+        locker.cursor().execute("begin exclusive")
+        runner = apsw.BackupRunner(":memory:", self.db, busysleep=0.01, busytimeout=0.2).start()
+        self.assertRaises(apsw.BusyError, runner.wait, 10)
+        self.assertTrue(runner.busy > 1)
+        locker.close()
+
+    def testBackupScheduler(self):
+        "Verify scheduling many backups"
+        self.assertRaises(ValueError, apsw.BackupScheduler, workers=0)
+        self.assertRaises(ValueError, apsw.BackupScheduler, rate=-1)
+        sources = []
+        for i in range(5):
+            deletefile(TESTFILEPREFIX + "testdb-src%d" % i)
+            db = apsw.Connection(TESTFILEPREFIX + "testdb-src%d" % i)
+            db.cursor().execute("create table foo(x); insert into foo values(randomblob(?))", (20000 * (i + 1), ))
+            sources.append(db)
+        pagesize = sources[0].cursor().execute("pragma page_size").fetchall()[0][0]
+        totalpages = sum(db.cursor().execute("pragma page_count").fetchall()[0][0] for db in sources)
+        scheduler = apsw.BackupScheduler(workers=2, rate=totalpages * pagesize * 4, pages=4, verify=True)
+        for i, db in enumerate(sources[:4]):
+            self.assertEqual("db%d" % i, scheduler.add(":memory:", db, name="db%d" % i))
+        self.assertRaises(ValueError, scheduler.add, ":memory:", sources[0], name="db0")
+        self.assertFalse(scheduler.wait(0))
+        self.assertEqual("pending", scheduler.status()["db0"]["state"])
+        # busy source
+        locker = apsw.Connection(TESTFILEPREFIX + "testdb-src3")
+        locker.cursor().execute("begin exclusive")
+        start = time.time()
+        scheduler.start()
+        # added after starting, and a destination that can't be used
+        dest = apsw.Connection(":memory:")
+        destcursor = dest.cursor()
+        self.assertEqual(sources[4].db_filename("main"), scheduler.add(dest, sources[4]))
+        scheduler.retries = 2
+        scheduler.retrysleep = 0.01
+        while scheduler.status()["db3"]["busy"] == 0:
+            time.sleep(0.01)
+        locker.close()
+        self.assertTrue(scheduler.wait(30))
+        self.assertTrue(time.time() - start > 0.2)
+        status = scheduler.status()
+        self.assertEqual(5, len(status))
+        for i in range(4):
+            self.assertEqual(("done", 1, None, 0), tuple(status["db%d" % i][k] for k in ("state", "attempts", "error", "remaining")))
+        self.assertTrue(status["db3"]["busy"] > 0)
+        failed = status[sources[4].db_filename("main")]
+        self.assertEqual(("failed", 3), (failed["state"], failed["attempts"]))
+        self.assertTrue(isinstance(failed["error"], apsw.ThreadingViolationError))
+        # which includes sources that stay busy
+        locker = apsw.Connection(TESTFILEPREFIX + "testdb-src0")
+        locker.cursor().execute("begin exclusive")
+        scheduler = apsw.BackupScheduler(retries=1, retrysleep=0.01, busytimeout=0.1)
+        name = scheduler.add(":memory:", sources[0])
+        with scheduler:
+            pass
+        failed = scheduler.status()[name]
+        self.assertEqual(("failed", 2), (failed["state"], failed["attempts"]))
+        self.assertTrue(isinstance(failed["error"], apsw.BusyError))
+        locker.close()
+        # cancelling
+        scheduler = apsw.BackupScheduler(workers=1, rate=pagesize, pages=1)
+        for i, db in enumerate(sources[:3]):
+            scheduler.add(":memory:", db)
+        with scheduler:
+            while scheduler.status()[sources[0].db_filename("main")]["state"] != "running":
+                time.sleep(0.01)
+            scheduler.cancel()
+        self.assertEqual(["cancelled"] * 3, [scheduler.status()[db.db_filename("main")]["state"] for db in sources[:3]])
+        for i, db in enumerate(sources):
+            db.close()
+            deletefile(TESTFILEPREFIX + "testdb-src%d" % i)
+
+    def testIncrementalBackup(self):
+        "Verify incremental backups and restores"
+        directory = TESTFILEPREFIX + "incremental"
+        dest = TESTFILEPREFIX + "testdb2"
+        shutil.rmtree(directory, True)
+        self.assertRaises(OSError, apsw.incrementalrestore, directory, dest)
+        c = self.db.cursor()
+        c.execute("create table foo(x,y)")
+        with self.db:
+            c.executemany("insert into foo values(?, randomblob(2000))", ((i, ) for i in range(500)))
+        pagecount = c.execute("pragma page_count").fetchall()[0][0]
+        res = apsw.incrementalbackup(self.db, directory)
+        self.assertEqual({"sequence": 0, "pagecount": pagecount, "changed": pagecount}, dict((k, v) for k, v in res.items() if k != "filename"))
+        original = c.execute("select * from foo").fetchall()
+        # nothing changed
+        res = apsw.incrementalbackup(TESTFILEPREFIX + "testdb", directory)
+        self.assertEqual((0, None, 0), (res["sequence"], res["filename"], res["changed"]))
+        c.execute("update foo set y=randomblob(10) where x=7")
+        res = apsw.incrementalbackup(self.db, directory)
+        self.assertEqual(1, res["sequence"])
+        self.assertTrue(0 < res["changed"] < 5)
+        self.assertTrue(os.path.getsize(res["filename"]) < 5 * 4096 + 100)
+        # shrinking
+        c.execute("delete from foo where x>250; vacuum").fetchall()
+        # and wal mode
+        c.execute("pragma journal_mode=wal").fetchall()
+        c.execute("insert into foo values(-1, -1)")
+        self.assertTrue(os.path.getsize(TESTFILEPREFIX + "testdb-wal") > 0)
+        res = apsw.incrementalbackup(self.db, directory)
+        self.assertEqual(2, res["sequence"])
+        latest = c.execute("select * from foo").fetchall()
+        self.assertEqual(2, apsw.incrementalrestore(directory, dest))
+        self.assertEqual(latest, apsw.Connection(dest).cursor().execute("select * from foo").fetchall())
+        self.assertEqual(0, apsw.incrementalrestore(directory, dest, upto=0))
+        self.assertEqual(original, apsw.Connection(dest).cursor().execute("select * from foo").fetchall())
+        self.assertEqual(1, apsw.incrementalrestore(directory, dest, upto=1))
+        self.assertEqual([(7, 10)], apsw.Connection(dest).cursor().execute("select x, length(y) from foo where length(y)<100").fetchall())
+        self.assertRaises(ValueError, apsw.incrementalrestore, directory, dest, upto=7)
+        # damage is detected
+        with open(os.path.join(directory, "00000002.delta"), "r+b") as f:
+            f.seek(-10, 2)
+            f.write(b("xxxxx"))
+        self.assertRaises(apsw.CorruptError, apsw.incrementalrestore, directory, dest)
+        # changes only in the wal are included even when it can't be checkpointed
+        reader = apsw.Connection(TESTFILEPREFIX + "testdb")
+        reader.cursor().execute("begin; select * from foo").fetchall()
+        c.execute("insert into foo values(-2, -2)")
+        self.assertEqual(3, apsw.incrementalbackup(self.db, directory)["sequence"])
+        reader.close()
+        self.assertEqual(3, apsw.incrementalrestore(directory, dest))
+        self.assertEqual([(-2, )], apsw.Connection(dest).cursor().execute("select x from foo where x=-2").fetchall())
+        # locks held by this process are still held afterwards
+        c.execute("pragma journal_mode=delete").fetchall()
+        c.execute("begin immediate")
+        apsw.incrementalbackup(self.db, directory)
+        import subprocess
+        code = "import sqlite3, sys\ntry:\n sqlite3.connect(sys.argv[1], timeout=0).execute('begin immediate')\nexcept sqlite3.OperationalError:\n sys.exit(7)"
+        self.assertEqual(7, subprocess.call([sys.executable, "-c", code, TESTFILEPREFIX + "testdb"]))
+        c.execute("rollback")
+        # nothing but the deltas and manifest are written
+        self.assertEqual(["0000000%d.delta" % i for i in range(5)] + ["manifest"], sorted(os.listdir(directory)))
+        # which needs a database with a filename
+        for name in (":memory:", ""):
+            self.assertRaises(ValueError, apsw.incrementalbackup, apsw.Connection(name), directory)
+        self.assertEqual(["0000000%d.delta" % i for i in range(5)] + ["manifest"], sorted(os.listdir(directory)))
+        shutil.rmtree(directory)
+
     def testLog(self):
         "Verifies logging functions"
         self.assertRaises(TypeError, apsw.log)
@@ -6100,6 +7447,298 @@ class APSW(unittest.TestCase):
         self.db.cursor().execute("attach '%s' as foo" % (TESTFILEPREFIX + "testdb2", ))
         self.assertEqual(self.db.filename + "2", self.db.db_filename("foo"))
 
+    def testConnectionPool(self):
+        "Verify connection pool"
+        self.assertRaises(ValueError, apsw.ConnectionPool, ":memory:", minsize=3, maxsize=2)
+        self.assertRaises(ValueError, apsw.ConnectionPool, ":memory:", maxsize=0)
+        self.db.cursor().execute("create table foo(x)")
+        self.db.close()
+
+        setups = []
+
+        def setup(con):
+            setups.append(con)
+            con.createscalarfunction("double", lambda x: x * 2)
+
+        fname = TESTFILEPREFIX + "testdb"
+        pool = apsw.ConnectionPool(fname,
+                                   minsize=2,
+                                   maxsize=3,
+                                   setup=setup,
+                                   busytimeout=5000,
+                                   pragmas={
+                                       "journal_mode": "wal",
+                                       "cache_size": -1000
+                                   },
+                                   checkpoint=2,
+                                   statementcachesize=17)
+        self.assertEqual(2, len(setups))
+        stats = pool.stats()
+        self.assertEqual((2, 2, 0, 3), (stats["size"], stats["idle"], stats["inuse"], stats["maxsize"]))
+        with pool.connection() as con:
+            self.assertTrue(con in setups)
+            self.assertEqual([(4, "wal", -1000)],
+                             con.cursor().execute("select double(2), * from pragma_journal_mode, pragma_cache_size").fetchall())
+            self.assertEqual(17, con.statementcache_stats()["maxentries"])
+            self.assertEqual(1, pool.stats()["inuse"])
+        # most recently used is reused keeping the statement cache warm
+        for i in range(3):
+            with pool.connection() as con2:
+                self.assertTrue(con2 is con)
+                con2.cursor().execute("insert into foo values(?)", (i, ))
+        self.assertTrue(con.statementcache_stats()["hits"] >= 2)
+        # transactions left open are rolled back
+        con = pool.acquire()
+        con.cursor().execute("begin; insert into foo values(99)")
+        pool.release(con)
+        self.assertTrue(con.getautocommit())
+        self.assertRaises(ValueError, pool.release, con)
+        # exhaustion and timeouts
+        cons = [pool.acquire() for i in range(3)]
+        self.assertEqual(3, len(setups))
+        self.assertRaises(apsw.BusyError, pool.acquire, 0.05)
+        self.assertRaises(apsw.BusyError, pool.acquire, 0)
+        stats = pool.stats()
+        self.assertEqual((3, 3, 2), (stats["inuse"], stats["peak"], stats["timeouts"]))
+        self.assertTrue(stats["utilisation"] > 0)
+
+        # waiters get connections as they are released
+        def releaselater():
+            time.sleep(0.1)
+            pool.release(cons.pop())
+
+        t = ThreadRunner(releaselater)
+        t.start()
+        con = pool.acquire(10)
+        t.go()
+        stats = pool.stats()
+        self.assertEqual(1, stats["waits"])
+        self.assertTrue(stats["max_wait"] > 0.05)
+        self.assertTrue(stats["wait_time"] >= stats["max_wait"])
+        # user closed connections are discarded and replaced
+        con.close()
+        pool.release(con)
+        self.assertEqual(1, pool.stats()["discarded"])
+        for c in cons:
+            pool.release(c)
+        # health checks
+        pool.healthcheck = lambda c: c is not setups[0]
+        cons = [pool.acquire() for i in range(3)]
+        self.assertTrue(setups[0] not in cons)
+        for c in cons:
+            pool.release(c)
+        pool.healthcheck = lambda c: 1 / 0
+        with pool.connection() as con:
+            self.assertTrue(con is setups[-1])
+        stats = pool.stats()
+        self.assertEqual(stats["created"], len(setups))
+        self.assertEqual(stats["created"] - stats["discarded"], stats["size"])
+        # threads
+        pool.healthcheck = None
+        results = []
+
+        def worker(n):
+            for i in range(20):
+                with pool.connection(10) as con:
+                    results.append(con.cursor().execute("select double(?)", (n * 100 + i, )).fetchall()[0][0])
+
+        threads = [ThreadRunner(worker, n) for n in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.go()
+        self.assertEqual(sorted(results), [2 * (n * 100 + i) for n in range(8) for i in range(20)])
+        self.assertTrue(pool.stats()["peak"] <= 3)
+        # setup failures
+        pool2 = apsw.ConnectionPool(fname, minsize=0, setup=lambda c: 1 / 0)
+        self.assertRaises(ZeroDivisionError, pool2.acquire)
+        self.assertEqual(0, pool2.stats()["size"])
+        # closing
+        with pool.connection() as con:
+            pool.close()
+            self.assertRaises(apsw.ConnectionClosedError, pool.acquire)
+            self.assertEqual([(2, )], con.cursor().execute("select double(1)").fetchall())
+        self.assertRaises(apsw.ConnectionClosedError, con.cursor)
+        self.assertEqual(0, pool.stats()["size"])
+        for c in setups:
+            self.assertRaises(apsw.ConnectionClosedError, c.cursor)
+        self.assertEqual(3, len(apsw.Connection(fname).cursor().execute("select * from foo").fetchall()))
+
+    def testParallelReader(self):
+        "Verify parallel partitioned reads"
+        self.assertRaises(ValueError, apsw.ParallelReader, TESTFILEPREFIX + "testdb", connections=0)
+        c = self.db.cursor()
+        c.execute("pragma journal_mode=wal; create table foo(x,y)").fetchall()
+        c.execute("create table bar(x)")
+        with self.db:
+            c.executemany("insert into foo values(?,?)", ((i, "x" * (i % 10)) for i in range(10000)))
+        threads = set()
+
+        def setup(con):
+            con.createscalarfunction("thread", lambda: threads.add(threading.current_thread()) or 1)
+            con.createscalarfunction("fail", lambda x: 1 / 0)
+
+        reader = apsw.ParallelReader(TESTFILEPREFIX + "testdb", connections=3, batchsize=100, setup=setup)
+        parts = reader.rowidpartitions("foo")
+        self.assertEqual(12, len(parts))
+        self.assertEqual(["1"], reader.rowidpartitions("bar"))
+        self.assertEqual(["1"], reader.rowidpartitions("foo", 1))
+        # aggregates
+        res = list(reader.execute("select count(*), sum(x), sum(thread()) from foo where {partition}", parts))
+        self.assertEqual(12, len(res))
+        self.assertEqual((10000, sum(range(10000))), (sum(r[0] for r in res), sum(r[1] for r in res)))
+        self.assertEqual(3, len(threads))
+        self.assertTrue(threading.current_thread() not in threads)
+        # streaming in order
+        rows = list(reader.execute("select x from foo where {partition} order by x", parts, ordered=True))
+        self.assertEqual([(i, ) for i in range(10000)], rows)
+        # explicit predicates and bindings
+        rows = list(
+            reader.execute("select x from foo where length(y)=:len and {partition}",
+                           ["x<5000", "x>=5000 and x<7000", "x>=7000"], {"len": 3}))
+        self.assertEqual(list(range(3, 10000, 10)), sorted(r[0] for r in rows))
+        # read only
+        self.assertRaises(apsw.ReadOnlyError, list, reader.execute("insert into bar values(1)", ["1"]))
+        # errors are raised and abandon the rest
+        self.assertRaises(apsw.SQLError, list, reader.execute("select x from foo where {partition} and nosuch", parts))
+        self.assertRaises(ZeroDivisionError, list,
+                          reader.execute("select fail(x) from foo where {partition}", parts))
+        # stopping early doesn't block the workers
+        for i in range(3):
+            it = reader.execute("select x from foo where {partition}", parts)
+            self.assertEqual(1, len(_realnext(it)))
+            del it
+        self.assertEqual([(10000, )], list(reader.execute("select count(*) from foo", ["1"])))
+        # and idle workers don't hold read transactions open
+        for i in range(100):
+            if c.execute("pragma wal_checkpoint(TRUNCATE)").fetchall()[0][0] == 0:
+                break
+            time.sleep(0.05)
+        else:
+            self.fail("ParallelReader workers are blocking checkpoints")
+        # changes are seen
+        c.execute("insert into foo values(-1, '')")
+        self.assertEqual(10001, sum(r[0] for r in reader.execute("select count(*) from foo where {partition}", parts)))
+        reader.close()
+        self.assertRaises(apsw.ConnectionClosedError, reader.execute, "select 3", ["1"])
+        reader.close()
+        with apsw.ParallelReader(TESTFILEPREFIX + "testdb", connections=1) as reader:
+            self.assertEqual([(3, )], list(reader.execute("select 3", ["1", "1", "1"]))[:1])
+
+    def testAsyncio(self):
+        "Verify asyncio front end"
+        if not hasattr(apsw, "aio"):
+            return
+        # importing apsw shouldn't also import asyncio which is slow
+        import subprocess
+        code = "import sys\nsys.path.insert(0, %r)\nimport apsw\nsys.exit(7 if 'asyncio' in sys.modules else 0)" % (
+            os.path.dirname(os.path.abspath(apsw.__file__)), )
+        self.assertEqual(0, subprocess.call([sys.executable, "-c", code]))
+        import asyncio
+        from apsw import aio
+        self.assertTrue(sys.modules["apsw.aio"] is aio)
+        loop = asyncio.new_event_loop()
+        run = loop.run_until_complete
+        try:
+            self.assertRaises(apsw.CantOpenError, run, aio.connect("/", flags=apsw.SQLITE_OPEN_READONLY))
+            con = run(aio.connect(TESTFILEPREFIX + "testdb", statementcachesize=7))
+            self.assertTrue(isinstance(con.connection, apsw.Connection))
+            self.assertEqual(7, con.connection.statementcache_stats()["maxentries"])
+            run(con.execute("create table foo(x,y)"))
+            run(con.executemany("insert into foo values(?,?)", [(i, str(i)) for i in range(1000)]))
+            cur = run(con.execute("select x,y from foo where x>=? order by x", (10, ), batchsize=100))
+            self.assertEqual(["x", "y"], [d[0] for d in run(cur.getdescription())])
+            self.assertEqual((10, "10"), run(cur.fetchone()))
+            self.assertEqual([(i, str(i)) for i in range(11, 14)], run(cur.fetchmany(3)))
+            # async iteration in batches
+            it = cur.__aiter__()
+            self.assertEqual((14, "14"), run(it.__anext__()))
+            self.assertEqual(95, len(cur._rows))
+            self.assertEqual([(i, str(i)) for i in range(15, 1000)], run(cur.fetchall()))
+            self.assertRaises(StopAsyncIteration, run, it.__anext__())
+            self.assertEqual(None, run(cur.fetchone()))
+            self.assertEqual([], run(cur.fetchmany()))
+            # errors
+            self.assertRaises(apsw.SQLError, run, con.execute("select nonexistent"))
+            self.assertRaises(ZeroDivisionError, run, con.run(lambda: 1 / 0))
+            # functions registered run in the worker thread
+            threads = []
+
+            def f(x):
+                threads.append(threading.current_thread())
+                return x * 2
+
+            run(con.run(con.connection.createscalarfunction, "f", f))
+            self.assertEqual([(6, )], run(run(con.execute("select f(3)")).fetchall()))
+            self.assertTrue(threads[0] is con._thread)
+            # the event loop is not blocked
+            ticks = []
+
+            def slow(x):
+                time.sleep(0.3)
+                return x
+
+            run(con.run(con.connection.createscalarfunction, "slow", slow))
+            tick = asyncio.ensure_future(asyncio.sleep(0.05), loop=loop)
+            tick.add_done_callback(lambda _: ticks.append(time.time()))
+            query = asyncio.ensure_future(con.execute("select slow(1)"), loop=loop)
+            query.add_done_callback(lambda _: ticks.append(time.time()))
+            run(asyncio.wait([tick, query]))
+            self.assertTrue(ticks[0] < ticks[1])
+            # cancellation interrupts the running query
+            query = asyncio.ensure_future(
+                con.execute("with recursive c(x) as (select 1 union all select x+1 from c) select count(*) from c"),
+                loop=loop)
+            queued = asyncio.ensure_future(con.run(f, 1), loop=loop)
+            loop.call_later(0.2, query.cancel)
+            loop.call_later(0.2, queued.cancel)
+            start = time.time()
+            self.assertRaises(asyncio.CancelledError, run, query)
+            self.assertRaises(asyncio.CancelledError, run, queued)
+            self.assertTrue(time.time() - start < 5)
+            self.assertEqual([(3, )], run(run(con.execute("select 3")).fetchall()))
+            self.assertEqual(1, len(threads))
+            # closing
+            cur = run(con.execute("select 1"))
+            run(cur.close())
+            run(con.close())
+            self.assertRaises(apsw.ConnectionClosedError, con.connection.cursor)
+            con._thread.join(5)
+            self.assertFalse(con._thread.is_alive())
+            self.assertRaises(apsw.ConnectionClosedError, run, con.execute("select 1"))
+            self.assertRaises(apsw.ConnectionClosedError, run, con.run(f, 1))
+            run(con.close())
+            # commands issued before close complete, those issued once it
+            # has started fail rather than hang, and closing twice is fine
+            con = run(aio.connect(":memory:"))
+            run(con.run(con.connection.createscalarfunction, "slow", slow))
+            query = lambda: con.connection.cursor().execute("select slow(4)").fetchall()
+            before = asyncio.ensure_future(con.run(query), loop=loop)
+            close = asyncio.ensure_future(con.close(), loop=loop)
+            after = asyncio.ensure_future(con.run(f, 1), loop=loop)
+            self.assertRaises(apsw.ConnectionClosedError, run, after)
+            start = time.time()
+            run(con.close())
+            self.assertTrue(time.time() - start < 0.2)
+            self.assertFalse(close.done())
+            self.assertEqual([(4, )], run(before))
+            run(close)
+            con._thread.join(5)
+            self.assertFalse(con._thread.is_alive())
+            # anything still queued when the worker stops is failed
+            con = run(aio.connect(":memory:"))
+            con._stop()
+            self.assertRaises(apsw.ConnectionClosedError, run, con._run(True, f, (1, ), {}))
+            con._thread.join(5)
+            self.assertFalse(con._thread.is_alive())
+            # context manager
+            con = run(aio.connect(":memory:"))
+            run(con.__aenter__())
+            run(con.__aexit__(None, None, None))
+            self.assertRaises(apsw.ConnectionClosedError, con.connection.cursor)
+        finally:
+            loop.close()
+
     def testShell(self, shellclass=None):
         "Check Shell functionality"
         # The windows stdio library is hopelessly broken when used
@@ -7773,6 +9412,15 @@ shell.write(shell.stdout, "hello world\\n")
         except MemoryError:
             pass
 
+        ## PreparedStatementAllocFails
+        apsw.faultdict["PreparedStatementAllocFails"] = True
+        try:
+            db = apsw.Connection(":memory:")
+            db.prepare("select 3")
+            1 / 0
+        except MemoryError:
+            pass
+
         ## CursorAllocFails
         apsw.faultdict["CursorAllocFails"] = True
         try:
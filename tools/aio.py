@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+
+import collections
+import itertools
+import queue
+import threading
+import apsw
+
+__doc__ = """asyncio front end to APSW
+
+Each :class:`Connection` has a dedicated worker thread which runs
+everything that touches SQLite.  The event loop only waits for the
+results so it is never blocked by disk I/O or long queries.
+"""
+
+
+async def connect(*args, **kwargs):
+    """Opens a connection in a new worker thread, taking the same
+    arguments as :class:`apsw.Connection`, and returns a
+    :class:`Connection`"""
+    con = Connection()
+    try:
+        con.connection = await con.run(apsw.Connection, *args, **kwargs)
+    except BaseException:
+        con._stop()
+        raise
+    return con
+
+
+class _Command(object):
+    # something for the worker thread to run
+
+    def __init__(self, loop, func, args, kwargs):
+        self.loop = loop
+        self.future = loop.create_future()
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.cancelled = False
+
+    def run(self):
+        if self.cancelled:
+            return
+        try:
+            result, exc = self.func(*self.args, **self.kwargs), None
+        except BaseException as e:
+            result, exc = None, e
+        self.post(result, exc)
+
+    def fail(self, exc):
+        # used for commands that will never be run
+        self.post(None, exc)
+
+    def post(self, result, exc):
+        try:
+            self.loop.call_soon_threadsafe(self.deliver, result, exc)
+        except RuntimeError:
+            # event loop has been closed
+            pass
+
+    def deliver(self, result, exc):
+        if self.future.cancelled():
+            return
+        if exc is not None:
+            self.future.set_exception(exc)
+        else:
+            self.future.set_result(result)
+
+
+class Connection(object):
+    """Wraps a :class:`apsw.Connection` running it in a dedicated worker
+    thread.  Use :func:`connect` to make one.
+
+    Commands are run in the order they are issued.  If the task
+    awaiting a command is cancelled while the command is running then
+    :meth:`apsw.Connection.interrupt` is called so that it finishes
+    promptly, while commands that have not started yet are skipped.
+    """
+
+    def __init__(self):
+        self.connection = None
+        "The underlying :class:`apsw.Connection`.  Only use it via :meth:`run`."
+        self._queue = queue.Queue()
+        self._running = None
+        self._lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._worker, name="apsw.aio worker")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _worker(self):
+        while True:
+            command = self._queue.get()
+            if command is None:
+                break
+            with self._lock:
+                self._running = command
+            try:
+                command.run()
+            finally:
+                with self._lock:
+                    self._running = None
+        # nothing can be queued once closed, but make sure no caller
+        # is left waiting forever
+        while True:
+            try:
+                command = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if command is not None:
+                command.fail(apsw.ConnectionClosedError("The connection has been closed"))
+
+    def _stop(self):
+        with self._lock:
+            self._closed = True
+            self._queue.put(None)
+
+    async def run(self, func, *args, **kwargs):
+        """Calls *func* with the arguments in the worker thread returning its
+        result.  Use this for anything not provided here, for example
+        ``await con.run(con.connection.createscalarfunction, "f", f)``"""
+        return await self._run(False, func, args, kwargs)
+
+    async def _run(self, closing, func, args, kwargs):
+        # asyncio is slow to import so it is only done when used rather
+        # than by every import of apsw
+        import asyncio
+        command = _Command(asyncio.get_event_loop(), func, args, kwargs)
+        with self._lock:
+            if self._closed and not closing:
+                raise apsw.ConnectionClosedError("The connection has been closed")
+            self._queue.put(command)
+        try:
+            return await command.future
+        except asyncio.CancelledError:
+            with self._lock:
+                command.cancelled = True
+                if self._running is command and self.connection is not None:
+                    self.connection.interrupt()
+            raise
+
+    def _cursor_execute(self, method, statements, bindings):
+        cursor = self.connection.cursor()
+        getattr(cursor, method)(statements, bindings)
+        return cursor
+
+    async def execute(self, statements, bindings=None, batchsize=256):
+        """Executes the statements returning a :class:`Cursor` for the results.
+        *batchsize* is how many rows at a time are fetched when
+        iterating over the cursor."""
+        return Cursor(self, await self.run(self._cursor_execute, "execute", statements, bindings), batchsize)
+
+    async def executemany(self, statements, sequenceofbindings, batchsize=256):
+        "Like :meth:`apsw.Cursor.executemany` returning a :class:`Cursor`"
+        return Cursor(self, await self.run(self._cursor_execute, "executemany", statements, sequenceofbindings),
+                      batchsize)
+
+    async def close(self, force=False):
+        """Closes the connection and stops the worker thread.  Commands
+        already issued are completed first, while any issued afterwards
+        raise :exc:`apsw.ConnectionClosedError`.  Calling it again does
+        nothing."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        try:
+            if self.connection is not None:
+                await self._run(True, self.connection.close, (force, ), {})
+        finally:
+            self._stop()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+
+class Cursor(object):
+    """Results of :meth:`Connection.execute`.  Use ``async for`` to
+    iterate over the rows, which are fetched from the worker thread
+    in batches."""
+
+    def __init__(self, connection, cursor, batchsize):
+        self.connection = connection
+        self.cursor = cursor
+        "The underlying :class:`apsw.Cursor`"
+        self.batchsize = batchsize
+        self._rows = collections.deque()
+        self._done = False
+
+    def _fetch(self, n):
+        return list(itertools.islice(self.cursor, n))
+
+    async def _fill(self):
+        if not self._rows and not self._done:
+            rows = await self.connection.run(self._fetch, self.batchsize)
+            if len(rows) < self.batchsize:
+                self._done = True
+            self._rows.extend(rows)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        await self._fill()
+        if not self._rows:
+            raise StopAsyncIteration
+        return self._rows.popleft()
+
+    async def fetchone(self):
+        "Returns the next row or None when there are no more"
+        await self._fill()
+        return self._rows.popleft() if self._rows else None
+
+    async def fetchmany(self, size=None):
+        "Returns a list of up to *size* (default *batchsize*) rows"
+        size = self.batchsize if size is None else size
+        res = []
+        while len(res) < size:
+            if not self._rows:
+                if self._done:
+                    break
+                rows = await self.connection.run(self._fetch, size - len(res))
+                if len(rows) < size - len(res):
+                    self._done = True
+                res.extend(rows)
+                continue
+            res.append(self._rows.popleft())
+        return res
+
+    async def fetchall(self):
+        "Returns a list of all remaining rows"
+        res = list(self._rows)
+        self._rows.clear()
+        if not self._done:
+            res.extend(await self.connection.run(list, self.cursor))
+            self._done = True
+        return res
+
+    async def getdescription(self):
+        "Returns :meth:`apsw.Cursor.getdescription`"
+        return await self.connection.run(self.cursor.getdescription)
+
+    async def close(self, force=False):
+        "Closes the cursor"
+        await self.connection.run(self.cursor.close, force)
@@ -0,0 +1,701 @@
+#!/usr/bin/env python3
+
+import hashlib
+import os
+import re
+import struct
+import threading
+import time
+import apsw
+
+_backup_clock = getattr(time, "monotonic", time.time)
+_backup_replace = getattr(os, "replace", os.rename)
+
+
+class BackupRunner(object):
+    """Copies a database using :meth:`Connection.backup` in a background
+    thread, throttled so a live database can be backed up without
+    hurting other users of it.
+
+    :param destination: A :class:`Connection` or a filename which is
+      opened (and closed when finished)
+    :param source: The :class:`Connection` to copy
+    :param pages: How many pages each :meth:`backup.step` copies.  The
+      source is locked during each step so smaller values let other
+      connections in more often.
+    :param rate: If not None, the most bytes per second to copy.  The
+      runner sleeps between steps to stay under it.
+    :param progress: Called after each step with ``(remaining,
+      pagecount, eta)`` where *eta* is the estimated seconds to
+      completion, or None if not known yet.  It is called in the
+      background thread.  Raising an exception aborts the backup.
+    :param verify: If true then `pragma integrity_check
+      <https://sqlite.org/pragma.html#pragma_integrity_check>`__ is run
+      on the destination when the copy is complete, raising
+      :exc:`CorruptError` if it fails.
+    :param maxrestarts: SQLite starts the copy again from the
+      beginning if the source is changed by a different connection.
+      If this many restarts happen then the remaining pages are copied
+      in a single step, which locks the source until it completes.
+      None means never do that.
+    :param destdb: Database name in *destination*
+    :param sourcedb: Database name in *source*
+    :param busysleep: Seconds to wait before trying again when a step
+      gets :exc:`BusyError` or :exc:`LockedError`
+    :param busytimeout: If steps keep getting :exc:`BusyError` or
+      :exc:`LockedError` for this many seconds then the backup fails
+      with that exception.  None means keep trying forever.
+
+    Call :meth:`start` and then :meth:`wait` for the result, or use it
+    as a context manager which starts it and waits on exit.  Do not use
+    the destination until the runner has finished.
+
+    .. code-block:: python
+
+        # copy at most 20MB per second
+        with apsw.BackupRunner("backup.db", con, rate=20*1024*1024,
+                               progress=lambda r, p, eta: print(r, p, eta),
+                               verify=True) as runner:
+            pass
+        print(runner.restarts)
+    """
+
+    def __init__(self,
+                 destination,
+                 source,
+                 pages=256,
+                 rate=None,
+                 progress=None,
+                 verify=False,
+                 maxrestarts=None,
+                 destdb="main",
+                 sourcedb="main",
+                 busysleep=0.1,
+                 busytimeout=30):
+        if pages < 1:
+            raise ValueError("pages must be at least one")
+        if rate is not None and rate <= 0:
+            raise ValueError("rate must be positive")
+        self.pages = pages
+        self.rate = rate
+        self.progress = progress
+        self.verify = verify
+        self.maxrestarts = maxrestarts
+        self.busysleep = busysleep
+        self.busytimeout = busytimeout
+        self.destdb = destdb
+        self.pagesize = source.cursor().execute("pragma %s.page_size" % _backup_quote(sourcedb)).fetchall()[0][0]
+        "Page size of the source database"
+        self._owndest = not isinstance(destination, apsw.Connection)
+        self._dest = apsw.Connection(destination) if self._owndest else destination
+        try:
+            self._backup = self._dest.backup(destdb, source, sourcedb)
+        except BaseException:
+            if self._owndest:
+                self._dest.close()
+            raise
+        self.remaining = 0
+        "Pages remaining after the most recent step"
+        self.pagecount = 0
+        "Pages in the source after the most recent step"
+        self.restarts = 0
+        "How many times the copy started again because the source changed"
+        self.busy = 0
+        "How many steps got :exc:`BusyError` or :exc:`LockedError`"
+        self.eta = None
+        "Estimated seconds to completion or None"
+        self.exception = None
+        "The exception if the backup failed"
+        self._limiter = _BackupRateLimiter(rate) if rate else None
+        self._cancel = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="apsw.BackupRunner")
+        self._thread.daemon = True
+
+    def start(self):
+        "Starts the background thread returning self"
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        "Stops copying.  The destination is rolled back unless the copy was already complete."
+        self._cancel.set()
+
+    @property
+    def done(self):
+        "True if the background thread has finished"
+        return not self._thread.is_alive() and self._backup is None
+
+    def wait(self, timeout=None):
+        """Waits for the backup to finish, raising any exception it had.
+        Returns True if it finished, or False if *timeout* seconds
+        elapsed first.  A cancelled backup returns True without
+        exception, check :attr:`cancelled`."""
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            return False
+        if self.exception is not None:
+            raise self.exception
+        return True
+
+    @property
+    def cancelled(self):
+        "True if :meth:`cancel` was called"
+        return self._cancel.is_set()
+
+    def _run(self):
+        try:
+            try:
+                self._copy()
+            finally:
+                backup, self._backup = self._backup, None
+                backup.finish()
+            if self.verify and not self._cancel.is_set():
+                res = self._dest.cursor().execute("pragma %s.integrity_check" % _backup_quote(self.destdb)).fetchall()
+                if res != [("ok", )]:
+                    raise apsw.CorruptError("Backup verification failed: " + "; ".join(r[0] for r in res))
+        except BaseException as e:
+            self.exception = e
+        finally:
+            if self._owndest:
+                self._dest.close()
+
+    def _copy(self):
+        backup = self._backup
+        copied = 0
+        # when the current pass started and pages copied since
+        passstart = _backup_clock()
+        passpages = 0
+        # when steps started being busy
+        busystart = None
+        while not self._cancel.is_set():
+            pages = self.pages
+            if self.maxrestarts is not None and self.restarts >= self.maxrestarts:
+                pages = -1
+            try:
+                done = backup.step(pages)
+            except (apsw.BusyError, apsw.LockedError):
+                self.busy += 1
+                if busystart is None:
+                    busystart = _backup_clock()
+                elif self.busytimeout is not None and _backup_clock() - busystart >= self.busytimeout:
+                    raise
+                self._cancel.wait(self.busysleep)
+                continue
+            busystart = None
+            now = _backup_clock()
+            self.remaining, self.pagecount = backup.remaining, backup.pagecount
+            nowcopied = self.pagecount - self.remaining
+            if nowcopied <= copied and not done:
+                # source was written to by another connection
+                self.restarts += 1
+                passstart, passpages = now, 0
+                copied = 0
+            delta = nowcopied - copied
+            copied = nowcopied
+            passpages += delta
+            if done:
+                self.remaining, self.eta = 0, 0
+            elif passpages and now > passstart:
+                self.eta = self.remaining * (now - passstart) / passpages
+                if self.rate:
+                    self.eta = max(self.eta, self.remaining * self.pagesize / float(self.rate))
+            if self.progress is not None:
+                self.progress(self.remaining, self.pagecount, self.eta)
+            if done:
+                return
+            if self._limiter is not None:
+                self._limiter.consume(delta * self.pagesize, self._cancel)
+            else:
+                # let other threads in
+                time.sleep(0)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, etype, *args):
+        if etype is not None:
+            self.cancel()
+            self._thread.join()
+            return False
+        self.wait()
+        return False
+
+
+class _BackupRateLimiter(object):
+    # limits bytes per second across all threads using it
+
+    def __init__(self, rate):
+        self.rate = float(rate)
+        self.lock = threading.Lock()
+        # time by which the bytes so far are allowed to be copied
+        self.budget = _backup_clock()
+
+    def consume(self, nbytes, event):
+        with self.lock:
+            now = _backup_clock()
+            self.budget = max(self.budget + nbytes / self.rate, now)
+            delay = self.budget - now
+        if delay > 0:
+            event.wait(delay)
+
+
+class BackupScheduler(object):
+    """Runs many backups using a fixed number of worker threads, with a
+    bytes per second limit shared by all of them.  Each backup is done
+    by a :class:`BackupRunner`.
+
+    :param workers: How many backups run at the same time
+    :param rate: If not None, the most bytes per second copied by all
+      the backups combined
+    :param pages: Pages per step passed to :class:`BackupRunner`
+    :param verify: Passed to :class:`BackupRunner`
+    :param retries: How many more times a backup is tried when it fails
+      with :exc:`BusyError`, :exc:`LockedError` or
+      :exc:`ThreadingViolationError` (the source connection was in use)
+    :param retrysleep: Seconds to wait before retrying
+    :param busytimeout: Passed to :class:`BackupRunner`
+
+    .. code-block:: python
+
+        scheduler = apsw.BackupScheduler(workers=4, rate=50*1024*1024)
+        for shard in shards:
+            scheduler.add(shard.filename + ".bak", shard.connection, name=shard.name)
+        with scheduler:
+            pass
+        for name, status in scheduler.status().items():
+            print(name, status["state"], status["error"])
+    """
+
+    def __init__(self, workers=4, rate=None, pages=256, verify=False, retries=10, retrysleep=1, busytimeout=30):
+        if workers < 1:
+            raise ValueError("workers must be at least one")
+        if rate is not None and rate <= 0:
+            raise ValueError("rate must be positive")
+        self.workers = workers
+        self.pages = pages
+        self.verify = verify
+        self.retries = retries
+        self.retrysleep = retrysleep
+        self.busytimeout = busytimeout
+        self._limiter = _BackupRateLimiter(rate) if rate else None
+        self._lock = threading.Lock()
+        self._jobs = []
+        self._pending = []
+        self._threads = []
+        self._started = False
+        self._cancel = threading.Event()
+
+    def add(self, destination, source, name=None, destdb="main", sourcedb="main"):
+        """Adds a backup of *source* to *destination* as for
+        :class:`BackupRunner`.  Backups can be added before or after
+        :meth:`start`.
+
+        :param name: Used as the key in :meth:`status`, defaulting to the
+          source filename
+        :returns: The name
+        """
+        if name is None:
+            name = source.db_filename(sourcedb)
+        job = _BackupJob(name, destination, source, destdb, sourcedb)
+        with self._lock:
+            if any(j.name == name for j in self._jobs):
+                raise ValueError("There is already a backup named %r" % (name, ))
+            self._jobs.append(job)
+            self._pending.append(job)
+            if self._started and len(self._threads) < self.workers:
+                self._startworker()
+        return name
+
+    def start(self):
+        "Starts the worker threads returning self"
+        with self._lock:
+            self._started = True
+            while len(self._threads) < min(self.workers, len(self._pending)):
+                self._startworker()
+        return self
+
+    def _startworker(self):
+        t = threading.Thread(target=self._worker, name="apsw.BackupScheduler")
+        t.daemon = True
+        t.start()
+        self._threads.append(t)
+
+    def _worker(self):
+        while True:
+            with self._lock:
+                if not self._pending or self._cancel.is_set():
+                    self._threads.remove(threading.current_thread())
+                    return
+                job = self._pending.pop(0)
+                job.state = "running"
+            self._run(job)
+
+    def _run(self, job):
+        while True:
+            job.attempts += 1
+            try:
+                job.runner = BackupRunner(job.destination,
+                                          job.source,
+                                          pages=self.pages,
+                                          verify=self.verify,
+                                          destdb=job.destdb,
+                                          sourcedb=job.sourcedb,
+                                          busytimeout=self.busytimeout)
+            except BaseException as e:
+                job.error = e
+            else:
+                job.runner._limiter = self._limiter
+                if self._cancel.is_set():
+                    job.runner.cancel()
+                job.runner._run()
+                job.error = job.runner.exception
+            if job.error is None:
+                job.state = "cancelled" if job.runner.cancelled else "done"
+                return
+            if job.attempts > self.retries or self._cancel.is_set() or \
+                   not isinstance(job.error, (apsw.BusyError, apsw.LockedError, apsw.ThreadingViolationError)):
+                job.state = "failed"
+                return
+            self._cancel.wait(self.retrysleep)
+
+    def cancel(self):
+        "Stops running backups and skips pending ones"
+        with self._lock:
+            self._cancel.set()
+            for job in self._pending:
+                job.state = "cancelled"
+            self._pending = []
+            for job in self._jobs:
+                if job.runner is not None:
+                    job.runner.cancel()
+
+    def wait(self, timeout=None):
+        """Waits for all the backups to finish.  Returns True if they have,
+        or False if *timeout* seconds elapsed first.  Use :meth:`status`
+        to see which succeeded."""
+        end = None if timeout is None else _backup_clock() + timeout
+        while True:
+            with self._lock:
+                threads = list(self._threads)
+                if not threads:
+                    return not self._pending
+            for t in threads:
+                t.join(None if end is None else max(0, end - _backup_clock()))
+                if end is not None and _backup_clock() >= end and t.is_alive():
+                    return False
+
+    def status(self):
+        """Returns a dict keyed by backup name.  Each value is a dict with
+        keys *state* (one of pending, running, done, failed, cancelled),
+        *attempts*, *error* (the exception or None), and from the current
+        :class:`BackupRunner` *remaining*, *pagecount*, *restarts*,
+        *busy* and *eta*."""
+        res = {}
+        with self._lock:
+            for job in self._jobs:
+                r = job.runner
+                res[job.name] = {
+                    "state": job.state,
+                    "attempts": job.attempts,
+                    "error": job.error,
+                    "remaining": r.remaining if r else None,
+                    "pagecount": r.pagecount if r else None,
+                    "restarts": r.restarts if r else 0,
+                    "busy": r.busy if r else 0,
+                    "eta": r.eta if r else None,
+                }
+        return res
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, etype, *args):
+        if etype is not None:
+            self.cancel()
+        self.wait()
+        return False
+
+
+class _BackupJob(object):
+
+    def __init__(self, name, destination, source, destdb, sourcedb):
+        self.name = name
+        self.destination = destination
+        self.source = source
+        self.destdb = destdb
+        self.sourcedb = sourcedb
+        self.state = "pending"
+        self.attempts = 0
+        self.error = None
+        self.runner = None
+
+
+def _backup_quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+# magic, sequence, page size, page count, pages in the file
+_backup_header = struct.Struct(">8sIIII")
+_backup_pgno = struct.Struct(">I")
+_backup_deltamagic = b"APSWINC1"
+_backup_manifestmagic = b"APSWMAN1"
+_backup_hashsize = hashlib.sha1().digest_size
+
+
+def incrementalbackup(source, directory, sourcedb="main", retries=20):
+    """Backs up the database into *directory* writing only the pages
+    that changed since the previous backup into a new delta file.  The
+    first backup (or one after the page size changed) writes all the
+    pages.  Use :func:`incrementalrestore` to get the database back.
+
+    :param source: A :class:`Connection` or the filename of the
+      database.  A separate connection is opened to get a consistent
+      view of the database, so it must have a filename and not be in
+      memory or temporary (:exc:`ValueError` is raised).
+    :param directory: Where delta files and the manifest of page hashes
+      are kept.  It is created if necessary.
+    :param sourcedb: Database name when *source* is a :class:`Connection`
+    :param retries: How many times to try again when the database is
+      locked by a writer, before raising :exc:`BusyError`.
+
+    :returns: A dict with keys *sequence* (number of the delta),
+      *filename* (None if nothing changed so no delta was written),
+      *pagecount* and *changed* (how many pages are in the delta)
+
+    The pages are read with the backup API, which includes changes
+    still in a `write ahead log <https://sqlite.org/wal.html>`__.  The
+    database file itself is never opened directly since closing it
+    would release the locks held by other connections in this process.
+    The backup goes to a connection whose database file is provided
+    by a private :class:`VFS` that hashes each page as SQLite writes
+    it, so no copy of the database is made and only the changed pages
+    are written out.  Deltas are files named ``00000000.delta``,
+    ``00000001.delta`` etc, with ``manifest`` holding a SHA1 hash of
+    each page as of the most recent one.
+    """
+    filename = source.db_filename(sourcedb) if isinstance(source, apsw.Connection) else source
+    if not filename:
+        raise ValueError("The database has no filename (it is in memory or temporary) so can't be backed up")
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    seq, pagesize, hashes = _backup_readmanifest(directory)
+    seq = 0 if seq is None else seq + 1
+    deltaname = os.path.join(directory, "%08d.delta" % seq)
+    con = apsw.Connection(filename, flags=apsw.SQLITE_OPEN_READWRITE)
+    try:
+        with open(deltaname + ".tmp", "wb") as out:
+            for attempt in range(retries + 1):
+                out.seek(0)
+                out.truncate()
+                out.write(_backup_header.pack(_backup_deltamagic, seq, 0, 0, 0))
+                sink = _BackupPageSink(out, pagesize, hashes)
+                try:
+                    sink.backup(con)
+                    break
+                except (apsw.BusyError, apsw.LockedError):
+                    if attempt == retries:
+                        raise
+                    time.sleep(0.05)
+            newpagesize = sink.pagesize or pagesize or 4096
+            pagecount = sink.size // newpagesize
+            changed = sum(1 for pgno in sink.written if pgno <= pagecount)
+            out.seek(0)
+            out.write(_backup_header.pack(_backup_deltamagic, seq, newpagesize, pagecount, sink.records))
+    except BaseException:
+        if os.path.exists(deltaname + ".tmp"):
+            os.remove(deltaname + ".tmp")
+        raise
+    finally:
+        con.close()
+    oldpagecount = len(hashes) // _backup_hashsize if hashes and newpagesize == pagesize else None
+    if changed == 0 and pagecount == oldpagecount:
+        os.remove(deltaname + ".tmp")
+        return {"sequence": seq - 1, "filename": None, "pagecount": pagecount, "changed": 0}
+    # pages SQLite never writes (the one holding the lock bytes) read as zeros
+    zerodigest = hashlib.sha1(b"\0" * newpagesize).digest()
+    _backup_replace(deltaname + ".tmp", deltaname)
+    _backup_writemanifest(directory, seq, newpagesize,
+                          b"".join(sink.hashes.get(pgno, zerodigest) for pgno in range(1, pagecount + 1)))
+    return {"sequence": seq, "filename": deltaname, "pagecount": pagecount, "changed": changed}
+
+
+class _BackupPageSink(object):
+    # Stands in for the database file of a connection being backed up
+    # into.  Each page is hashed as SQLite writes it, and only written
+    # to the delta if the hash differs from the manifest.  Nothing is
+    # kept except page 1 which SQLite may read back.
+
+    def __init__(self, out, pagesize, hashes):
+        self.out = out
+        self.oldpagesize = pagesize
+        self.oldhashes = hashes
+        self.pagesize = None
+        self.size = 0
+        self.page1 = b""
+        # pgno to hash of each page written, and which went to the delta
+        self.hashes = {}
+        self.written = set()
+        self.records = 0
+
+    def backup(self, con):
+        name = "apsw-incrementalbackup-%x" % id(self)
+        vfs = _BackupSinkVFS(name, self)
+        try:
+            copy = apsw.Connection("incrementalbackup", vfs=name)
+            try:
+                copy.cursor().execute("pragma journal_mode=off").fetchall()
+                with copy.backup("main", con, "main") as b:
+                    b.step()
+            finally:
+                copy.close()
+        finally:
+            vfs.unregister()
+
+    def xWrite(self, data, offset):
+        page = bytes(data)
+        if self.pagesize is None:
+            self.pagesize = len(page)
+        if len(page) != self.pagesize or offset % self.pagesize:
+            raise apsw.IOError("Unexpected write of %d bytes at offset %d" % (len(page), offset))
+        pgno = offset // self.pagesize + 1
+        digest = hashlib.sha1(page).digest()
+        self.hashes[pgno] = digest
+        if pgno == 1:
+            self.page1 = page
+        old = b""
+        if self.pagesize == self.oldpagesize:
+            old = self.oldhashes[(pgno - 1) * _backup_hashsize:pgno * _backup_hashsize]
+        if old != digest:
+            self.out.write(_backup_pgno.pack(pgno))
+            self.out.write(page)
+            self.written.add(pgno)
+            self.records += 1
+        self.size = max(self.size, offset + len(page))
+
+    def xRead(self, amount, offset):
+        if offset >= self.size:
+            return b""
+        if offset + amount <= len(self.page1):
+            return self.page1[offset:offset + amount]
+        raise apsw.IOError("Page at offset %d was not kept" % offset)
+
+    def xTruncate(self, size):
+        self.size = size
+
+    def xFileSize(self):
+        return self.size
+
+    def xSync(self, flags):
+        pass
+
+    def xLock(self, level):
+        pass
+
+    def xUnlock(self, level):
+        pass
+
+    def xCheckReservedLock(self):
+        return False
+
+    def xFileControl(self, op, ptr):
+        return False
+
+    def xSectorSize(self):
+        return 4096
+
+    def xDeviceCharacteristics(self):
+        return 0
+
+    def xClose(self):
+        pass
+
+
+class _BackupSinkVFS(apsw.VFS):
+    # only the database file exists - the copy has no journal
+
+    def __init__(self, name, sink):
+        self.sink = sink
+        apsw.VFS.__init__(self, name, "")
+
+    def xOpen(self, name, flags):
+        if flags[0] & apsw.SQLITE_OPEN_MAIN_DB:
+            return self.sink
+        raise apsw.CantOpenError("Only the database file can be opened")
+
+    def xAccess(self, name, flags):
+        return False
+
+    def xDelete(self, name, syncdir):
+        pass
+
+
+def incrementalrestore(directory, destination, upto=None):
+    """Rebuilds a database from the deltas written by
+    :func:`incrementalbackup`, overwriting *destination*.
+
+    :param directory: Directory containing the deltas
+    :param destination: Filename to write the database to
+    :param upto: If not None then the database is restored as of this
+      sequence number, otherwise the most recent.
+
+    :returns: The sequence number restored
+
+    Restoring the most recent delta also checks each page against the
+    manifest, raising :exc:`CorruptError` if any are different.
+    """
+    deltas = sorted(n for n in os.listdir(directory) if re.match(r"^[0-9]{8}\.delta$", n))
+    if not deltas:
+        raise ValueError("No deltas found in " + directory)
+    seq = pagesize = None
+    with open(destination, "wb") as out:
+        for name in deltas:
+            if upto is not None and int(name[:8]) > upto:
+                break
+            with open(os.path.join(directory, name), "rb") as f:
+                magic, seq, newpagesize, pagecount, count = _backup_header.unpack(f.read(_backup_header.size))
+                if magic != _backup_deltamagic:
+                    raise apsw.CorruptError(name + " is not a delta")
+                if newpagesize != pagesize:
+                    out.truncate(0)
+                    pagesize = newpagesize
+                for i in range(count):
+                    pgno = _backup_pgno.unpack(f.read(_backup_pgno.size))[0]
+                    page = f.read(pagesize)
+                    if len(page) != pagesize:
+                        raise apsw.CorruptError(name + " is truncated")
+                    out.seek((pgno - 1) * pagesize)
+                    out.write(page)
+                out.truncate(pagecount * pagesize)
+    if upto is not None and seq != upto:
+        raise ValueError("There is no delta %d" % upto)
+    lastseq, pagesize, hashes = _backup_readmanifest(directory)
+    if seq == lastseq:
+        with open(destination, "rb") as f:
+            for offset in range(0, len(hashes), _backup_hashsize):
+                if hashlib.sha1(f.read(pagesize)).digest() != hashes[offset:offset + _backup_hashsize]:
+                    raise apsw.CorruptError("Page %d does not match the manifest" % (offset // _backup_hashsize + 1))
+    return seq
+
+
+def _backup_readmanifest(directory):
+    # returns sequence, pagesize, hashes with sequence None if there is no manifest
+    try:
+        f = open(os.path.join(directory, "manifest"), "rb")
+    except (IOError, OSError):
+        return None, None, b""
+    with f:
+        magic, seq, pagesize, pagecount, _ = _backup_header.unpack(f.read(_backup_header.size))
+        if magic != _backup_manifestmagic:
+            raise apsw.CorruptError("Not a manifest")
+        hashes = f.read()
+    if len(hashes) != pagecount * _backup_hashsize:
+        raise apsw.CorruptError("Manifest is truncated")
+    return seq, pagesize, hashes
+
+
+def _backup_writemanifest(directory, seq, pagesize, hashes):
+    name = os.path.join(directory, "manifest")
+    with open(name + ".tmp", "wb") as f:
+        f.write(_backup_header.pack(_backup_manifestmagic, seq, pagesize, len(hashes) // _backup_hashsize, 0))
+        f.write(hashes)
+    _backup_replace(name + ".tmp", name)
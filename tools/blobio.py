@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+
+import bisect
+import io
+import apsw
+
+
+class BlobIO(io.RawIOBase):
+    """Makes a :class:`blob` usable with the :mod:`io` module, such as
+    with :class:`io.BufferedReader` for large reads and read ahead, and
+    with :func:`shutil.copyfileobj`.  :meth:`readinto` reads directly
+    into the supplied buffer with no intermediate copies.
+
+    Like the blob itself the size can't be changed by writing.  Closing
+    this closes the blob.  See :func:`blobstream` to get a buffered
+    stream."""
+
+    def __init__(self, blob):
+        io.RawIOBase.__init__(self)
+        self.blob = blob
+        "The underlying :class:`blob`"
+        self._writeable = None
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        if self._writeable is None:
+            # there is no API to ask, so try writing nothing
+            try:
+                self.blob.write(b"")
+                self._writeable = True
+            except apsw.ReadOnlyError:
+                self._writeable = False
+        return self._writeable
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        n = min(len(b), self.blob.length() - self.blob.tell())
+        if n > 0:
+            self.blob.readinto(b, 0, n)
+        return n
+
+    def write(self, b):
+        self.blob.write(b)
+        return len(b)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        self.blob.seek(offset, whence)
+        return self.blob.tell()
+
+    def tell(self):
+        return self.blob.tell()
+
+    def close(self):
+        if not self.closed:
+            self.blob.close()
+        io.RawIOBase.close(self)
+
+
+def blobstream(connection, table, column, rowid, writeable=False, dbname="main", buffersize=1024 * 1024):
+    """Opens a blob as for :meth:`Connection.blobopen` returning a
+    buffered :mod:`io` stream doing reads and writes of the blob in
+    *buffersize* chunks.
+
+    .. code-block:: python
+
+        with apsw.blobstream(con, "media", "data", rowid) as f:
+            shutil.copyfileobj(f, out, 1024 * 1024)
+    """
+    raw = BlobIO(connection.blobopen(dbname, table, column, rowid, writeable))
+    if writeable:
+        return io.BufferedRandom(raw, buffersize)
+    return io.BufferedReader(raw, buffersize)
+
+
+class ChunkedBlobs(object):
+    """Stores named binary objects of any size, spread across multiple
+    rows of a table so they are not limited by the `maximum blob size
+    <https://sqlite.org/limits.html#max_length>`__, and streams them in
+    and out without needing them in memory.
+
+    :param connection: The :class:`Connection`
+    :param table: Table to use, which is created if necessary
+    :param chunksize: Most bytes in each row.  Rows start smaller and
+      double in size up to this, so small objects don't need space for
+      a whole chunk while being written.
+    :param dbname: Which attached database the table is in
+
+    .. code-block:: python
+
+        store = apsw.ChunkedBlobs(con)
+        with open("movie.mp4", "rb") as f, store.create("movie") as out:
+            shutil.copyfileobj(f, out, 1024 * 1024)
+
+        with store.open("movie") as f:
+            f.seek(1000000000)
+            data = f.read(65536)
+
+    Writes are not done in a transaction of their own.  Use one
+    (eg ``with con:``) around :meth:`create` so a failed write isn't
+    left behind.
+    """
+
+    def __init__(self, connection, table="blobchunks", chunksize=64 * 1024 * 1024, dbname="main"):
+        limit = connection.limit(apsw.SQLITE_LIMIT_LENGTH)
+        if chunksize < 1 or chunksize > limit:
+            raise ValueError("chunksize must be between 1 and the SQLite length limit of %d" % limit)
+        self.connection = connection
+        self.table = table
+        self.chunksize = chunksize
+        self.dbname = dbname
+        self._qualified = _blobio_quote(dbname) + "." + _blobio_quote(table)
+        connection.cursor().execute(
+            "create table if not exists %s(name text not null, chunk integer not null, data blob not null);"
+            "create unique index if not exists %s on %s(name, chunk)" %
+            (self._qualified, _blobio_quote(dbname) + "." + _blobio_quote(table + "_index"), _blobio_quote(table)))
+
+    def _chunks(self, name):
+        return self.connection.cursor().execute(
+            "select rowid, length(data) from %s where name=? order by chunk" % self._qualified, (name, )).fetchall()
+
+    def names(self):
+        "Returns a list of the stored names"
+        return [r[0] for r in self.connection.cursor().execute("select distinct name from %s" % self._qualified)]
+
+    def size(self, name):
+        "Returns the size of the named object, raising :exc:`KeyError` if it doesn't exist"
+        chunks = self._chunks(name)
+        if not chunks:
+            raise KeyError(name)
+        return sum(c[1] for c in chunks)
+
+    def delete(self, name):
+        "Deletes the named object if it exists"
+        self.connection.cursor().execute("delete from %s where name=?" % self._qualified, (name, ))
+
+    def create(self, name, buffersize=1024 * 1024):
+        """Returns a buffered writable stream replacing any existing object
+        named *name*.  The data is complete once the stream is closed."""
+        self.delete(name)
+        return io.BufferedWriter(_ChunkedWriter(self, name), buffersize)
+
+    def open(self, name, buffersize=1024 * 1024):
+        """Returns a buffered seekable readable stream of the named
+        object, raising :exc:`KeyError` if it doesn't exist"""
+        chunks = self._chunks(name)
+        if not chunks:
+            raise KeyError(name)
+        return io.BufferedReader(_ChunkedReader(self, chunks), buffersize)
+
+
+class _ChunkedReader(io.RawIOBase):
+
+    def __init__(self, store, chunks):
+        io.RawIOBase.__init__(self)
+        self.store = store
+        self.rowids = [c[0] for c in chunks]
+        # offset of the start of each chunk
+        self.starts = [0]
+        for c in chunks:
+            self.starts.append(self.starts[-1] + c[1])
+        self.size = self.starts.pop()
+        self.pos = 0
+        self.blob = None
+        self.current = None
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        if self.pos >= self.size:
+            return 0
+        i = bisect.bisect_right(self.starts, self.pos) - 1
+        if self.blob is None:
+            self.blob = self.store.connection.blobopen(self.store.dbname, self.store.table, "data", self.rowids[i],
+                                                       False)
+        elif self.current != i:
+            self.blob.reopen(self.rowids[i])
+        self.current = i
+        offset = self.pos - self.starts[i]
+        n = min(len(b), self.blob.length() - offset)
+        self.blob.seek(offset)
+        self.blob.readinto(b, 0, n)
+        self.pos += n
+        return n
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        elif whence != io.SEEK_SET:
+            raise ValueError("whence should be 0, 1 or 2")
+        if offset < 0:
+            raise ValueError("negative seek position")
+        self.pos = offset
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+    def close(self):
+        if self.blob is not None:
+            self.blob.close()
+            self.blob = None
+        io.RawIOBase.close(self)
+
+
+class _ChunkedWriter(io.RawIOBase):
+
+    def __init__(self, store, name):
+        io.RawIOBase.__init__(self)
+        self.store = store
+        self.name = name
+        self.blob = None
+        self.chunk = -1
+        # size of and space left in the current chunk
+        self.size = 0
+        self.left = 0
+
+    def writable(self):
+        return True
+
+    def _newchunk(self, wanted):
+        self.chunk += 1
+        # the unused end of the last chunk is copied away on close, so
+        # don't start big in case there isn't much data
+        self.size = min(self.store.chunksize, max(self.size * 2, wanted, _blobio_firstchunk))
+        cur = self.store.connection.cursor()
+        cur.execute("insert into %s(name, chunk, data) values(?, ?, ?)" % self.store._qualified,
+                    (self.name, self.chunk, apsw.zeroblob(self.size)))
+        rowid = self.store.connection.last_insert_rowid()
+        if self.blob is None:
+            self.blob = self.store.connection.blobopen(self.store.dbname, self.store.table, "data", rowid, True)
+        else:
+            self.blob.reopen(rowid)
+        self.rowid = rowid
+        self.left = self.size
+
+    def write(self, b):
+        if not self.left:
+            self._newchunk(len(b))
+        n = min(len(b), self.left)
+        if n < len(b):
+            b = b[:n]
+        self.blob.write(b)
+        self.left -= n
+        return n
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            io.RawIOBase.close(self)
+        finally:
+            if self.blob is not None:
+                self.blob.close()
+                self.blob = None
+        if self.chunk < 0:
+            # always have a row so empty objects exist
+            self.store.connection.cursor().execute(
+                "insert into %s(name, chunk, data) values(?, 0, x'')" % self.store._qualified, (self.name, ))
+        elif self.left:
+            self.store.connection.cursor().execute(
+                "update %s set data=substr(data, 1, ?) where rowid=?" % self.store._qualified,
+                (self.size - self.left, self.rowid))
+
+
+# size of the first chunk unless the first write is bigger
+_blobio_firstchunk = 64 * 1024
+
+
+def _blobio_quote(name):
+    return '"' + name.replace('"', '""') + '"'
@@ -77,11 +77,14 @@ for name, obj in (
             # ignore debugging thingies
             if c.startswith("test_") or c in ("faultdict", "_fini"):
                 continue
+            # ignore private helpers of the code written in Python
+            if c.startswith("_"):
+                continue
             # ignore the exceptions
             if isinstance(getattr(apsw, c), type) and issubclass(getattr(apsw, c), Exception):
                 continue
             # ignore classes !!!
-            if c in ("Connection", "VFS", "VFSFile", "zeroblob", "Shell", "URIFilename", "Cursor", "Blob", "Backup"):
+            if c in ("Connection", "VFS", "VFSFile", "zeroblob", "Shell", "ConnectionPool", "ParallelReader", "BackupRunner", "BackupScheduler", "incrementalbackup", "incrementalrestore", "BlobIO", "blobstream", "ChunkedBlobs", "URIFilename", "Cursor", "Blob", "Backup"):
                 continue
             # ignore mappings !!!
             if c.startswith("mapping_"):
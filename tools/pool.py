@@ -0,0 +1,501 @@
+#!/usr/bin/env python3
+
+import itertools
+import threading
+import time
+import apsw
+try:
+    import queue as _pool_queue
+except ImportError:
+    import Queue as _pool_queue
+
+_pool_clock = getattr(time, "monotonic", time.time)
+
+
+class ConnectionPool(object):
+    """A thread safe pool of :class:`Connection` to the same database
+
+    :param filename: Database filename passed to :class:`Connection`
+    :param minsize: How many connections are opened immediately and
+      kept open
+    :param maxsize: Most connections that will be open at once.
+      :meth:`acquire` waits when they are all in use.
+    :param timeout: Default seconds :meth:`acquire` waits for a
+      connection before raising :exc:`BusyError`.  None waits forever.
+    :param setup: A callable or sequence of callables called with each
+      new connection, for example to register functions, collations
+      and hooks.
+    :param pragmas: A dict of pragma names and values run on each new
+      connection, eg ``{"journal_mode": "wal", "foreign_keys": 1}``
+    :param busytimeout: Milliseconds passed to
+      :meth:`Connection.setbusytimeout` on each new connection
+    :param healthcheck: A callable called with a connection before it
+      is handed out.  If it returns a false value or raises an
+      exception then the connection is closed and replaced.
+    :param checkpoint: If non-zero then every this many releases a
+      passive `WAL checkpoint <https://sqlite.org/wal.html#ckpt>`__ is
+      done on the released connection.
+    :param kwargs: Passed to :class:`Connection` (eg *flags*, *vfs*,
+      *statementcachesize*)
+
+    Connections are handed out most recently used first, so a busy
+    pool keeps using the same connections and their :ref:`statement
+    caches <statementcache>` stay warm.  Consider also enabling
+    :meth:`sharedquerycache`.  When a connection is released any
+    transaction left open is rolled back and any
+    :meth:`Connection.close` by the user causes it to be discarded.
+
+    .. code-block:: python
+
+        pool = apsw.ConnectionPool("db", maxsize=16, pragmas={"journal_mode": "wal"})
+
+        with pool.connection() as con:
+            for row in con.cursor().execute("select ..."):
+                ...
+    """
+
+    def __init__(self,
+                 filename,
+                 minsize=1,
+                 maxsize=8,
+                 timeout=None,
+                 setup=None,
+                 pragmas=None,
+                 busytimeout=None,
+                 healthcheck=None,
+                 checkpoint=0,
+                 **kwargs):
+        if minsize < 0 or maxsize < 1 or minsize > maxsize:
+            raise ValueError("Need 0 <= minsize <= maxsize and maxsize >= 1")
+        self.filename = filename
+        self.minsize = minsize
+        self.maxsize = maxsize
+        self.timeout = timeout
+        if setup is None:
+            setup = []
+        elif callable(setup):
+            setup = [setup]
+        self.setup = list(setup)
+        self.pragmas = dict(pragmas or {})
+        self.busytimeout = busytimeout
+        self.healthcheck = healthcheck
+        self.checkpoint = checkpoint
+        self.kwargs = kwargs
+
+        self._lock = threading.Condition(threading.Lock())
+        self._idle = []  # most recently used at the end
+        self._inuse = set()
+        self._opening = 0  # connections being opened outside the lock
+        self._closed = False
+        self._releases = 0
+
+        self._created = self._discarded = self._checkouts = 0
+        self._waits = self._timeouts = 0
+        self._waittime = self._maxwait = 0.0
+        self._peak = 0
+        self._start = self._lastchange = _pool_clock()
+        self._busyarea = 0.0
+
+        for i in range(minsize):
+            self._idle.append(self._open())
+
+    def _open(self):
+        "Makes and sets up a new connection"
+        con = apsw.Connection(self.filename, **self.kwargs)
+        try:
+            if self.busytimeout is not None:
+                con.setbusytimeout(self.busytimeout)
+            for name, value in self.pragmas.items():
+                con.cursor().execute("pragma %s=%s" % (name, apsw.format_sql_value(value))).fetchall()
+            for s in self.setup:
+                s(con)
+        except:
+            con.close(True)
+            raise
+        self._created += 1
+        return con
+
+    def _discard(self, con):
+        self._discarded += 1
+        try:
+            con.close(True)
+        except apsw.Error:
+            pass
+
+    def _healthy(self, con):
+        if self.healthcheck is None:
+            return True
+        try:
+            return bool(self.healthcheck(con))
+        except Exception:
+            return False
+
+    def _accumulate(self):
+        # time weighted count of connections in use, with the lock held
+        now = _pool_clock()
+        self._busyarea += len(self._inuse) * (now - self._lastchange)
+        self._lastchange = now
+
+    def acquire(self, timeout=-1):
+        """Returns a connection from the pool which must be given back
+        with :meth:`release`.  Raises :exc:`BusyError` if none is
+        available within *timeout* seconds (-1 means use the pool
+        default)."""
+        if timeout == -1:
+            timeout = self.timeout
+        start = _pool_clock()
+        waited = False
+        while True:
+            con = None
+            with self._lock:
+                while True:
+                    if self._closed:
+                        raise apsw.ConnectionClosedError("The pool has been closed")
+                    if self._idle:
+                        con = self._idle.pop()
+                        break
+                    if len(self._inuse) + self._opening < self.maxsize:
+                        self._opening += 1
+                        break
+                    remaining = None
+                    if timeout is not None:
+                        remaining = timeout - (_pool_clock() - start)
+                        if remaining <= 0:
+                            self._timeouts += 1
+                            raise apsw.BusyError("No connection available in the pool within %s seconds" % (timeout, ))
+                    waited = True
+                    self._lock.wait(remaining)
+
+            if con is None:
+                try:
+                    con = self._open()
+                finally:
+                    with self._lock:
+                        self._opening -= 1
+                        if con is None:
+                            self._lock.notify()
+            elif not self._healthy(con):
+                with self._lock:
+                    self._discard(con)
+                continue
+
+            with self._lock:
+                self._accumulate()
+                self._inuse.add(con)
+                self._checkouts += 1
+                self._peak = max(self._peak, len(self._inuse))
+                if waited:
+                    wait = _pool_clock() - start
+                    self._waits += 1
+                    self._waittime += wait
+                    self._maxwait = max(self._maxwait, wait)
+            return con
+
+    def release(self, con):
+        "Gives back a connection obtained from :meth:`acquire`"
+        with self._lock:
+            if con not in self._inuse:
+                raise ValueError("Connection is not checked out from this pool")
+        keep = True
+        try:
+            if not con.getautocommit():
+                con.cursor().execute("rollback")
+            if self.checkpoint:
+                self._releases += 1
+                if self._releases % self.checkpoint == 0:
+                    con.wal_checkpoint(mode=apsw.SQLITE_CHECKPOINT_PASSIVE)
+        except apsw.ConnectionClosedError:
+            keep = False
+        except apsw.Error:
+            # it is in an unknown state
+            keep = False
+        with self._lock:
+            self._accumulate()
+            self._inuse.discard(con)
+            if keep and not self._closed:
+                self._idle.append(con)
+            else:
+                self._discard(con)
+            self._lock.notify()
+
+    def connection(self, timeout=-1):
+        """Returns a context manager that acquires a connection and releases it
+        at the end of the block"""
+        return _PoolCheckout(self, timeout)
+
+    def close(self):
+        """Closes the idle connections.  Connections in use are closed when
+        they are released.  The pool can't be used afterwards."""
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            for con in idle:
+                self._discard(con)
+            self._lock.notify_all()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def stats(self):
+        """Returns a dict of metrics
+
+        size
+          Connections currently open
+        idle
+          Connections not in use
+        inuse
+          Connections in use
+        peak
+          Most connections in use at once
+        created / discarded
+          Connections opened and closed by the pool
+        checkouts
+          Successful :meth:`acquire` calls
+        waits
+          How many of those had to wait for a connection
+        wait_time / max_wait
+          Total and longest seconds spent waiting
+        timeouts
+          :meth:`acquire` calls that gave up
+        utilisation
+          Average fraction of *maxsize* connections in use since the
+          pool was created
+        """
+        with self._lock:
+            self._accumulate()
+            elapsed = self._lastchange - self._start
+            return {
+                "size": len(self._idle) + len(self._inuse),
+                "idle": len(self._idle),
+                "inuse": len(self._inuse),
+                "maxsize": self.maxsize,
+                "peak": self._peak,
+                "created": self._created,
+                "discarded": self._discarded,
+                "checkouts": self._checkouts,
+                "waits": self._waits,
+                "wait_time": self._waittime,
+                "max_wait": self._maxwait,
+                "timeouts": self._timeouts,
+                "utilisation": self._busyarea / (elapsed * self.maxsize) if elapsed > 0 else 0.0,
+            }
+
+
+class _PoolCheckout(object):
+    def __init__(self, pool, timeout):
+        self.pool = pool
+        self.timeout = timeout
+        self.con = None
+
+    def __enter__(self):
+        self.con = self.pool.acquire(self.timeout)
+        return self.con
+
+    def __exit__(self, *args):
+        con, self.con = self.con, None
+        self.pool.release(con)
+
+
+class ParallelReader(object):
+    """Runs read only queries split into partitions on several
+    connections at once
+
+    :param filename: Database filename
+    :param connections: How many connections and worker threads
+    :param setup: A callable or sequence of callables called with each
+      new connection
+    :param batchsize: Rows are sent from the workers in lists of this size
+    :param kwargs: Passed to :class:`Connection`.  *flags* defaults to
+      :const:`SQLITE_OPEN_READONLY`.
+
+    SQLite lets many connections read a database at the same time, and
+    APSW releases the GIL while SQLite is working, so a large scan or
+    aggregate split into parts can use several CPU cores.  This works
+    best with `WAL <https://sqlite.org/wal.html>`__ databases where
+    readers don't block and aren't blocked by writers.
+
+    Each partition is run in its own read transaction so if the
+    database is being changed the partitions may see different
+    versions of it.
+
+    .. code-block:: python
+
+        reader = apsw.ParallelReader("big.db", connections=4)
+        total = 0
+        for (subtotal, ) in reader.execute("select sum(price) from sales where {partition}",
+                                           reader.rowidpartitions("sales")):
+            total += subtotal
+    """
+
+    def __init__(self, filename, connections=4, setup=None, batchsize=1024, **kwargs):
+        if connections < 1:
+            raise ValueError("Need at least one connection")
+        kwargs.setdefault("flags", apsw.SQLITE_OPEN_READONLY)
+        if setup is None:
+            setup = []
+        elif callable(setup):
+            setup = [setup]
+        self.batchsize = batchsize
+        self._tasks = _pool_queue.Queue()
+        self._connections = []
+        self._threads = []
+        try:
+            for i in range(connections):
+                con = apsw.Connection(filename, **kwargs)
+                self._connections.append(con)
+                for s in setup:
+                    s(con)
+        except:
+            for con in self._connections:
+                con.close(True)
+            raise
+        for con in self._connections:
+            t = threading.Thread(target=self._worker, args=(con, ), name="apsw.ParallelReader worker")
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+
+    def _worker(self, con):
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                return
+            index, query, bindings, state = task
+            if state.cancelled:
+                continue
+            cursor = None
+            try:
+                cursor = con.cursor()
+                cursor.execute(query, bindings)
+                while True:
+                    batch = list(itertools.islice(cursor, self.batchsize))
+                    if batch and not state.put((index, batch, None)):
+                        break
+                    if len(batch) < self.batchsize:
+                        state.put((index, None, None))
+                        break
+            except BaseException as e:
+                state.put((index, None, e))
+            finally:
+                # ends the read transaction so an idle worker doesn't
+                # block checkpoints or writers
+                if cursor is not None:
+                    cursor.close(True)
+
+    def execute(self, query, partitions, bindings=None, ordered=False):
+        """Runs *query* once per partition returning an iterator of all
+        the resulting rows.
+
+        :param query: SQL containing ``{partition}`` which is replaced
+          by each partition
+        :param partitions: A sequence of SQL expressions, such as
+          those returned by :meth:`rowidpartitions`
+        :param bindings: Used for every partition
+        :param ordered: If False then rows are returned as soon as
+          they are available, otherwise in partition order
+
+        If any partition has an error then the remaining work is
+        abandoned and the exception is raised.
+        """
+        if not self._threads:
+            raise apsw.ConnectionClosedError("The reader has been closed")
+        queries = [query.replace("{partition}", "(" + p + ")") for p in partitions]
+        return self._results(queries, bindings, ordered)
+
+    def _results(self, queries, bindings, ordered):
+        # the work is only queued once iteration starts, otherwise an
+        # iterator that is never used would leave workers waiting
+        state = _ParallelState(len(self._connections) * 4)
+        for i, q in enumerate(queries):
+            self._tasks.put((i, q, bindings, state))
+        pending = {}
+        nextindex = 0
+        remaining = len(queries)
+        try:
+            while remaining:
+                index, batch, exc = state.results.get()
+                if exc is not None:
+                    raise exc
+                if batch is None:
+                    remaining -= 1
+                    if ordered:
+                        pending.setdefault(index, []).append(None)
+                elif not ordered:
+                    for row in batch:
+                        yield row
+                    continue
+                else:
+                    pending.setdefault(index, []).append(batch)
+                # send what we can in order
+                while nextindex in pending:
+                    batches = pending[nextindex]
+                    while batches and batches[0] is not None:
+                        for row in batches.pop(0):
+                            yield row
+                    if not batches:
+                        break
+                    del pending[nextindex]
+                    nextindex += 1
+        finally:
+            state.cancelled = True
+
+    def rowidpartitions(self, table, count=None, dbname="main"):
+        """Returns a list of expressions dividing *table* into *count*
+        (default four per connection) rowid ranges.  The first and
+        last are open ended so rows added later are still included."""
+        if count is None:
+            count = len(self._connections) * 4
+        quoted = "%s.%s" % (_pool_quote(dbname), _pool_quote(table))
+        (lo, hi), = list(self.execute("select min(rowid), max(rowid) from %s" % (quoted, ), ["1"]))
+        if lo is None or count < 2 or hi - lo < count:
+            return ["1"]
+        step = (hi - lo + count) // count
+        bounds = [lo + step * i for i in range(1, count)]
+        res = ["rowid < %d" % (bounds[0], )]
+        for a, b in zip(bounds, bounds[1:]):
+            res.append("rowid >= %d AND rowid < %d" % (a, b))
+        res.append("rowid >= %d" % (bounds[-1], ))
+        return res
+
+    def close(self):
+        """Stops the worker threads and closes the connections"""
+        threads, self._threads = self._threads, []
+        for t in threads:
+            self._tasks.put(None)
+        for t in threads:
+            t.join()
+        for con in self._connections:
+            con.close(True)
+        self._connections = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class _ParallelState(object):
+    # the results of one ParallelReader.execute call
+
+    def __init__(self, maxsize):
+        # bounded so workers don't get too far ahead of the consumer
+        self.results = _pool_queue.Queue(maxsize)
+        self.cancelled = False
+
+    def put(self, item):
+        # returns False if the consumer has gone away
+        while not self.cancelled:
+            try:
+                self.results.put(item, timeout=0.1)
+                return True
+            except _pool_queue.Full:
+                pass
+        return False
+
+
+def _pool_quote(name):
+    return '"' + name.replace('"', '""') + '"'
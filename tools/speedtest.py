@@ -20,6 +20,7 @@ write = sys.stdout.write
 if sys.version_info >= (3, ):
     xrange = range
     unichr = chr
+    unicode = str
 
 # Sigh
 try:
@@ -41,8 +42,21 @@ def doit():
     write("          Tests %s\n" % (", ".join(options.tests), ))
     write("     Iterations %d\n" % (options.iterations, ))
     write("Statement Cache %d\n" % (options.scsize, ))
+    write("  Row fast path %s\n" % (options.rowfastpath, ))
+    write("      UDF types %s\n" % (options.udftypes, ))
 
     write("\n")
+
+    # Short functions for the functions test so that the time is
+    # dominated by calling them.  The name, function, argument types
+    # and result type.
+    udfs = (
+        ("udf_int", lambda x: x + 1, (int, ), int),
+        ("udf_float", lambda x: x * 0.5, (float, ), float),
+        ("udf_text", lambda s: s[:4], (unicode, ), unicode),
+        ("udf_add", lambda a, b: a + b, (int, int), int),
+    )
+
     if options.apsw:
         import apsw
 
@@ -53,7 +67,13 @@ def doit():
 
         def apsw_setup(dbfile):
             con = apsw.Connection(dbfile, statementcachesize=options.scsize)
+            con.rowfastpath = options.rowfastpath
             con.createscalarfunction("number_name", number_name, 1)
+            for name, func, argtypes, returntype in udfs:
+                if options.udftypes:
+                    con.createscalarfunction(name, func, len(argtypes), argtypes=argtypes, returntype=returntype)
+                else:
+                    con.createscalarfunction(name, func, len(argtypes))
             return con
 
     if options.pysqlite:
@@ -69,6 +89,8 @@ def doit():
         def pysqlite_setup(dbfile):
             con = pysqlite.connect(dbfile, isolation_level=None, cached_statements=options.scsize)
             con.create_function("number_name", 1, number_name)
+            for name, func, argtypes, returntype in udfs:
+                con.create_function(name, len(argtypes), func)
             return con
     ones = ("zero", "one", "two", "three", "four", "five", "six", "seven", "eight", "nine", "ten", "eleven", "twelve",
             "thirteen", "fourteen", "fifteen", "sixteen", "seventeen", "eighteen", "nineteen")
@@ -286,6 +308,64 @@ def doit():
 
         yield ("SELECT count(*) FROM t1", )
 
+    def getwidelines(scale=50):
+        random.seed(0)
+
+        # A table with many columns of each type that is then read
+        # back in full several times.  The time is dominated by
+        # converting result rows into Python objects.
+        for i in """PRAGMA page_size=4096;
+      PRAGMA cache_size=8192;
+      PRAGMA locking_mode=EXCLUSIVE;
+      PRAGMA journal_mode = OFF;
+      PRAGMA temp_store = MEMORY""".split(";"):
+            yield (i, )
+
+        numcols = 40
+        yield ("CREATE TABLE wide(%s)" % (", ".join(["c%d" % (i, ) for i in range(numcols)]), ), )
+
+        yield ("BEGIN", )
+        for i in xrange(scale * 1000):
+            vals = []
+            for col in range(numcols):
+                r = random.randint(0, 500000)
+                kind = col % 4
+                if kind == 0:
+                    vals.append("%d" % (r, ))
+                elif kind == 1:
+                    vals.append(repr(r / 7.0))
+                elif kind == 2:
+                    vals.append("'%s'" % (number_name(r), ))
+                else:
+                    vals.append("x'%08x'" % (r, ))
+            yield ("INSERT INTO wide VALUES(%s)" % (", ".join(vals), ), )
+        yield ("COMMIT", )
+
+        for i in xrange(10):
+            yield ("SELECT * FROM wide", )
+
+    def getfunctionlines(scale=50):
+        random.seed(0)
+
+        # A narrow table read back several times calling a short
+        # function on each column of each row.
+        for i in """PRAGMA page_size=4096;
+      PRAGMA cache_size=8192;
+      PRAGMA locking_mode=EXCLUSIVE;
+      PRAGMA journal_mode = OFF;
+      PRAGMA temp_store = MEMORY""".split(";"):
+            yield (i, )
+
+        yield ("CREATE TABLE funcs(i, f, t)", )
+        yield ("BEGIN", )
+        for i in xrange(scale * 2000):
+            r = random.randint(0, 5000)
+            yield ("INSERT INTO funcs VALUES(%d, %r, '%s')" % (r, r / 7.0, number_name(r)), )
+        yield ("COMMIT", )
+
+        for i in xrange(10):
+            yield ("SELECT sum(udf_int(i)), sum(udf_float(f)), max(udf_text(t)), sum(udf_add(i, i)) FROM funcs", )
+
     # Do a correctness test first
     if options.correctness:
         write("Correctness test\n")
@@ -295,6 +375,10 @@ def doit():
             withbindings = [line for line in getlines(scale=1, bindings=True)]
         if 'statements_nobindings' in options.tests:
             withoutbindings = [line for line in getlines(scale=1, bindings=False)]
+        if 'widerows' in options.tests:
+            widelines = [line for line in getwidelines(scale=1)]
+        if 'functions' in options.tests:
+            funclines = [line for line in getfunctionlines(scale=1)]
 
         res = {}
         for driver in ('apsw', 'pysqlite'):
@@ -329,6 +413,10 @@ def doit():
                     sql = withbindings
                 elif test == 'statements_nobindings':
                     sql = withoutbindings
+                elif test == 'widerows':
+                    sql = widelines
+                elif test == 'functions':
+                    sql = funclines
 
                 l = []
                 for s in sql:
@@ -347,6 +435,8 @@ def doit():
     text = None
     withbindings = None
     withoutbindings = None
+    widelines = None
+    funclines = None
 
     if options.dump_filename or "bigstmt" in options.tests:
         text = ";\n".join([x[0] for x in getlines(scale=options.scale)]) + ";"  # pysqlite requires final semicolon
@@ -360,6 +450,12 @@ def doit():
     if "statements_nobindings" in options.tests:
         withoutbindings = list(getlines(scale=options.scale, bindings=False))
 
+    if "widerows" in options.tests:
+        widelines = list(getwidelines(scale=options.scale))
+
+    if "functions" in options.tests:
+        funclines = list(getfunctionlines(scale=options.scale))
+
     # Each test returns the amount of time taken.  Note that we include
     # the close time as well.  Otherwise the numbers become a function of
     # cache and other collection sizes as freeing members gets deferred to
@@ -402,6 +498,22 @@ def doit():
         "pysqlite individual statements without bindings"
         return pysqlite_statements(con, withoutbindings)
 
+    def apsw_widerows(con):
+        "APSW rows with many columns"
+        return apsw_statements(con, widelines)
+
+    def pysqlite_widerows(con):
+        "pysqlite rows with many columns"
+        return pysqlite_statements(con, widelines)
+
+    def apsw_functions(con):
+        "APSW user defined functions"
+        return apsw_statements(con, funclines)
+
+    def pysqlite_functions(con):
+        "pysqlite user defined functions"
+        return pysqlite_statements(con, funclines)
+
     # Do the work
     write("\nRunning tests - elapsed, CPU (results in seconds, lower is better)\n")
 
@@ -484,6 +596,16 @@ parser.add_option(
     help=
     "Size of the statement cache. APSW will disable cache with value of zero.  Pysqlite ensures a minimum of 5 [Default %default]"
 )
+parser.add_option("--row-fast-path",
+                  dest="rowfastpath",
+                  action="store_true",
+                  default=False,
+                  help="Use APSW's row conversion fast path (Connection.rowfastpath) [Default %default]")
+parser.add_option("--udf-types",
+                  dest="udftypes",
+                  action="store_true",
+                  default=False,
+                  help="Declare argument and result types of APSW user defined functions [Default %default]")
 parser.add_option("--unicode",
                   dest="unicode",
                   type="int",
@@ -533,6 +655,22 @@ statements_nobindings:
   In theory all the tests above should run in almost identical time
   as well as when using the SQLite command line shell.  This tool
   shows you what happens in practise.
+
+widerows:
+
+  Fills a table that has 40 columns of integers, floats, strings and
+  blobs and then reads all of it back several times.  Most of the
+  time goes in converting result rows.  Use --row-fast-path to
+  compare APSW's row conversion fast path against converting a
+  column at a time.
+
+functions:
+
+  Fills a table with integers, floats and strings and then reads it
+  back several times calling a short user defined function on each
+  value.  Most of the time goes in calling the functions and
+  converting their arguments and results.  Use --udf-types to compare
+  declaring the argument and result types with APSW.
     \n"""
 
 if __name__ == "__main__":